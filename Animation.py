@@ -1,5 +1,10 @@
 import imageio
 import Art
+import ColourSpace
+from collections import OrderedDict
+from PIL import Image, GifImagePlugin
+import numpy as np
+from Fill import pixels_to_array
 
 class Animation():
     def __init__(self, frame_list):
@@ -22,4 +27,249 @@ class Animation():
         for frame in self.frames:
             images.append(imageio.imread(frame))
 
-        imageio.mimsave(fname, images)
\ No newline at end of file
+        imageio.mimsave(fname, images)
+
+class ArtAnimation():
+    """
+    Animation made of Art frames that share a palette.
+    Frames are stored as keyframes plus a Delta from the previous frame,
+    so memory is proportional to the pixels that change between frames.
+    """
+    def __init__(self, frames=None, keyframe_interval=16, cache_size=8):
+        self.keyframe_interval = keyframe_interval
+        self.cache_size = cache_size
+        self.palette = None
+        self.image_size = None
+        self.keyframes = {} #frame index: Art
+        self.diffs = [] #Delta from the previous frame, or None for keyframes
+        self.current_frame = None
+        self._cache = OrderedDict()
+        for art in frames or []:
+            self.append(art)
+
+    def __len__(self):
+        return len(self.diffs)
+
+    def _diff(self, old_art, new_art):
+        """Delta of pixels that differ between two frames"""
+        delta = Art.Delta()
+        for y, (old_row, new_row) in enumerate(zip(old_art.pixels, new_art.pixels)):
+            if old_row == new_row:
+                continue
+            for x, (old, new) in enumerate(zip(old_row, new_row)):
+                if old != new:
+                    delta.record(x, y, old, new)
+        return delta
+
+    def _store(self, index, art):
+        """Store a frame as a keyframe or as a diff from the previous frame"""
+        self._cache.pop(index, None)
+        if index % self.keyframe_interval == 0:
+            self.keyframes[index] = art.copy()
+            self.diffs[index] = None
+            return
+        delta = self._diff(self.get_frame(index-1), art)
+        width, height = self.image_size
+        if len(delta) > width*height//4:
+            #Too many changes for a diff to be worth it
+            self.keyframes[index] = art.copy()
+            self.diffs[index] = None
+        else:
+            self.keyframes.pop(index, None)
+            self.diffs[index] = delta
+
+    def append(self, art):
+        """Add a frame to the end of the animation"""
+        if self.palette is None:
+            self.palette = art.palette
+            self.image_size = (len(art.pixels[0]), len(art.pixels))
+        self.diffs.append(None)
+        self._store(len(self.diffs)-1, art)
+
+    def set_frame(self, index, art):
+        """Replace a frame, updating the diff of the frame after it"""
+        next_frame = self.get_frame(index+1) if index+1 < len(self) else None
+        self._store(index, art)
+        #Later frames are reconstructed from this one, so drop them from the cache
+        for cached_index in [i for i in self._cache if i > index]:
+            del self._cache[cached_index]
+        if next_frame is not None:
+            self._store(index+1, next_frame)
+
+    def get_frame(self, index):
+        """
+        Reconstruct a frame as a new Art object.
+        Replays diffs from the nearest cached frame or keyframe before it.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        start = index
+        while start not in self._cache and start not in self.keyframes:
+            start -= 1
+        art = (self._cache[start] if start in self._cache else self.keyframes[start]).copy()
+        for frame_index in range(start+1, index+1):
+            self.diffs[frame_index].redo(art.pixels)
+        art.palette = self.palette
+
+        self._cache[index] = art.copy()
+        self._cache.move_to_end(index)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return art
+
+    def get_next_frame(self):
+        if self.current_frame == None:
+            self.current_frame = 0
+        else:
+            self.current_frame = (self.current_frame+1)% len(self)
+        return self.get_frame(self.current_frame)
+
+    def changed_bounds(self, index):
+        """Rectangle (x, y, width, height) that changed since the previous frame"""
+        if self.diffs[index] is None:
+            return (0, 0) + self.image_size
+        return self.diffs[index].bounds()
+
+    def _gif_colours(self):
+        """
+        (lookup, rgb): an array mapping palette indices to GIF colour numbers,
+        and the GIF's colours. A GIF holds at most 256 colours, so larger
+        palettes are cut down to the colours the frames actually use.
+        """
+        rgb = ColourSpace.palette_rgb(self.palette)
+        if len(rgb) <= 256:
+            return np.arange(len(rgb), dtype=np.uint8), rgb
+        used = set()
+        for art in self.keyframes.values():
+            used.update(np.unique(pixels_to_array(art.pixels)).tolist())
+        for delta in self.diffs:
+            if delta is not None:
+                used.update(np.unique(delta.arrays()[3]).tolist())
+        if len(used) > 256:
+            raise ValueError("GIFs can only hold 256 colours, but the frames use {}".format(len(used)))
+        used = sorted(used)
+        lookup = np.zeros(len(rgb), dtype=np.uint8)
+        lookup[used] = np.arange(len(used))
+        return lookup, rgb[used]
+
+    def _palette_image(self, pixels, scalar, lookup, rgb):
+        """Render a 2d array of palette indices as a palette ("P") image at scalar size"""
+        height, width = pixels.shape
+        img = Image.frombytes("P", (width, height), lookup[pixels].tobytes())
+        img.putpalette(rgb.tobytes())
+        return img.resize((width*scalar, height*scalar), Image.NEAREST)
+
+    def export_as_gif(self, fname, scalar=1, duration=100):
+        """
+        Export as an animated GIF.
+        Frames are written to the file one at a time: keyframes in full and
+        diff frames cropped to the diff's bounds, drawn over the previous
+        frame at that offset. Only one frame is held in memory.
+        Raises ValueError if the frames use more than 256 colours.
+        """
+        if not len(self):
+            return
+        lookup, rgb = self._gif_colours()
+        art = self.get_frame(0)
+        frame = pixels_to_array(art.pixels)
+        first = self._palette_image(frame, scalar, lookup, rgb)
+        header, _ = GifImagePlugin.getheader(first, info={"loop": 0})
+        with open(fname, "wb") as f:
+            f.write(b"".join(header))
+            for index in range(len(self)):
+                delta = self.diffs[index]
+                if index == 0:
+                    img, offset = first, (0, 0)
+                elif delta is None:
+                    frame = pixels_to_array(self.keyframes[index].pixels)
+                    img, offset = self._palette_image(frame, scalar, lookup, rgb), (0, 0)
+                else:
+                    xs, ys, old, new = delta.arrays()
+                    frame[ys, xs] = new
+                    #An unchanged frame still needs a (single pixel) image for its duration
+                    x, y, width, height = delta.bounds() or (0, 0, 1, 1)
+                    img, offset = self._palette_image(frame[y:y+height, x:x+width], scalar, lookup, rgb), (x*scalar, y*scalar)
+                #Disposal 1 keeps the previous frame under the cropped one
+                for data in GifImagePlugin.getdata(img, offset, duration=duration, disposal=1):
+                    f.write(data)
+            f.write(b";")
+
+class OnionSkin():
+    """
+    Shows neighbouring frames of an ArtAnimation faintly under the frame
+    being edited.
+
+    The previous and following frames are blended into a "ghost" layer, the
+    nearest at `opacity` and each further frame at `falloff` times the one
+    before. The ghost layer only depends on the other frames, so it is
+    built once per active frame and cached; drawing on the active frame
+    only needs the colours of the changed cells recomputed.
+    """
+    def __init__(self, animation, previous=1, following=1, opacity=0.4, falloff=0.5, cache_size=4):
+        self.animation = animation
+        self.previous = previous
+        self.following = following
+        self.opacity = opacity
+        self.falloff = falloff
+        self.cache_size = cache_size
+        self._backgrounds = OrderedDict()
+
+    def _neighbours(self, index):
+        """(frame index, weight) of each ghost frame, furthest first"""
+        frames = []
+        for distance in range(max(self.previous, self.following), 0, -1):
+            weight = self.opacity * self.falloff**(distance-1)
+            if distance <= self.previous and index-distance >= 0:
+                frames.append((index-distance, weight))
+            if distance <= self.following and index+distance < len(self.animation):
+                frames.append((index+distance, weight))
+        return frames
+
+    def background(self, index):
+        """
+        The ghost layer for a frame as (colour, alpha) arrays of shape
+        (height, width, 3) and (height, width, 1), with colour premultiplied by alpha.
+        """
+        if index in self._backgrounds:
+            self._backgrounds.move_to_end(index)
+            return self._backgrounds[index]
+        width, height = self.animation.image_size
+        colour = np.zeros((height, width, 3), dtype=np.float32)
+        alpha = np.zeros((height, width, 1), dtype=np.float32)
+        palette = ColourSpace.palette_rgb(self.animation.palette).astype(np.float32)
+        #Layer the nearest frames on top of the furthest ones
+        for frame_index, weight in self._neighbours(index):
+            frame = palette[pixels_to_array(self.animation.get_frame(frame_index).pixels)]
+            colour = colour*(1-weight) + frame*weight
+            alpha = alpha*(1-weight) + weight
+        self._backgrounds[index] = (colour, alpha)
+        while len(self._backgrounds) > self.cache_size:
+            self._backgrounds.popitem(last=False)
+        return colour, alpha
+
+    def invalidate(self, frame_index=None):
+        """
+        Forget cached ghost layers that include frame_index (or all of them),
+        e.g. after that frame has been changed with set_frame.
+        """
+        if frame_index is None:
+            self._backgrounds.clear()
+            return
+        for index in list(self._backgrounds):
+            if index-self.previous <= frame_index <= index+self.following:
+                del self._backgrounds[index]
+
+    def composite(self, index, art):
+        """The art, drawn over the ghost layer of frame index, as an (height, width, 3) uint8 array"""
+        colour, alpha = self.background(index)
+        active = art.palette_rgb()[pixels_to_array(art.pixels)].astype(np.float32)
+        return np.round(active*(1-alpha) + colour).astype(np.uint8)
+
+    def composite_cells(self, index, art, cells):
+        """Composited "#rrggbb" colours for a list of (x, y) cells, e.g. the cells in a Delta"""
+        if not cells:
+            return []
+        colour, alpha = self.background(index)
+        xs, ys = np.array(cells).T
+        active = art.palette_rgb()[[art.pixels[y][x] for x, y in cells]].astype(np.float32)
+        return ColourSpace.rgb_to_hex(np.round(active*(1-alpha[ys, xs]) + colour[ys, xs]))
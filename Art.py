@@ -1,18 +1,55 @@
+import base64
 import copy
+import io
 import os
-import math
 import requests
 #from lxml import html
-import colorsys
+import numpy as np
 from urllib.parse import urlparse
 #For image exporting
 from PIL import Image, ImageDraw
 import json
 from bs4 import BeautifulSoup
+from Pixels import SparsePixels, SparseRow, PackedPixels, BIT_DEPTHS, bit_depth_for, iter_row_runs, write_cells
+from Symmetry import Symmetry
+from PngStream import PngStreamWriter
+import ColourSpace
+import zlib
+from itertools import chain
+from Fill import fill_mask, pixels_to_array
+
+def atomic_write(filename, write_function):
+    """
+    Call write_function with a temporary filename, then rename the temporary
+    file over filename. A crash part way through never leaves a half-written file.
+    """
+    temp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        write_function(temp_filename)
+        with open(temp_filename, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+#Output size (in pixels) above which PNG exports are streamed in bands
+BANDED_EXPORT_PIXELS = 4096*4096
+
+#Where the existing image is kept when the canvas is resized, as fractions of the added space
+ANCHORS = {
+    "top-left": (0, 0), "top": (0.5, 0), "top-right": (1, 0),
+    "left": (0, 0.5), "centre": (0.5, 0.5), "right": (1, 0.5),
+    "bottom-left": (0, 1), "bottom": (0.5, 1), "bottom-right": (1, 1),
+}
 
 class Art():
-    """Contains palette and pixel data"""
-    def __init__(self, palette=None, image_size=(16, 16), pixels=None):
+    """
+    Contains palette and pixel data.
+    Pixels are packed into as few bits per pixel as the palette size allows;
+    sparse stores them as runs instead, and packed=False as a list of rows.
+    """
+    def __init__(self, palette=None, image_size=(16, 16), pixels=None, sparse=False, packed=True):
         self.image_size = image_size
         if not palette:
             #Greyscale palette by default
@@ -30,49 +67,178 @@ class Art():
 
         if not pixels:
             #Image is square of palette colour 0 by default.
-            self.pixels = [[0 for x in range(image_size[0])] for y in range(image_size[1])]
+            if sparse:
+                self.pixels = SparsePixels(image_size[0], image_size[1])
+            elif packed:
+                self.pixels = PackedPixels(image_size[0], image_size[1], bit_depth_for(len(self.palette)))
+            else:
+                self.pixels = [[0 for x in range(image_size[0])] for y in range(image_size[1])]
+        elif sparse and not isinstance(pixels, SparsePixels):
+            self.pixels = SparsePixels.from_rows(pixels)
+        elif packed and isinstance(pixels, list):
+            self.pixels = self._packed_pixels(pixels)
         else:
             self.pixels = pixels
 
+        #Histogram of palette indexes, built on first use
+        self._colour_index = None
+
+    @property
+    def sparse(self):
+        """Whether the pixels are stored as runs rather than a full grid"""
+        return isinstance(self.pixels, SparsePixels)
+
+    @property
+    def packed(self):
+        """Whether the pixels are bit-packed to suit the palette size"""
+        return isinstance(self.pixels, PackedPixels)
+
+    def _packed_pixels(self, rows):
+        #Pack a list of rows, with enough bits for the palette and every index used
+        array = pixels_to_array(rows)
+        used = int(array.max()) + 1 if array.size else 0
+        return PackedPixels.from_array(array, bit_depth_for(max(len(self.palette), used)))
+
+    def fit_bit_depth(self, palette_size=None):
+        """
+        Repack packed pixels at the smallest bit depth that holds the palette
+        (or palette_size colours, if more) and every index in use.
+        Call after changing the palette size.
+        """
+        if self.packed:
+            used = max(self.colour_index.used(), default=-1) + 1
+            self.pixels.set_bit_depth(bit_depth_for(max(len(self.palette), palette_size or 0, used)))
+
+    def resize_palette(self, size):
+        """
+        Change the number of colours in the palette. New colours are spread
+        around the colour wheel; pixels of removed colours become colour 0.
+        Pixels held as a list of rows are packed once the palette grows past
+        the default 8 colours. Returns a Delta of the pixels that changed.
+        """
+        if not 1 <= size <= 1 << BIT_DEPTHS[-1]:
+            raise ValueError("Palettes must have between 1 and {} colours".format(1 << BIT_DEPTHS[-1]))
+        changes = {}
+        for index in self.colour_index.used():
+            if index >= size:
+                changes.update(self.replace_colour(index, 0).changes)
+        for index in [index for index in self.palette if index >= size]:
+            del self.palette[index]
+        added = size - len(self.palette)
+        if added > 0:
+            hsv = np.stack([np.arange(added)/added, np.full(added, 0.6), np.full(added, 0.9)], axis=1)
+            for index, colour in zip(range(len(self.palette), size), ColourSpace.rgb_to_hex(ColourSpace.hsv_to_rgb(hsv))):
+                self.palette[index] = colour
+        if size > 8 and isinstance(self.pixels, list):
+            self.pixels = self._packed_pixels(self.pixels)
+        self.fit_bit_depth()
+        return Delta(changes)
+
+    @property
+    def colour_index(self):
+        """
+        ColourIndex of pixel counts and bounding boxes per palette index.
+        Built with one scan on first use, then kept up to date by set_pixel,
+        apply_tool, apply_delta and the region operations.
+        """
+        if self._colour_index is None:
+            self._colour_index = ColourIndex(self.pixels)
+        return self._colour_index
+
+    def invalidate_colour_index(self):
+        """Call after modifying self.pixels directly"""
+        self._colour_index = None
+
+    def _indexed(self, delta):
+        #Update the colour index with a Delta and pass it through
+        if self._colour_index is not None:
+            self._colour_index.apply(delta)
+        return delta
+
     def sort_palette(self):
         """Sort the colour palette.
         Sorting colours is actually really hard so this does its best."""
 
-        def step_sort(r,g,b, repetitions=1):
-            """Set up sorting function"""
-            lum = math.sqrt( .241 * r + .691 * g + .068 * b )
-            h, s, v = colorsys.rgb_to_hsv(r,g,b)
-            h2 = int(h * repetitions)
-            lum2 = int(lum * repetitions)
-            v2 = int(v * repetitions)
-            if h2 % 2 == 1:
-                v2 = repetitions - v2
-                lum2 = repetitions - lum2
-            return (h2, lum2, v2)
-
-        colours_as_list = [self.html_colour_to_rgb(self.palette[index]) for index in self.palette]
-        sorted_colours = sorted(colours_as_list, key= lambda rgb: step_sort(*rgb,10))
+        repetitions = 10
+        keys = list(self.palette)
+        rgb = ColourSpace.hex_to_rgb([self.palette[key] for key in keys])
+        #Step sort: hue bands, alternating direction of luminosity and value
+        r, g, b = rgb.astype(np.float64).T
+        lum = np.sqrt(.241*r + .691*g + .068*b)
+        h2 = (ColourSpace.rgb_to_hsv(rgb)[:, 0] * repetitions).astype(int)
+        lum2 = (lum * repetitions).astype(int)
+        v2 = rgb.max(axis=1).astype(int) * repetitions
+        odd = h2 % 2 == 1
+        v2[odd] = repetitions - v2[odd]
+        lum2[odd] = repetitions - lum2[odd]
+        order = np.lexsort((v2, lum2, h2))
+        sorted_colours = ColourSpace.rgb_to_hex(rgb[order])
         old_palette = copy.copy(self.palette)
-        old_pixels = copy.deepcopy(self.pixels)
 
         #Actually sort the palette
         for key in self.palette:
-            self.palette[key] = self.rgb_colour_to_html(*sorted_colours[key])
+            self.palette[key] = sorted_colours[key]
         
         #Update the pixel value to the new indexes
-        for old_index in old_palette:
-            colour = old_palette[old_index]
-            new_index = [k for k,v in self.palette.items() if v.lower()==colour.lower()][0]
-            for y, row in enumerate(old_pixels):
-                for x, index in enumerate(row):
-                    if index == old_index:
-                        self.pixels[y][x] = new_index
-        
+        first_index = {}
+        for key, colour in self.palette.items():
+            first_index.setdefault(colour, key)
+        new_indexes = {old_index: first_index[colour.lower()] for old_index, colour in old_palette.items()}
+        self._remap_pixels(new_indexes)
+
+    def _remap_pixels(self, new_indexes):
+        """Change every pixel to new_indexes[pixel] in a single pass"""
+        for y, row in enumerate(self.pixels):
+            old_row = row[:]
+            new_row = [new_indexes.get(index, index) for index in old_row]
+            if new_row != old_row:
+                self.pixels[y][:] = new_row
+        if self._colour_index is not None:
+            self._colour_index.remap(new_indexes)
+
+    def replace_colour(self, old_symbol, new_symbol):
+        """
+        Replace every pixel of one palette index with another.
+        Only the bounding box of old_symbol is visited.
+        """
+        bounds = self.colour_index.bounds(old_symbol, self.pixels)
+        if not bounds or old_symbol == new_symbol:
+            return Delta()
+        return self.replace_colour_in_region(*bounds, old_symbol, new_symbol)
+
+    def unused_colours(self):
+        """List of palette indexes that are not used by any pixel"""
+        return [index for index in self.palette if not self.colour_index.count(index)]
+
+    def compact_palette(self):
+        """
+        Remove unused colours from the palette and renumber the rest so they
+        are contiguous. Only pixels of renumbered colours are rewritten.
+        Returns a dict of {old_index: new_index}.
+        """
+        used = [index for index in sorted(self.palette) if self.colour_index.count(index)]
+        new_indexes = {old_index: new_index for new_index, old_index in enumerate(used)}
+        #Renumbering in ascending order never overwrites a colour that is still to be moved
+        for old_index in used:
+            if new_indexes[old_index] != old_index:
+                self.replace_colour(old_index, new_indexes[old_index])
+        self.palette = {new_indexes[index]: self.palette[index] for index in used}
+        return new_indexes
         
     def set_pixel(self, x, y, colour):
         """Set a pixel at a given coordinate"""
-        self.pixels[x][y] = colour
+        if self.packed and colour > self.pixels.max_value:
+            self.fit_bit_depth(colour+1)
+        old = self.pixels[y][x]
+        self.pixels[y][x] = colour
+        if self._colour_index is not None and old != colour:
+            self._colour_index.remove(x, y, old)
+            self._colour_index.add(x, y, colour)
         
+    def palette_rgb(self):
+        """The palette as a read-only (n, 3) uint8 array, row i being the colour of index i"""
+        return ColourSpace.palette_rgb(self.palette)
+
     def html_colour_to_rgb(self, html_colour):
         """Convert a html colour code to an rgb triple"""
         r, g, b = html_colour[1:3], html_colour[3:5], html_colour[5:]
@@ -91,8 +257,13 @@ class Art():
 
     def export_to_image_file(self, filename, scalar=10, transparent_palette_index=None):
         """
-        Export the current image to a file
+        Export the current image to a file.
+        Large PNG exports are written in bands by export_to_png_banded.
         """
+        width, height = len(self.pixels[0]), len(self.pixels)
+        if os.path.splitext(filename)[1] == ".png" and width*height*scalar*scalar > BANDED_EXPORT_PIXELS:
+            return self.export_to_png_banded(filename, scalar, transparent_palette_index)
+
         format_colour_modes = {
             ".jpg": "RGB",
             ".png": "RGBA",
@@ -100,43 +271,107 @@ class Art():
         }
         
         colour_mode = format_colour_modes[os.path.splitext(filename)[1]]
+        self.render_image(scalar, transparent_palette_index, colour_mode).save(filename)
+
+    def render_image(self, scalar=10, transparent_palette_index=None, colour_mode="RGBA"):
+        """Render the art as a PIL Image, scaled up by scalar"""
         #Create blank image
-        img = Image.new(colour_mode, (len(self.pixels[1]), len(self.pixels[0])))
+        img = Image.new(colour_mode, (len(self.pixels[0]), len(self.pixels)))
         d = ImageDraw.Draw(img)
-        #Add each individual pixel to the image
-        for xn, x in enumerate(self.pixels):
-            for yn, y in enumerate(x):
-                if y != transparent_palette_index or not "A" in colour_mode:
-                    d.point((yn,xn), fill=(self.html_colour_to_rgb(self.palette[y])))
+        colours = [tuple(rgb) for rgb in self.palette_rgb().tolist()]
+        #Draw each run of same-coloured pixels in the image
+        for yn, row in enumerate(self.pixels):
+            xn = 0
+            for index, length in iter_row_runs(row):
+                if index != transparent_palette_index or not "A" in colour_mode:
+                    d.line([(xn, yn), (xn+length-1, yn)], fill=colours[index])
+                xn += length
         
-        img = img.resize((scalar*img.size[0], scalar*img.size[1]))
+        return img.resize((scalar*img.size[0], scalar*img.size[1]), Image.NEAREST)
 
-        img.save(filename)
+    def export_to_bytes(self, image_format="png", scalar=10, transparent_palette_index=None):
+        """Export the current image to an in-memory file, returned as bytes"""
+        colour_mode = "RGBA" if image_format.lower() == "png" else "RGB"
+        output = io.BytesIO()
+        self.render_image(scalar, transparent_palette_index, colour_mode).save(output, format=image_format)
+        return output.getvalue()
+
+    def export_to_png_banded(self, filename, scalar=10, transparent_palette_index=None, band_bytes=8*1024*1024, workers=None):
+        """
+        Export to a PNG in horizontal bands that are rendered and compressed
+        on a pool of worker threads and streamed to the file.
+        Peak memory is about band_bytes per worker, whatever the output size.
+        """
+        width, height = len(self.pixels[0]), len(self.pixels)
+        rgba = np.full((len(self.palette_rgb()), 4), 255, dtype=np.uint8)
+        rgba[:, :3] = self.palette_rgb()
+        if transparent_palette_index in self.palette:
+            rgba[transparent_palette_index] = 0
+        colours = [colour.tobytes() for colour in rgba]
+        #Number of source rows in each band
+        band_rows = max(1, band_bytes // (width*scalar*4*scalar))
+
+        def render_band(band_start):
+            rows = []
+            for y in range(band_start, min(height, band_start+band_rows)):
+                line = b"".join(colours[index]*(length*scalar) for index, length in iter_row_runs(self.pixels[y]))
+                rows.extend([line]*scalar)
+            return rows
+
+        writer = PngStreamWriter(filename, width*scalar, height*scalar, alpha=True, workers=workers)
+        try:
+            for band_start in range(0, height, band_rows):
+                writer.add_band((min(height, band_start+band_rows) - band_start)*scalar,
+                                lambda band_start=band_start: render_band(band_start))
+        finally:
+            writer.close()
 
     def load_from_file(filename):
         """Load an Art object from a file""" #TODO: Implement pixel loading
-        components = {}
         with open(filename) as f:
-            for line in f:
-                key, value = line.split(", ")
-                components[key] = value.strip()
+            return Art.read_from(f)
+
+    def read_from(lines):
+        """Load an Art object from the lines of a .pxlart file"""
+        components = {}
+        for line in lines:
+            key, value = line.split(", ")
+            components[key] = value.strip()
 
         #Load palette
         palette = {}
         for colour_index, colour in enumerate(components["palette"].split(" ")):
             palette[colour_index] = colour.strip()
-        #Load image size
-        size = (int(components["size"]), int(components["size"]))
+        #Load image size, either "16" for square art or "width height"
+        size = [int(n) for n in components["size"].split(" ")]
+        size = (size[0], size[-1])
+
+        #Load pixels stored as runs
+        if "runs" in components:
+            runs = (token.split(":") for token in components["runs"].split(" ") if token)
+            pixels = SparsePixels.from_runs(size[0], size[1], ((int(v), int(n)) for v, n in runs))
+            return Art(palette=palette, image_size=size, pixels=pixels)
+
+        #Load bit-packed pixels: "bit_depth base64(zlib(packed rows))"
+        if "packed" in components:
+            bit_depth, data = components["packed"].split(" ")
+            data = zlib.decompress(base64.b64decode(data))
+            pixels = PackedPixels.from_bytes(size[0], size[1], int(bit_depth), data)
+            return Art(palette=palette, image_size=size, pixels=pixels)
 
         #Load pixels
         pixels = [int(pixel.strip()) for pixel in components["pixels"].split(" ")]
         pixels = [pixels[i:i+size[0]] for i in range(0, len(pixels), size[0])]
-        print(pixels)
             
         return Art(palette=palette, image_size=size, pixels=pixels)
 
     def load_palette_from_file(self, filename):
         """Change the palette to one that is loaded from a file."""
+        self.palette = Art.read_palette_file(filename)
+        self.fit_bit_depth()
+
+    def read_palette_file(filename):
+        """Read just the palette from a file, without loading the pixels"""
         components = {}
         palette = {}
         with open(filename) as f:
@@ -147,25 +382,299 @@ class Art():
                     for colour_index, colour in enumerate(value.split(" ")):
                         palette[colour_index] = colour.strip()      
                     break    
-        
-        self.palette = palette
+        return palette
 
     def save_to_file(self, filename):
-        """Save the art to a file"""
+        """
+        Save the art to a file.
+        Sparse art is written as "value:count" runs so the file size
+        is proportional to the drawn content, and packed art as its
+        compressed packed rows.
+        The file is replaced atomically so a crash can't corrupt an existing save.
+        """
+        atomic_write(filename, self._write_to_file)
+
+    def _write_to_file(self, filename):
         with open(filename, "w") as f:
-            #Size
-            f.write("size, {}\n".format(len(self.pixels)))
-            #Palette
-            colours = " ".join([self.palette[index] for index in self.palette])
-            f.write("palette, {}\n".format(colours))
-            #Pixels
+            self.write_to(f)
+
+    def write_to(self, f):
+        """Write the art in the .pxlart format to an open text file"""
+        #Size
+        width, height = len(self.pixels[0]), len(self.pixels)
+        if width == height:
+            f.write("size, {}\n".format(width))
+        else:
+            f.write("size, {} {}\n".format(width, height))
+        #Palette
+        colours = " ".join([self.palette[index] for index in self.palette])
+        f.write("palette, {}\n".format(colours))
+        #Pixels
+        if self.sparse:
+            f.write("runs,")
+            for value, length in self.pixels.runs():
+                f.write(" {}:{}".format(value, length))
+            f.write("\n")
+        elif self.packed:
+            data = base64.b64encode(zlib.compress(self.pixels.data.tobytes())).decode("ascii")
+            f.write("packed, {} {}\n".format(self.pixels.bit_depth, data))
+        else:
             pixels = " ".join([str(pixel) for pixel_row in self.pixels for pixel in pixel_row])
             f.write("pixels, {}\n".format(pixels))
     
     def copy(self):
         """Get a new instance of this art object"""
-        new_pixels = copy.deepcopy(self.pixels)
-        return Art(self.palette, self.image_size, new_pixels )
+        #Rows only hold ints, so copying each row is enough
+        new_pixels = self.pixels.copy() if isinstance(self.pixels, (SparsePixels, PackedPixels)) else [row[:] for row in self.pixels]
+        return Art(self.palette, self.image_size, new_pixels, packed=self.packed)
+
+    def apply_tool(self, tool, location, symbol):
+        """Activate a tool on this art and return the resulting Delta"""
+        if self.packed and symbol > self.pixels.max_value:
+            self.fit_bit_depth(symbol+1)
+        try:
+            delta = tool.activate(location, self.pixels, symbol)
+        except IndexError:
+            self.invalidate_colour_index()
+            raise
+        if delta is None:
+            #Tool doesn't report its changes, so the index can't be trusted
+            self.invalidate_colour_index()
+            return Delta()
+        return self._indexed(delta)
+
+    def apply_delta(self, delta, undo=False):
+        """Re-apply (or undo) a previously recorded Delta, writing each changed row once"""
+        xs, ys, old, new = delta.arrays()
+        target = old if undo else new
+        if self.packed and len(target) and target.max() > self.pixels.max_value:
+            self.fit_bit_depth(int(target.max())+1)
+        current = write_cells(self.pixels, xs, ys, target)
+        if self._colour_index is not None:
+            changed = current != target
+            self._colour_index.apply_arrays(xs[changed], ys[changed], current[changed], target[changed])
+
+    def _clip_rect(self, x, y, width, height):
+        """Clip a rectangle to the canvas. Returns (x0, y0, x1, y1) with exclusive ends"""
+        x0, y0 = max(0, x), max(0, y)
+        x1 = min(len(self.pixels[0]), x+width)
+        y1 = min(len(self.pixels), y+height)
+        return x0, y0, max(x0, x1), max(y0, y1)
+
+    def _write_rows(self, x, y, rows, delta, transparent_index=None):
+        """
+        Write a block of rows with its top-left corner at (x, y),
+        one row slice at a time. Changes are recorded in delta.
+        """
+        if self.packed:
+            #e.g. a clipboard copied before the palette was made smaller
+            largest = max((max(row) for row in rows if len(row)), default=0)
+            if largest > self.pixels.max_value:
+                self.fit_bit_depth(largest+1)
+        for row_offset, new_row in enumerate(rows):
+            yn = y + row_offset
+            if not 0 <= yn < len(self.pixels):
+                continue
+            #Clip the row to the canvas
+            start = max(0, -x)
+            stop = min(len(new_row), len(self.pixels[yn]) - x)
+            if start >= stop:
+                continue
+            pixel_row = self.pixels[yn]
+            old_values = pixel_row[x+start:x+stop]
+            new_values = list(new_row[start:stop])
+            if transparent_index is not None:
+                new_values = [o if n == transparent_index else n for o, n in zip(old_values, new_values)]
+            if old_values == new_values:
+                continue
+            for xn, (old, new) in enumerate(zip(old_values, new_values), x+start):
+                if old != new:
+                    delta.record(xn, yn, old, new)
+            pixel_row[x+start:x+stop] = new_values
+        return delta
+
+    def copy_region(self, x, y, width, height):
+        """Copy a rectangle of pixels into a list of rows (a clipboard)"""
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        return [self.pixels[yn][x0:x1] for yn in range(y0, y1)]
+
+    def paste(self, rows, x, y, transparent_index=None):
+        """
+        Paste a list of rows with the top-left at (x, y).
+        Pixels equal to transparent_index are not pasted.
+        """
+        return self._indexed(self._write_rows(x, y, rows, Delta(), transparent_index))
+
+    def fill_rect(self, x, y, width, height, symbol):
+        """Fill a rectangle with a single palette index"""
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        return self._indexed(self._write_rows(x0, y0, [[symbol]*(x1-x0)]*(y1-y0), Delta()))
+
+    def move_region(self, x, y, width, height, dx, dy, fill_symbol=0):
+        """Move a rectangle by (dx, dy), leaving fill_symbol behind"""
+        rows = self.copy_region(x, y, width, height)
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        delta = self._write_rows(x0, y0, [[fill_symbol]*(x1-x0)]*(y1-y0), Delta())
+        return self._indexed(self._write_rows(x0+dx, y0+dy, rows, delta))
+
+    def flip_region(self, x, y, width, height, horizontal=True):
+        """Mirror a rectangle left-to-right (horizontal) or top-to-bottom"""
+        rows = self.copy_region(x, y, width, height)
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        if horizontal:
+            rows = [row[::-1] for row in rows]
+        else:
+            rows = rows[::-1]
+        return self._indexed(self._write_rows(x0, y0, rows, Delta()))
+
+    def rotate_region(self, x, y, width, height, clockwise=True, fill_symbol=0):
+        """
+        Rotate a rectangle by 90 degrees around its top-left corner.
+        Non-square regions swap width and height; uncovered pixels become fill_symbol.
+        """
+        rows = self.copy_region(x, y, width, height)
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        if clockwise:
+            rotated = [list(row) for row in zip(*rows[::-1])]
+        else:
+            rotated = [list(row) for row in zip(*rows)][::-1]
+        delta = Delta()
+        if len(rotated) != y1-y0 or (rotated and len(rotated[0]) != x1-x0):
+            self._write_rows(x0, y0, [[fill_symbol]*(x1-x0)]*(y1-y0), delta)
+        return self._indexed(self._write_rows(x0, y0, rotated, delta))
+
+    def replace_colour_in_region(self, x, y, width, height, old_symbol, new_symbol):
+        """Replace one palette index with another inside a rectangle"""
+        rows = self.copy_region(x, y, width, height)
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        rows = [[new_symbol if p == old_symbol else p for p in row] for row in rows]
+        return self._indexed(self._write_rows(x0, y0, rows, Delta()))
+
+    def _new_art(self, rows, width, height):
+        """New Art with the same palette and pixel store as this one"""
+        if self.sparse:
+            pixels = SparsePixels(width, 0)
+            pixels.rows = [row if isinstance(row, SparseRow) else SparseRow.from_values(row) for row in rows]
+            pixels.height = height
+        elif self.packed:
+            pixels = PackedPixels.from_rows(rows, self.pixels.bit_depth)
+        else:
+            pixels = [list(row) for row in rows] if rows else [[]]
+        return Art(dict(self.palette), (width, height), pixels, packed=self.packed)
+
+    def _reframe(self, width, height, offset_x, offset_y, fill_symbol=0):
+        """
+        New Art of size (width, height) with this art's top-left corner
+        placed at (offset_x, offset_y). Used by crop, pad and resize_canvas.
+        """
+        if width < 1 or height < 1:
+            raise ValueError("Art must be at least 1x1, not {}x{}".format(width, height))
+        old_width, old_height = len(self.pixels[0]), len(self.pixels)
+        #Visible part of each source row
+        sx0 = max(0, -offset_x)
+        sx1 = max(sx0, min(old_width, width - offset_x))
+        left = min(width, max(0, offset_x))
+        right = max(0, width - left - (sx1 - sx0))
+        rows = []
+        for ny in range(height):
+            sy = ny - offset_y
+            if not 0 <= sy < old_height:
+                rows.append(SparseRow(width, fill_symbol) if self.sparse else [fill_symbol]*width)
+            elif self.sparse:
+                runs = [(fill_symbol, left)] + list(self.pixels[sy].runs(sx0, sx1)) + [(fill_symbol, right)]
+                rows.append(SparseRow.from_runs(width, runs))
+            else:
+                rows.append([fill_symbol]*left + self.pixels[sy][sx0:sx1] + [fill_symbol]*right)
+        return self._new_art(rows, width, height)
+
+    def crop(self, x, y, width, height):
+        """
+        New Art containing only the given rectangle, clipped to the canvas.
+        Raises ValueError if nothing of it is on the canvas.
+        """
+        x0, y0, x1, y1 = self._clip_rect(x, y, width, height)
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError("Crop rectangle ({}, {}, {}, {}) has no pixels on the {}x{} canvas".format(
+                x, y, width, height, len(self.pixels[0]), len(self.pixels)))
+        return self._reframe(x1-x0, y1-y0, -x0, -y0)
+
+    def pad(self, left=0, top=0, right=0, bottom=0, fill_symbol=0):
+        """New Art with extra pixels added around the edges"""
+        width = len(self.pixels[0]) + left + right
+        height = len(self.pixels) + top + bottom
+        return self._reframe(width, height, left, top, fill_symbol)
+
+    def resize_canvas(self, width, height, anchor="top-left", fill_symbol=0):
+        """
+        New Art with a different canvas size, keeping the image at full scale.
+        anchor is where the existing image is kept: "top-left", "top", "top-right",
+        "left", "centre", "right", "bottom-left", "bottom" or "bottom-right".
+        """
+        old_width, old_height = len(self.pixels[0]), len(self.pixels)
+        if anchor not in ANCHORS:
+            raise ValueError("Unknown anchor: {}".format(anchor))
+        ax, ay = ANCHORS[anchor]
+        offset_x = int((width - old_width) * ax)
+        offset_y = int((height - old_height) * ay)
+        return self._reframe(width, height, offset_x, offset_y, fill_symbol)
+
+    def scale(self, factor_x, factor_y=None):
+        """New Art scaled up by whole-number factors using nearest neighbour"""
+        factor_y = factor_x if factor_y is None else factor_y
+        width, height = len(self.pixels[0])*factor_x, len(self.pixels)*factor_y
+        rows = []
+        for row in self.pixels:
+            scaled_runs = [(value, length*factor_x) for value, length in iter_row_runs(row)]
+            if self.sparse:
+                scaled = SparseRow.from_runs(width, scaled_runs)
+            else:
+                scaled = []
+                for value, length in scaled_runs:
+                    scaled.extend([value]*length)
+            rows.append(scaled)
+            rows.extend(scaled.copy() for _ in range(factor_y-1))
+        return self._new_art(rows, width, height)
+
+    def resize_nearest(self, width, height):
+        """New Art resampled to any size using nearest neighbour"""
+        old_width, old_height = len(self.pixels[0]), len(self.pixels)
+        x_map = [x*old_width//width for x in range(width)]
+        rows, previous_sy, previous_row = [], None, None
+        for y in range(height):
+            sy = y*old_height//height
+            if sy != previous_sy:
+                source = self.pixels[sy][:]
+                previous_row = [source[sx] for sx in x_map]
+                previous_sy = sy
+            rows.append(list(previous_row))
+        return self._new_art(rows, width, height)
+
+    def scale2x(self):
+        """
+        New Art at double size using the Scale2x/EPX algorithm,
+        which keeps diagonal edges sharp instead of making blocky steps.
+        """
+        source = [row[:] for row in self.pixels]
+        width, height = len(source[0]), len(source)
+        rows = []
+        for y, row in enumerate(source):
+            above = source[y-1] if y > 0 else row
+            below = source[y+1] if y < height-1 else row
+            left = row[:1] + row[:-1]
+            right = row[1:] + row[-1:]
+            top_row, bottom_row = [], []
+            for p, a, b, c, d in zip(row, above, right, left, below):
+                if a != d and c != b:
+                    top_row.append(a if c == a else p)
+                    top_row.append(b if a == b else p)
+                    bottom_row.append(c if d == c else p)
+                    bottom_row.append(d if b == d else p)
+                else:
+                    top_row.extend((p, p))
+                    bottom_row.extend((p, p))
+            rows.append(top_row)
+            rows.append(bottom_row)
+        return self._new_art(rows, width*2, height*2)
 
     def load_palette_from_url(self, url):
         """
@@ -180,6 +689,7 @@ class Art():
                 for index in new_palette:
                     print("Loading {} into index {}".format(new_palette[index], index))
                     self.palette[index] = new_palette[index]
+                self.fit_bit_depth()
                 return True
         else:
             print("Unsupported URL: {}".format(url))
@@ -187,25 +697,64 @@ class Art():
             return False
 
 class PaletteLoader():
+    colormind_url = "http://colormind.io/api/"
+
     def __init__(self):
         self.supported_sites = {
             "colormind.io": lambda url: self.load_random_from_colormind(),
             "colourlovers.com": lambda url: self.load_from_colourlovers(url),
             "color-hex.com": lambda url: self.load_from_color_hex(url),
         }
+        #How to request and parse each site, shared with the async loader
+        self.site_requests = {
+            "colormind.io": (self.colormind_request, self.parse_colormind),
+            "colourlovers.com": (self.colourlovers_request, self.parse_colourlovers),
+            "color-hex.com": (self.color_hex_request, self.parse_color_hex),
+        }
+
+    def get_site(self, url):
+        """The supported site that a url belongs to, or None"""
+        for site in self.site_requests:
+            if site in url:
+                return site
+        return None
+
+    def colormind_request(self, url=None):
+        """(method, url, keyword arguments) of the request for a random colormind palette"""
+        return ("GET", self.colormind_url, {"data": '{"model": "default"}'})
+
+    def parse_colormind(self, response):
+        return dict(enumerate(ColourSpace.rgb_to_hex(response.json()['result'])))
+
+    def colourlovers_request(self, url):
+        return ("GET", "{}/{}".format(url.replace("/palette","/api/palette"), "/?format=json"), {})
+
+    def parse_colourlovers(self, response):
+        palette = {}
+        for index, colour in enumerate(response.json()[0]["colors"]):
+            palette[index] = "#{}".format(colour)
+        return palette
+
+    def color_hex_request(self, url):
+        return ("GET", url, {})
+
+    def parse_color_hex(self, response):
+        palette = {}
+        soup = BeautifulSoup(response.text, "lxml")
+        for index, palette_div in enumerate(soup.find_all("div", attrs={'class': 'palettecolordivc'})):
+            palette[index] = palette_div["title"]
+        return palette
 
     def load_random_from_colormind(self):
         """
         Load a random palette from colormind.io using the API
         """
         palette = {}
-        headers = '{"model": "default"}'
-        r = requests.get("http://colormind.io/api/", data=headers)
+        method, url, kwargs = self.colormind_request()
+        r = requests.request(method, url, **kwargs)
 
         if r.status_code == 200:
-            for index, rgb in enumerate(r.json()['result']):
-                palette[index] = Art().rgb_colour_to_html(*rgb)
-                print(index,rgb)
+            palette = self.parse_colormind(r)
         else:
             print("Failed api call: {} - {}".format(r, r.status_code))
 
@@ -215,11 +764,10 @@ class PaletteLoader():
     def load_from_colourlovers(self, url):
         """e.g colourlovers : "http://www.colourlovers.com/palette/49963/let_them_eat_cake" """
         palette = {}
-        api_url = "{}/{}".format(url.replace("/palette","/api/palette"), "/?format=json")
-        r = requests.get(api_url)
+        method, api_url, kwargs = self.colourlovers_request(url)
+        r = requests.request(method, api_url, **kwargs)
         if r.status_code == 200:
-            for index, colour in enumerate(r.json()[0]["colors"]):
-                palette[index] = "#{}".format(colour)
+            palette = self.parse_colourlovers(r)
 
         return palette
 
@@ -228,20 +776,272 @@ class PaletteLoader():
         e.g https://www.color-hex.com/color-palette/65513
         """
         palette = {}
-        r = requests.get(url)
+        method, url, kwargs = self.color_hex_request(url)
+        r = requests.request(method, url, **kwargs)
         if r.status_code == 200:
-            soup = BeautifulSoup(r.text, "lxml")
-            for index, palette_div in enumerate(soup.find_all("div", attrs={'class': 'palettecolordivc'})):
-                palette[index] = palette_div["title"]
+            palette = self.parse_color_hex(r)
         return palette
 
+def _group_by_value(xs, ys, values):
+    #Yield (value, xs, ys) for each distinct value
+    if not len(values):
+        return
+    first = values[0]
+    if (values == first).all():
+        yield int(first), xs, ys
+        return
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.diff(sorted_values)) + 1
+    for cells in np.split(order, starts):
+        yield int(values[cells[0]]), xs[cells], ys[cells]
+
+class ColourIndex():
+    """
+    Pixel count and bounding box for each palette index.
+    Bounding boxes only grow as pixels are added; when a pixel on the edge
+    of a box is removed the box is marked stale and shrunk on the next query.
+    """
+    def __init__(self, pixels):
+        self.counts = {}
+        self.boxes = {} #index: [x0, y0, x1, y1] inclusive
+        self.stale = set()
+        for y, row in enumerate(pixels):
+            x = 0
+            for index, length in iter_row_runs(row):
+                self.counts[index] = self.counts.get(index, 0) + length
+                self._grow(index, x, y, x+length-1, y)
+                x += length
+
+    def _grow(self, index, x0, y0, x1, y1):
+        box = self.boxes.get(index)
+        if box is None:
+            self.boxes[index] = [x0, y0, x1, y1]
+        else:
+            box[0], box[1] = min(box[0], x0), min(box[1], y0)
+            box[2], box[3] = max(box[2], x1), max(box[3], y1)
+
+    def count(self, index):
+        """Number of pixels using a palette index"""
+        return self.counts.get(index, 0)
+
+    def used(self):
+        """Sorted list of palette indexes used by at least one pixel"""
+        return sorted(index for index, count in self.counts.items() if count)
+
+    def add(self, x, y, index):
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self._grow(index, x, y, x, y)
+
+    def remove(self, x, y, index):
+        self.counts[index] -= 1
+        if not self.counts[index]:
+            del self.counts[index]
+            del self.boxes[index]
+            self.stale.discard(index)
+        else:
+            x0, y0, x1, y1 = self.boxes[index]
+            if x in (x0, x1) or y in (y0, y1):
+                self.stale.add(index)
+
+    def apply(self, delta, undo=False):
+        """Update the index with the changes in a Delta"""
+        xs, ys, old, new = delta.arrays()
+        if undo:
+            old, new = new, old
+        self.apply_arrays(xs, ys, old, new)
+
+    def apply_arrays(self, xs, ys, old, new):
+        """
+        Update the index for the pixels at (xs, ys) changing from old to new
+        (numpy arrays), a palette index at a time rather than a pixel at a time.
+        """
+        for index, index_xs, index_ys in _group_by_value(xs, ys, old):
+            self.counts[index] -= len(index_xs)
+            if not self.counts[index]:
+                del self.counts[index]
+                del self.boxes[index]
+                self.stale.discard(index)
+            else:
+                x0, y0, x1, y1 = self.boxes[index]
+                if ((index_xs == x0) | (index_xs == x1) | (index_ys == y0) | (index_ys == y1)).any():
+                    self.stale.add(index)
+        for index, index_xs, index_ys in _group_by_value(xs, ys, new):
+            self.counts[index] = self.counts.get(index, 0) + len(index_xs)
+            self._grow(index, int(index_xs.min()), int(index_ys.min()), int(index_xs.max()), int(index_ys.max()))
+
+    def remap(self, new_indexes):
+        """Rename palette indexes after the pixels have been remapped"""
+        counts, boxes = {}, {}
+        for index in self.counts:
+            new_index = new_indexes.get(index, index)
+            counts[new_index] = counts.get(new_index, 0) + self.counts[index]
+            if new_index in boxes:
+                self.stale.add(index)
+                x0, y0, x1, y1 = self.boxes[index]
+                box = boxes[new_index]
+                boxes[new_index] = [min(box[0], x0), min(box[1], y0), max(box[2], x1), max(box[3], y1)]
+            else:
+                boxes[new_index] = self.boxes[index]
+        self.stale = {new_indexes.get(index, index) for index in self.stale}
+        self.counts, self.boxes = counts, boxes
+
+    def bounds(self, index, pixels):
+        """
+        Bounding box of a palette index as (x, y, width, height),
+        or None if it isn't used. Stale boxes are shrunk by scanning inside them.
+        """
+        if index not in self.boxes:
+            return None
+        if index in self.stale:
+            x0, y0, x1, y1 = self.boxes[index]
+            xs, ys = [], []
+            for y in range(y0, y1+1):
+                row = pixels[y][x0:x1+1]
+                if index in row:
+                    ys.append(y)
+                    xs.append(x0 + row.index(index))
+                    xs.append(x1 - row[::-1].index(index))
+            self.boxes[index] = [min(xs), min(ys), max(xs), max(ys)]
+            self.stale.discard(index)
+        x0, y0, x1, y1 = self.boxes[index]
+        return (x0, y0, x1-x0+1, y1-y0+1)
+
+class Delta():
+    """
+    A record of pixel changes made by a single operation.
+    changes maps (x, y) to (old_symbol, new_symbol), so the operation
+    can be undone, redone and redrawn using only the changed pixels.
+    Fills are held as a block instead (see from_mask), which is only
+    turned into changes if something asks for them.
+    """
+    def __init__(self, changes=None):
+        self._changes = changes if changes else {}
+        #(x, y, mask, old values, new symbol), or None
+        self._block = None
+
+    @classmethod
+    def from_mask(cls, x, y, mask, old, new):
+        """
+        Delta for writing new wherever mask is set, with the mask's top left at (x, y).
+        old holds the previous value of each masked pixel, in row-major order.
+        """
+        delta = cls()
+        if len(old):
+            rows = np.flatnonzero(mask.any(axis=1))
+            columns = np.flatnonzero(mask.any(axis=0))
+            mask = mask[rows[0]:rows[-1]+1, columns[0]:columns[-1]+1]
+            delta._block = (x+int(columns[0]), y+int(rows[0]), mask, old, new)
+        return delta
+
+    @property
+    def changes(self):
+        if self._block is not None:
+            xs, ys, old, new = self.arrays()
+            self._changes = dict(zip(zip(xs.tolist(), ys.tolist()), zip(old.tolist(), new.tolist())))
+            self._block = None
+        return self._changes
+
+    def __len__(self):
+        if self._block is not None:
+            return len(self._block[3])
+        return len(self._changes)
+
+    def __bool__(self):
+        return self._block is not None or bool(self._changes)
+
+    def record(self, x, y, old, new):
+        """Record a single pixel change, keeping the original old value"""
+        changes = self.changes
+        if (x, y) in changes:
+            old = changes[(x, y)][0]
+        if old == new:
+            changes.pop((x, y), None)
+        else:
+            changes[(x, y)] = (old, new)
+
+    def cells(self):
+        """List of (x, y) locations that were changed"""
+        if self._block is not None:
+            xs, ys, old, new = self.arrays()
+            return list(zip(xs.tolist(), ys.tolist()))
+        return list(self._changes)
+
+    def bounds(self):
+        """Dirty rectangle as (x, y, width, height), or None if nothing changed"""
+        if self._block is not None:
+            x, y, mask, old, new = self._block
+            return (x, y, mask.shape[1], mask.shape[0])
+        if not self._changes:
+            return None
+        xs = [x for x, y in self._changes]
+        ys = [y for x, y in self._changes]
+        return (min(xs), min(ys), max(xs)-min(xs)+1, max(ys)-min(ys)+1)
+
+    def arrays(self):
+        """The changes as numpy arrays (xs, ys, old, new)"""
+        if self._block is not None:
+            x, y, mask, old, new = self._block
+            ys, xs = np.nonzero(mask)
+            return xs+x, ys+y, old.astype(np.int64), np.full(len(old), new, dtype=np.int64)
+        if not self._changes:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        count = 2*len(self._changes)
+        cells = np.fromiter(chain.from_iterable(self._changes), dtype=np.int64, count=count)
+        values = np.fromiter(chain.from_iterable(self._changes.values()), dtype=np.int64, count=count)
+        return cells[0::2], cells[1::2], values[0::2], values[1::2]
+
+    def undo(self, pixelgrid):
+        xs, ys, old, new = self.arrays()
+        write_cells(pixelgrid, xs, ys, old)
+
+    def redo(self, pixelgrid):
+        xs, ys, old, new = self.arrays()
+        write_cells(pixelgrid, xs, ys, new)
+
 class Tool():
     def __init__(self):
         pass
 
     def activate(self, location, pixelgrid, symbol):
-        #Modifies pixel grid in-place
-        pass
+        #Modifies pixel grid in-place and returns a Delta of the changes
+        return self._write(pixelgrid, self.get_locations(location, pixelgrid, symbol), symbol)
+
+    def get_locations(self, location, pixelgrid, symbol):
+        #Return the locations this tool would paint, without changing anything
+        return []
+
+    def _write(self, pixelgrid, locations, symbol):
+        #Write symbol to every location in one batch, returning a Delta
+        delta = Delta()
+        for x, y in locations:
+            old = pixelgrid[y][x]
+            if old != symbol:
+                pixelgrid[y][x] = symbol
+                delta.record(x, y, old, symbol)
+        return delta
+
+    def _write_mask(self, pixelgrid, array, mask, symbol, x=0, y=0):
+        #Write symbol wherever mask is set, one slice per changed row, returning a Delta
+        #array is the area of pixelgrid under the mask, whose top left is (x, y), and is updated too
+        changed = mask & (array != symbol)
+        ys, xs = np.nonzero(changed)
+        if not len(ys):
+            return Delta()
+        delta = Delta.from_mask(x, y, changed, array[changed], symbol)
+        array[changed] = symbol
+        if hasattr(pixelgrid, "set_block"):
+            #Packed stores repack the changed rows in one go
+            y0, y1 = ys[0], ys[-1]+1
+            pixelgrid.set_block(x, y+y0, array[y0:y1])
+            return delta
+        #Locations are in row-major order, so each row's changes are one block
+        row_ys, first = np.unique(ys, return_index=True)
+        last = np.append(first[1:], len(ys)) - 1
+        for yn, x0, x1 in zip(row_ys.tolist(), xs[first].tolist(), xs[last].tolist()):
+            pixelgrid[yn+y][x0+x:x1+x+1] = array[yn, x0:x1+1].tolist()
+        return delta
 
     def _get_neighbouring_locations(self, location, pixelgrid):
         #Return a list of neighbouring coordinates
@@ -256,86 +1056,169 @@ class Tool():
         for direction in (up, down, left, right):
             if min(direction) < 0:
                 continue
-            elif max(direction) >= len(pixelgrid):
+            elif direction[0] >= len(pixelgrid[0]) or direction[1] >= len(pixelgrid):
                 continue
             else:
                 nieghbours.append(direction)
         return nieghbours
 
-class MirroredPencil(Tool):
-    def __init__(self, axis="x"):
-        self.axis = axis
-
-    def activate(self, location, pixelgrid, symbol):
-        x, y = location[0], location[1]
-        pixelgrid[y][x] = symbol
+class SymmetryTool(Tool):
+    """Runs another tool's locations through a Symmetry in one batched write"""
+    def __init__(self, tool, symmetry):
+        self.tool = tool
+        self.symmetry = symmetry
 
-        if "y" in self.axis:
-            mirrored_x = len(pixelgrid[0])-1-x
-            print("mirroring to: ", mirrored_x, y)
-            pixelgrid[y][mirrored_x] = symbol
-        if "x" in self.axis:
-            mirrored_y = len(pixelgrid[1])-1-y
-            print("mirroring to: ", x, mirrored_y)
-            pixelgrid[mirrored_y][x] = symbol
-        if "xy" in self.axis or "yx" in self.axis:
-            pixelgrid[mirrored_y][mirrored_x] = symbol
+    def get_locations(self, location, pixelgrid, symbol):
+        locations = self.tool.get_locations(location, pixelgrid, symbol)
+        return self.symmetry.expand(locations, len(pixelgrid[0]), len(pixelgrid))
 
+class MirroredPencil(SymmetryTool):
+    def __init__(self, axis="x"):
+        self.axis = axis
+        super().__init__(Pencil(), Symmetry("xy" if "x" in axis and "y" in axis else axis))
 
 class Pencil(Tool):
     def __init__(self):
         pass
 
-    def activate(self, location, pixelgrid, symbol):
-        x, y = location[0], location[1]
-        pixelgrid[y][x] = symbol
+    def get_locations(self, location, pixelgrid, symbol):
+        return [location]
 
-class Bucket(Tool):
-    def __init__(self):
-        pass
+class ShapeTool(Tool):
+    """
+    Draws a shape from a start location, set with begin(), to the location
+    the tool is activated at. The shape is rasterised into a mask of its
+    bounding box and written in one batch, so it is a single Delta.
+    preview_shape names the canvas item used to preview it while dragging.
+    """
+    preview_shape = "line"
+
+    def __init__(self, filled=False):
+        self.filled = filled
+        self.start = None
+
+    def begin(self, location):
+        self.start = location
+
+    def get_mask(self, start, end):
+        #Return (x, y, mask) where mask is a bool array of the shape's bounding box at (x, y)
+        #Subclasses draw their shape; by default only the end pixel is painted
+        return end[0], end[1], np.ones((1, 1), dtype=bool)
+
+    def _get_clipped_mask(self, location, pixelgrid):
+        #The shape's mask, clipped to the canvas, or None if it is entirely outside
+        x, y, mask = self.get_mask(self.start if self.start is not None else location, location)
+        width, height = len(pixelgrid[0]), len(pixelgrid)
+        left, top = max(0, -x), max(0, -y)
+        right, bottom = min(mask.shape[1], width-x), min(mask.shape[0], height-y)
+        if left >= right or top >= bottom:
+            return None
+        return x+left, y+top, mask[top:bottom, left:right]
 
     def activate(self, location, pixelgrid, symbol):
-        x, y = location[0], location[1]
-        symbol_to_fill = pixelgrid[y][x]
-        visited_locations = []
-        locations_to_expand = [location]
+        clipped = self._get_clipped_mask(location, pixelgrid)
+        if clipped is None:
+            return Delta()
+        x, y, mask = clipped
+        h, w = mask.shape
+        if hasattr(pixelgrid, "get_block"):
+            array = pixelgrid.get_block(x, y, w, h)
+        else:
+            array = np.array([pixelgrid[yn][x:x+w] for yn in range(y, y+h)], dtype=np.int32)
+        return self._write_mask(pixelgrid, array, mask, symbol, x, y)
 
-        while len(locations_to_expand) > 0:
-            x, y = locations_to_expand[0]
+    def get_locations(self, location, pixelgrid, symbol):
+        clipped = self._get_clipped_mask(location, pixelgrid)
+        if clipped is None:
+            return []
+        x, y, mask = clipped
+        ys, xs = np.nonzero(mask)
+        return list(zip((xs+x).tolist(), (ys+y).tolist()))
 
-            if pixelgrid[y][x] == symbol_to_fill:
-                pixelgrid[y][x] = symbol
-                locations_to_expand = locations_to_expand + self._get_neighbouring_locations((x,y), pixelgrid)
-                locations_to_expand = [l for l in locations_to_expand if l not in visited_locations]
+def _shape_bounds(start, end):
+    #Top left corner and size of the rectangle with corners start and end
+    (x0, y0), (x1, y1) = start, end
+    return min(x0, x1), min(y0, y1), abs(x1-x0)+1, abs(y1-y0)+1
 
-            if (x,y) in locations_to_expand:
-                locations_to_expand.remove((x,y))
+class Line(ShapeTool):
+    """Straight line, with the same pixels as Bresenham's algorithm"""
+    preview_shape = "line"
 
-            visited_locations.append((x,y))
+    def get_mask(self, start, end):
+        x, y, w, h = _shape_bounds(start, end)
+        (x0, y0), (x1, y1) = start, end
+        dx, dy = x1-x0, y1-y0
+        steps = max(abs(dx), abs(dy))
+        i = np.arange(steps+1)
+        #Step along the major axis; the minor axis is rounded to the nearest pixel
+        def minor(d):
+            return np.sign(d) * ((2*i*abs(d) + steps) // (2*steps)) if steps else np.zeros_like(i)
+        xs = x0 + (i*np.sign(dx) if abs(dx) == steps else minor(dx))
+        ys = y0 + (i*np.sign(dy) if abs(dx) != steps else minor(dy))
+        mask = np.zeros((h, w), dtype=bool)
+        mask[ys-y, xs-x] = True
+        return x, y, mask
 
-class PartialBucket(Tool):
-    def __init__(self):
-        pass
+class Rectangle(ShapeTool):
+    """Rectangle outline, or a filled rectangle"""
+    preview_shape = "rectangle"
 
-    def activate(self, location, pixelgrid, symbol):
-        x, y = location[0], location[1]
-        symbol_to_fill = pixelgrid[y][x]
-        visited_locations = []
-        locations_to_expand = [location]
+    def get_mask(self, start, end):
+        x, y, w, h = _shape_bounds(start, end)
+        mask = np.ones((h, w), dtype=bool)
+        if not self.filled:
+            mask[1:-1, 1:-1] = False
+        return x, y, mask
+
+class Ellipse(ShapeTool):
+    """
+    Ellipse that fits the rectangle between the two locations, outlined or
+    filled. Like the midpoint algorithm, pixels whose centres fall inside the
+    ellipse are filled; the outline is the filled pixels next to an empty one.
+    """
+    preview_shape = "oval"
 
-        while len(locations_to_expand) > 0:
-            x, y = locations_to_expand[0]
+    def get_mask(self, start, end):
+        x, y, w, h = _shape_bounds(start, end)
+        #Half width of the ellipse on each row, measured at the pixel centres
+        dy = np.arange(h) - (h-1)/2
+        half = (w/2) * np.sqrt(1 - (dy/(h/2))**2)
+        #Every row has at least its middle pixel (or two)
+        half = np.maximum(half, ((w-1) % 2) / 2)
+        xs = np.arange(w) - (w-1)/2
+        mask = np.abs(xs)[np.newaxis, :] <= half[:, np.newaxis] + 1e-9
+        if not self.filled:
+            inside = np.zeros((h+2, w+2), dtype=bool)
+            inside[1:-1, 1:-1] = mask
+            interior = inside[:-2, 1:-1] & inside[2:, 1:-1] & inside[1:-1, :-2] & inside[1:-1, 2:]
+            mask &= ~interior
+        return x, y, mask
 
-            if pixelgrid[y][x] == symbol_to_fill:
-                if (x+y)%2==0:
-                    pixelgrid[y][x] = symbol
-                locations_to_expand = locations_to_expand + self._get_neighbouring_locations((x,y), pixelgrid)
-                locations_to_expand = [l for l in locations_to_expand if l not in visited_locations]
+class Bucket(Tool):
+    """
+    Fills the region connected to a location (or with contiguous=False, every
+    pixel of the same colour). See Fill.fill_mask for workers.
+    """
+    checkerboard = False
+
+    def __init__(self, contiguous=True, workers=None):
+        self.contiguous = contiguous
+        self.workers = workers
+
+    def _get_mask(self, location, array):
+        return fill_mask(array, location, self.contiguous, self.checkerboard, self.workers)
+
+    def activate(self, location, pixelgrid, symbol):
+        array = pixels_to_array(pixelgrid)
+        return self._write_mask(pixelgrid, array, self._get_mask(location, array), symbol)
 
-            if (x,y) in locations_to_expand:
-                locations_to_expand.remove((x,y))
+    def get_locations(self, location, pixelgrid, symbol):
+        ys, xs = np.nonzero(self._get_mask(location, pixels_to_array(pixelgrid)))
+        return list(zip(xs.tolist(), ys.tolist()))
 
-            visited_locations.append((x,y))
+class PartialBucket(Bucket):
+    """Bucket fill of every other pixel, in a checkerboard pattern"""
+    checkerboard = True
 
 def main():
     a = Art(image_size=(5,5))
@@ -0,0 +1,130 @@
+"""
+Batch colour conversions on numpy arrays.
+
+RGB colours are (n, 3) uint8 arrays. HSV is (n, 3) floats in [0, 1] (the
+same as colorsys) and Lab is (n, 3) floats. Hex strings ("#rrggbb") are only
+needed at the edges: files, the UI and palette websites.
+"""
+
+from functools import lru_cache
+import numpy as np
+
+#sRGB (D65) to CIE XYZ, and the D65 white point
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+XYZ_TO_RGB = np.linalg.inv(RGB_TO_XYZ)
+WHITE_POINT = np.array([0.95047, 1.0, 1.08883])
+
+def hex_to_rgb(colours):
+    """List of "#rrggbb" strings to an (n, 3) uint8 array"""
+    data = bytes.fromhex("".join(colour.strip()[1:7] for colour in colours))
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).copy()
+
+def rgb_to_hex(rgb):
+    """(n, 3) array of 0-255 values to a list of "#rrggbb" strings"""
+    data = np.clip(np.asarray(rgb), 0, 255).astype(np.uint8).reshape(-1, 3).tobytes().hex()
+    return ["#" + data[i:i+6] for i in range(0, len(data), 6)]
+
+@lru_cache(maxsize=64)
+def _palette_rgb(items):
+    rgb = np.zeros((max((index for index, _ in items), default=-1) + 1, 3), dtype=np.uint8)
+    if items:
+        indexes = [index for index, _ in items]
+        rgb[indexes] = hex_to_rgb([colour for _, colour in items])
+    rgb.flags.writeable = False
+    return rgb
+
+def palette_rgb(palette):
+    """
+    A palette dict of {index: "#rrggbb"} as an array where row i is the
+    colour of index i. Cached, so repeated calls with an unchanged palette are cheap.
+    """
+    return _palette_rgb(tuple(sorted(palette.items())))
+
+def rgb_to_hsv(rgb):
+    """
+    RGB to HSV, each in [0, 1]. Uses the same float64 operations as
+    colorsys.rgb_to_hsv on 0-255 values, so hue bands match it exactly.
+    """
+    rgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3)
+    maximum = rgb.max(axis=1)
+    minimum = rgb.min(axis=1)
+    chroma = maximum - minimum
+    safe_chroma = np.where(chroma == 0, 1, chroma)
+    rc, gc, bc = ((maximum[:, np.newaxis] - rgb) / safe_chroma[:, np.newaxis]).T
+    r, g, b = rgb.T
+    #Hue depends on which channel is the largest
+    hue = np.where(maximum == r, bc - gc,
+          np.where(maximum == g, 2.0 + rc - bc, 4.0 + gc - rc))
+    hue = np.where(chroma == 0, 0, (hue / 6.0) % 1.0)
+    saturation = np.where(maximum == 0, 0, chroma / np.where(maximum == 0, 1, maximum))
+    return np.stack([hue, saturation, maximum / 255], axis=1)
+
+def hsv_to_rgb(hsv):
+    """HSV in [0, 1] to RGB"""
+    hsv = np.asarray(hsv, dtype=np.float64).reshape(-1, 3)
+    h, s, v = hsv.T
+    sector = np.floor(h * 6).astype(int) % 6
+    f = h * 6 - np.floor(h * 6)
+    p, q, t = v * (1 - s), v * (1 - s * f), v * (1 - s * (1 - f))
+    choices = [
+        np.stack(channels, axis=1) for channels in
+        ((v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q))
+    ]
+    rgb = np.choose(sector[:, np.newaxis], choices)
+    return np.round(rgb * 255).astype(np.uint8)
+
+def rgb_to_lab(rgb):
+    """sRGB to CIE L*a*b* (D65)"""
+    rgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3) / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ RGB_TO_XYZ.T / WHITE_POINT
+    f = np.where(xyz > (6/29)**3, np.cbrt(xyz), xyz / (3 * (6/29)**2) + 4/29)
+    return np.stack([116*f[:, 1] - 16, 500*(f[:, 0] - f[:, 1]), 200*(f[:, 1] - f[:, 2])], axis=1)
+
+def lab_to_rgb(lab):
+    """CIE L*a*b* (D65) to sRGB, clipped to the sRGB gamut"""
+    lab = np.asarray(lab, dtype=np.float64).reshape(-1, 3)
+    fy = (lab[:, 0] + 16) / 116
+    f = np.stack([fy + lab[:, 1]/500, fy, fy - lab[:, 2]/200], axis=1)
+    xyz = np.where(f > 6/29, f**3, 3 * (6/29)**2 * (f - 4/29)) * WHITE_POINT
+    linear = np.clip(xyz @ XYZ_TO_RGB.T, 0, 1)
+    rgb = np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1/2.4) - 0.055)
+    return np.round(rgb * 255).astype(np.uint8)
+
+def relative_luminance(rgb):
+    """WCAG relative luminance of each colour"""
+    rgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3) / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    return linear @ RGB_TO_XYZ[1]
+
+def contrast_ratio(rgb1, rgb2):
+    """WCAG contrast ratio between pairs of colours (1 to 21)"""
+    l1, l2 = relative_luminance(rgb1), relative_luminance(rgb2)
+    return (np.maximum(l1, l2) + 0.05) / (np.minimum(l1, l2) + 0.05)
+
+def text_colours(rgb, saturation=0.99):
+    """
+    A readable text colour for each background colour: the inverted colour,
+    made fully saturated while keeping its hue and lightness.
+    """
+    inverted = 1 - np.asarray(rgb, dtype=np.float64).reshape(-1, 3) / 255
+    maximum = inverted.max(axis=1, keepdims=True)
+    minimum = inverted.min(axis=1, keepdims=True)
+    lightness = (maximum + minimum) / 2
+    chroma = maximum - minimum
+    target_chroma = saturation * (1 - np.abs(2*lightness - 1))
+    #Scaling each channel around the lightness keeps the hue and lightness
+    scaled = lightness + (inverted - lightness) * target_chroma / np.where(chroma == 0, 1, chroma)
+    #Greys have no hue; use red (hue 0)
+    grey = lightness + np.array([0.5, -0.5, -0.5]) * target_chroma
+    result = np.where(chroma == 0, grey, scaled)
+    return np.round(np.clip(result, 0, 1) * 255).astype(np.uint8)
+
+@lru_cache(maxsize=1024)
+def text_colour(colour):
+    """Cached text colour ("#rrggbb") to show on a background colour"""
+    return rgb_to_hex(text_colours(hex_to_rgb([colour])))[0]
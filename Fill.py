@@ -0,0 +1,177 @@
+"""
+Vectorised flood fill for large canvases.
+
+The pixels are turned into a numpy array and the pixels matching the target
+colour are split into horizontal runs. Runs that share a column on
+neighbouring rows are connected, and the connected runs are labelled with a
+vectorised union-find. With workers > 1, very large canvases can be split
+into strips that are labelled by worker processes reading the array from
+shared memory; the strips are then joined by merging labels across the strip
+boundaries.
+"""
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+#Worker processes are started on the first parallel fill and reused after that
+_pool = None
+_pool_workers = 0
+
+def pixels_to_array(pixelgrid):
+    """A pixel store (list of rows, SparsePixels or PackedPixels) as a 2d numpy array"""
+    if hasattr(pixelgrid, "to_array"):
+        return pixelgrid.to_array()
+    rows = getattr(pixelgrid, "rows", pixelgrid)
+    if rows and hasattr(rows[0], "starts"):
+        #Sparse rows: expand each row's runs
+        return np.stack([np.repeat(row.values, np.diff(row.starts + [row.width])) for row in rows]).astype(np.int32)
+    return np.array(pixelgrid, dtype=np.int32)
+
+def find_runs(mask, row_offset=0):
+    """Runs of True in each row of a 2d bool mask, as arrays of (rows, starts, stops)"""
+    height, width = mask.shape
+    padded = np.zeros((height, width+2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, stops = np.nonzero(edges == -1)
+    return rows + row_offset, starts, stops
+
+def overlapping_runs(rows, starts, stops, width):
+    """
+    Pairs of run numbers (above, below) for runs on neighbouring rows that
+    share at least one column. Runs must be in row-major order.
+    """
+    rows = rows.astype(np.int64)
+    start_keys = rows*width + starts
+    stop_keys = rows*width + stops
+    #Runs on the row above that end after this run starts and start before it ends
+    first = np.searchsorted(stop_keys, (rows-1)*width + starts, side="right")
+    last = np.searchsorted(start_keys, (rows-1)*width + stops, side="left")
+    counts = np.maximum(last - first, 0)
+    below = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    above = np.repeat(first, counts) + np.arange(counts.sum()) - offsets
+    return above, below
+
+def connected_labels(count, a, b):
+    """
+    Label count nodes so that every edge (a[i], b[i]) joins nodes with the
+    same label. Each label is the smallest node number in its component.
+    """
+    labels = np.arange(count)
+    while True:
+        label_a, label_b = labels[a], labels[b]
+        if np.array_equal(label_a, label_b):
+            return labels
+        #Hook the larger root onto the smaller, then jump pointers to the roots
+        low = np.minimum(label_a, label_b)
+        np.minimum.at(labels, label_a, low)
+        np.minimum.at(labels, label_b, low)
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+
+def label_runs(mask, row_offset=0):
+    """Runs of a mask, and a component label for each run"""
+    rows, starts, stops = find_runs(mask, row_offset)
+    above, below = overlapping_runs(rows, starts, stops, mask.shape[1])
+    return rows, starts, stops, connected_labels(len(rows), above, below)
+
+def runs_to_mask(shape, rows, starts, stops):
+    """A 2d bool mask that is True inside the given runs"""
+    height, width = shape
+    edges = np.zeros((height, width+1), dtype=np.int8)
+    edges[rows, starts] = 1
+    edges[rows, stops] = -1
+    return np.cumsum(edges, axis=1, dtype=np.int8)[:, :width].astype(bool)
+
+def _label_strip(shm_name, shape, dtype, row_start, row_stop, target):
+    """Worker process: label the runs of one strip of a shared array"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return label_runs(array[row_start:row_stop] == target, row_start)
+    finally:
+        shm.close()
+
+def get_pool(workers):
+    """The shared process pool, recreated if a different number of workers is asked for"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+@atexit.register
+def shutdown_pool():
+    """Stop the worker processes, if any were started"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+def label_runs_parallel(array, target, workers=None):
+    """
+    label_runs for array == target, with strips labelled in worker processes
+    that share the array's memory. Labels are merged across strip boundaries.
+    """
+    workers = workers or os.cpu_count() or 1
+    height = array.shape[0]
+    strip_rows = max(2, -(-height // workers))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    try:
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared[:] = array
+        pool = get_pool(workers)
+        futures = [pool.submit(_label_strip, shm.name, array.shape, array.dtype, row_start,
+                               min(height, row_start+strip_rows), target)
+                   for row_start in range(0, height, strip_rows)]
+        strips = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+    #Give each strip's labels their own range
+    label_offset = 0
+    for i, (rows, starts, stops, labels) in enumerate(strips):
+        strips[i] = (rows, starts, stops, labels + label_offset)
+        label_offset += len(rows)
+    rows, starts, stops, labels = (np.concatenate(parts) for parts in zip(*strips))
+    #Connect runs that touch across the boundary between two strips
+    boundary_rows = np.arange(strip_rows, height, strip_rows)
+    at_boundary = np.nonzero(np.isin(rows, boundary_rows) | np.isin(rows, boundary_rows-1))[0]
+    above, below = overlapping_runs(rows[at_boundary], starts[at_boundary], stops[at_boundary], array.shape[1])
+    merged = connected_labels(label_offset, labels[at_boundary[above]], labels[at_boundary[below]])
+    return rows, starts, stops, merged[labels]
+
+def fill_mask(array, location, contiguous=True, checkerboard=False, workers=None):
+    """
+    Bool mask of the pixels a bucket fill at location would paint.
+
+    contiguous: only pixels connected to location (otherwise every pixel of that colour)
+    checkerboard: only keep pixels where (x+y) is even, as PartialBucket does
+    workers: number of processes to label strips in. By default (None or 1)
+             the fill runs in this process; parallel labelling only pays off
+             for canvases of several million pixels
+    """
+    x, y = location
+    target = array[y, x]
+    if not contiguous:
+        mask = array == target
+    else:
+        if workers and workers > 1 and array.shape[0] >= 2*workers:
+            rows, starts, stops, labels = label_runs_parallel(array, target, workers)
+        else:
+            rows, starts, stops, labels = label_runs(array == target)
+        seed_run = np.nonzero((rows == y) & (starts <= x) & (stops > x))[0][0]
+        in_region = labels == labels[seed_run]
+        mask = runs_to_mask(array.shape, rows[in_region], starts[in_region], stops[in_region])
+    if checkerboard:
+        mask[0::2, 1::2] = False
+        mask[1::2, 0::2] = False
+    return mask
@@ -0,0 +1,132 @@
+import cProfile
+import functools
+import time
+from collections import deque
+
+class _NullTimer():
+    """Context manager that does nothing, used when instrumentation is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer():
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class Instrumentation():
+    """
+    Per-operation timers and counters.
+    Keeps the total count and time for each operation plus a rolling window
+    of recent timings for percentiles. When disabled, timer() returns a shared
+    no-op context manager so the cost is one attribute check.
+    """
+    def __init__(self, enabled=False, window=200):
+        self.enabled = enabled
+        self.window = window
+        self.counters = {}
+        self.totals = {}
+        self.recent = {}
+        self.profiler = None
+        self.profile_filename = None
+
+    def timer(self, name):
+        """Context manager that times the enclosed block as operation name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        """Record a single timing for an operation"""
+        self.counters[name] = self.counters.get(name, 0) + 1
+        self.totals[name] = self.totals.get(name, 0) + seconds
+        if name not in self.recent:
+            self.recent[name] = deque(maxlen=self.window)
+        self.recent[name].append(seconds)
+
+    def count(self, name, amount=1):
+        """Increase a counter without timing anything"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        self.counters, self.totals, self.recent = {}, {}, {}
+
+    def percentile(self, name, percent):
+        """Percentile of the recent timings for an operation, in seconds"""
+        timings = sorted(self.recent.get(name, ()))
+        if not timings:
+            return None
+        return timings[min(len(timings)-1, int(len(timings) * percent / 100))]
+
+    def stats(self, name):
+        """Summary of an operation's timings as a dict"""
+        count = self.counters.get(name, 0)
+        total = self.totals.get(name, 0)
+        recent = self.recent.get(name, ())
+        return {
+            "count": count,
+            "total": total,
+            "mean": total/count if count and recent else None,
+            "p50": self.percentile(name, 50),
+            "p90": self.percentile(name, 90),
+            "p99": self.percentile(name, 99),
+            "max": max(recent) if recent else None,
+        }
+
+    def summary_lines(self):
+        """One human-readable line per operation"""
+        lines = []
+        for name in sorted(self.counters):
+            s = self.stats(name)
+            if s["p50"] is None:
+                lines.append("{}: {}".format(name, s["count"]))
+            else:
+                lines.append("{}: n={} p50={:.1f}ms p90={:.1f}ms p99={:.1f}ms max={:.1f}ms".format(
+                    name, s["count"], s["p50"]*1000, s["p90"]*1000, s["p99"]*1000, s["max"]*1000))
+        return lines
+
+    def start_profile(self, filename):
+        """Start capturing a cProfile that is written to filename on stop_profile()"""
+        if self.profiler:
+            self.stop_profile()
+        self.profile_filename = filename
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self):
+        """Stop the cProfile capture and write it to disk. Returns the filename"""
+        if not self.profiler:
+            return None
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_filename)
+        self.profiler = None
+        return self.profile_filename
+
+def timed(name):
+    """
+    Decorator for methods of objects with an `instrumentation` attribute,
+    timing every call as operation name.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if not instrumentation.enabled:
+                return method(self, *args, **kwargs)
+            with instrumentation.timer(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
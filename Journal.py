@@ -0,0 +1,137 @@
+import os
+import numpy as np
+from Art import Art, atomic_write
+from Pixels import write_cells
+
+class Journal():
+    """
+    Crash-safe autosave for a document.
+
+    Edits are appended to "<document>.journal" as they happen. On the first
+    edit, and then every compact_every records, the current art is written to
+    "<document>.autosave" (atomically, via a temp file and rename) and the
+    journal is emptied, so recovery only has to load one snapshot and replay
+    a short journal. The document itself is only written when the user saves.
+
+    Each snapshot gets a new marker, written into the snapshot and as the
+    first line of the journal that follows it. Recovery only replays a
+    journal whose marker matches the snapshot, so a crash between writing a
+    snapshot (e.g. after a resize or palette sort) and emptying the journal
+    can't replay stale coordinates or palette indexes onto it.
+
+    Journal lines:
+        s marker                      snapshot this journal follows
+        d x y symbol x y symbol ...   pixels changed by one operation
+        p index #rrggbb               one palette colour changed
+    """
+    def __init__(self, document_filename, art, compact_every=500):
+        self.document_filename = document_filename
+        self.art = art
+        self.journal_filename = document_filename + ".journal"
+        self.snapshot_filename = document_filename + ".autosave"
+        self.compact_every = compact_every
+        self.records = 0
+        self._file = None
+        self._has_snapshot = False
+
+    @staticmethod
+    def exists(document_filename):
+        """Whether there are unsaved changes that can be recovered for a document"""
+        return os.path.exists(document_filename + ".autosave")
+
+    def _append(self, line):
+        if not self._has_snapshot:
+            #The art already includes this edit, replaying it again is harmless
+            self.compact()
+        elif self.records >= self.compact_every:
+            self.compact()
+        if self._file is None:
+            self._file = open(self.journal_filename, "a")
+        self._file.write(line + "\n")
+        self._file.flush()
+        self.records += 1
+
+    def record_delta(self, delta, undo=False):
+        """Append the pixel changes in a Delta (or its reverse, for undo)"""
+        if not delta:
+            return
+        xs, ys, old, new = delta.arrays()
+        cells = np.stack([xs, ys, old if undo else new], axis=1).ravel().tolist()
+        self._append("d " + " ".join(map(str, cells)))
+
+    def record_palette_colour(self, index, colour):
+        """Append a single palette colour change"""
+        self._append("p {} {}".format(index, colour))
+
+    def compact(self, art=None):
+        """
+        Write a full snapshot of the art and start an empty journal.
+        Pass art when the document's Art object has been replaced.
+        """
+        if art is not None:
+            self.art = art
+        self.close()
+        marker = os.urandom(8).hex()
+        def write_snapshot(filename):
+            with open(filename, "w") as f:
+                self.art.write_to(f)
+                f.write("journal, {}\n".format(marker))
+        def write_journal(filename):
+            with open(filename, "w") as f:
+                f.write("s {}\n".format(marker))
+        atomic_write(self.snapshot_filename, write_snapshot)
+        #Start the new journal only once the snapshot is safely on disk
+        atomic_write(self.journal_filename, write_journal)
+        self.records = 0
+        self._has_snapshot = True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Remove the snapshot and journal, e.g. after the document was saved"""
+        self.close()
+        for filename in (self.journal_filename, self.snapshot_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.records = 0
+        self._has_snapshot = False
+
+    @staticmethod
+    def recover(document_filename):
+        """
+        Rebuild the art from the last snapshot and journal of a document.
+        A partly written last line (from a crash mid-write) is ignored, as is
+        a journal that was written for a different snapshot. Changes outside
+        the canvas or palette are skipped.
+        """
+        with open(document_filename + ".autosave") as f:
+            lines = f.readlines()
+        art = Art.read_from(lines)
+        markers = [line.split(", ")[1].strip() for line in lines if line.startswith("journal, ")]
+        journal_filename = document_filename + ".journal"
+        if not os.path.exists(journal_filename):
+            return art
+        pixels = art.pixels
+        width, height = len(pixels[0]), len(pixels)
+        palette_indexes = list(art.palette)
+        with open(journal_filename) as f:
+            for line_number, line in enumerate(f):
+                if not line.endswith("\n"):
+                    break
+                tokens = line.split()
+                if line_number == 0 and markers and tokens != ["s", markers[0]]:
+                    #The crash came before this snapshot's journal was started
+                    break
+                if not tokens:
+                    continue
+                if tokens[0] == "d":
+                    values = np.array(tokens[1:], dtype=np.int64)
+                    xs, ys, symbols = values[:len(values)//3*3].reshape(-1, 3).T
+                    keep = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height) & np.isin(symbols, palette_indexes)
+                    write_cells(pixels, xs[keep], ys[keep], symbols[keep])
+                elif tokens[0] == "p" and int(tokens[1]) in art.palette:
+                    art.palette[int(tokens[1])] = tokens[2]
+        return art
@@ -0,0 +1,195 @@
+"""
+Fetch many palettes at once with asyncio.
+
+Usage:
+    python PaletteFetcher.py URL [URL ...] --output ./palettes
+
+Requests go through PaletteLoader's request builders and parsers, so any
+site PaletteLoader supports can be fetched here too.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from Art import Art, PaletteLoader
+
+class PaletteFetchError(Exception):
+    pass
+
+class RateLimiter():
+    """Spaces out requests so there are at most `rate` per second"""
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class PaletteFetcher():
+    """
+    Fetches palettes from urls concurrently.
+
+    At most max_concurrency requests are in flight, and each host gets at
+    most host_rate requests per second. Connection errors, timeouts, 429 and
+    5xx responses are retried up to `retries` times, waiting
+    backoff * 2**attempt seconds (plus jitter, or the Retry-After header).
+
+    requests is blocking, so each request runs on a thread pool and the
+    event loop only does the scheduling.
+    """
+    def __init__(self, max_concurrency=8, host_rate=2.0, retries=3, backoff=0.5, timeout=10, loader=None):
+        self.max_concurrency = max_concurrency
+        self.host_rate = host_rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.loader = loader or PaletteLoader()
+        self._limiters = {}
+        self._executor = None
+
+    def _get_limiter(self, url):
+        host = urlparse(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = RateLimiter(self.host_rate)
+        return self._limiters[host]
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            try:
+                return float(response.headers["Retry-After"])
+            except (KeyError, ValueError):
+                pass
+        return self.backoff * 2**attempt * (1 + random.random()/2)
+
+    async def _request(self, method, url, kwargs):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            await self._get_limiter(url).wait()
+            try:
+                response = await loop.run_in_executor(
+                    self._executor, lambda: requests.request(method, url, timeout=self.timeout, **kwargs))
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise PaletteFetchError("{}: {}".format(url, e))
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code == 200:
+                return response
+            if response.status_code != 429 and response.status_code < 500 or attempt == self.retries:
+                raise PaletteFetchError("{}: HTTP {}".format(url, response.status_code))
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def fetch(self, url):
+        """Fetch one palette as a dict of {index: "#rrggbb"}"""
+        site = self.loader.get_site(url)
+        if site is None:
+            raise PaletteFetchError("Unsupported URL: {}".format(url))
+        build_request, parse = self.loader.site_requests[site]
+        response = await self._request(*build_request(url))
+        try:
+            return parse(response)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise PaletteFetchError("{}: could not parse palette ({})".format(url, e))
+
+    async def fetch_iter(self, urls):
+        """
+        Async generator of (url, palette, error) in the order the fetches finish.
+        error is None on success, otherwise palette is None. error is usually
+        a PaletteFetchError, but unexpected exceptions are passed on as they are.
+        Only max_concurrency urls are being worked on at any time.
+        """
+        urls = list(urls)
+        queue = asyncio.Queue()
+        for url in urls:
+            queue.put_nowait(url)
+        results = asyncio.Queue()
+
+        async def worker():
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await results.put((url, await self.fetch(url), None))
+                except Exception as e:
+                    #Every url must produce a result, or the consumer waits forever
+                    await results.put((url, None, e))
+
+        #Limiters belong to the event loop they were first used in
+        self._limiters = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.max_concurrency, len(urls)))]
+        try:
+            for _ in urls:
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def fetch_all(self, urls):
+        """Blocking helper: {url: palette} for every url that loaded, and {url: error} for the rest"""
+        async def collect():
+            palettes, errors = {}, {}
+            async for url, palette, error in self.fetch_iter(urls):
+                if error is None:
+                    palettes[url] = palette
+                else:
+                    errors[url] = error
+            return palettes, errors
+        return asyncio.run(collect())
+
+def palette_filename(url, palette=None):
+    """
+    A file name for a palette, made from the end of its url. Urls without a
+    path (e.g. colormind.io, which gives a random palette each time) get a
+    hash of the palette's colours added so each palette has its own file.
+    """
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", urlparse(url).path.strip("/").replace("/", "_"))
+    if not name:
+        name = urlparse(url).netloc
+        if palette:
+            colours = " ".join(palette[index] for index in sorted(palette))
+            name += "_" + hashlib.sha1(colours.encode()).hexdigest()[:8]
+    return name + ".pxlart"
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch palettes from urls into a palette directory.")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--output", default="./palettes", help="Directory to save .pxlart palettes to")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--host-rate", type=float, default=2.0, help="Requests per second to each host")
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    fetcher = PaletteFetcher(max_concurrency=args.concurrency, host_rate=args.host_rate, retries=args.retries)
+    os.makedirs(args.output, exist_ok=True)
+
+    async def run():
+        async for url, palette, error in fetcher.fetch_iter(args.urls):
+            if error is not None:
+                print("Failed: {}".format(error))
+                continue
+            filename = os.path.join(args.output, palette_filename(url, palette))
+            Art(palette=palette, image_size=(1, 1)).save_to_file(filename)
+            print("Saved {} colours from {} to {}".format(len(palette), url, filename))
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import struct
+import numpy as np
+from Art import Art, atomic_write
+import ColourSpace
+
+INDEX_MAGIC = b"PXPL"
+INDEX_VERSION = 2
+
+#Distances are worked out for at most this many (query, library colour) pairs at a time
+DISTANCE_CHUNK = 1 << 22
+
+class PaletteLibrary():
+    """
+    Every palette in a directory of .pxlart files, parsed once and kept in a
+    compact binary index file inside the directory.
+
+    All colours are held in one packed (n, 3) uint8 array, with palette i
+    using colours[offsets[i]:offsets[i+1]], so searches over thousands of
+    palettes are a handful of numpy operations. refresh() only re-reads files
+    whose modification time or size has changed.
+    """
+    def __init__(self, directory="./palettes", index_filename=".palette_index"):
+        self.directory = directory
+        self.index_filename = os.path.join(directory, index_filename)
+        self.names = []
+        self.stats = [] #(mtime, size) of each file when it was read
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.colours = np.zeros((0, 3), dtype=np.uint8)
+        self._load_index()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _load_index(self):
+        """Read the binary index file if there is a valid one"""
+        try:
+            with open(self.index_filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        if data[:4] != INDEX_MAGIC or struct.unpack_from("<H", data, 4)[0] != INDEX_VERSION:
+            return
+        count, = struct.unpack_from("<I", data, 6)
+        position = 10
+        names, stats, palettes = [], [], []
+        try:
+            for _ in range(count):
+                name_length, = struct.unpack_from("<H", data, position)
+                position += 2
+                names.append(data[position:position+name_length].decode("utf-8"))
+                position += name_length
+                mtime, size, colour_count = struct.unpack_from("<dQI", data, position)
+                position += struct.calcsize("<dQI")
+                stats.append((mtime, size))
+                palettes.append(np.frombuffer(data, dtype=np.uint8, count=colour_count*3, offset=position).reshape(-1, 3))
+                position += colour_count*3
+        except (struct.error, ValueError, UnicodeDecodeError):
+            return
+        self._set_palettes(names, stats, palettes)
+
+    def _save_index(self):
+        parts = [INDEX_MAGIC, struct.pack("<HI", INDEX_VERSION, len(self.names))]
+        for i, name in enumerate(self.names):
+            encoded = name.encode("utf-8")
+            colours = self.palette_colours(i)
+            parts.append(struct.pack("<H", len(encoded)))
+            parts.append(encoded)
+            parts.append(struct.pack("<dQI", self.stats[i][0], self.stats[i][1], len(colours)))
+            parts.append(colours.tobytes())
+        def write(filename):
+            with open(filename, "wb") as f:
+                f.write(b"".join(parts))
+        atomic_write(self.index_filename, write)
+
+    def _set_palettes(self, names, stats, palettes):
+        self.names = names
+        self.stats = stats
+        lengths = [len(p) for p in palettes]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        self.colours = np.concatenate(palettes) if palettes else np.zeros((0, 3), dtype=np.uint8)
+
+    def refresh(self):
+        """
+        Bring the library up to date with the directory.
+        Unchanged files are not re-read. Returns True if anything changed.
+        """
+        if not os.path.isdir(self.directory):
+            return False
+        known = {name: i for i, name in enumerate(self.names)}
+        names, stats, palettes = [], [], []
+        changed = False
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.endswith(".pxlart"):
+                continue
+            stat = entry.stat()
+            file_stats = (stat.st_mtime, stat.st_size)
+            i = known.get(entry.name)
+            if i is not None and self.stats[i] == file_stats:
+                colours = self.palette_colours(i)
+            else:
+                try:
+                    palette = Art.read_palette_file(entry.path)
+                    colours = ColourSpace.hex_to_rgb([palette[k] for k in sorted(palette)])
+                except (OSError, ValueError, KeyError):
+                    continue
+                changed = True
+            names.append(entry.name)
+            stats.append(file_stats)
+            palettes.append(colours)
+        if changed or names != self.names:
+            self._set_palettes(names, stats, palettes)
+            self._save_index()
+            return True
+        return False
+
+    def palette_colours(self, i):
+        """Colours of palette number i as an (n, 3) array"""
+        return self.colours[self.offsets[i]:self.offsets[i+1]]
+
+    def get_palette(self, name):
+        """A palette as an Art palette dict of {index: "#rrggbb"}"""
+        i = self.names.index(name)
+        return dict(enumerate(ColourSpace.rgb_to_hex(self.palette_colours(i))))
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _distances(self, rgb_colours):
+        """Euclidean RGB distance from each given colour to every colour in the library"""
+        targets = np.asarray(rgb_colours, dtype=np.float32).reshape(-1, 3)
+        library = self.colours.astype(np.float32)
+        #One channel at a time, so there is no (queries, colours, 3) array
+        squared = np.zeros((len(targets), len(library)), dtype=np.float32)
+        for channel in range(3):
+            squared += (library[np.newaxis, :, channel] - targets[:, channel, np.newaxis])**2
+        return np.sqrt(squared)
+
+    def _closest_per_palette(self, rgb_colours):
+        """
+        Distance from each given colour to the closest colour of each palette,
+        as a (queries, palettes) array. Queries are done in chunks so large
+        palettes don't need a (queries, library colours) array all at once.
+        """
+        targets = np.asarray(rgb_colours).reshape(-1, 3)
+        chunk = max(1, DISTANCE_CHUNK // max(1, len(self.colours)))
+        return np.concatenate([self._per_palette_min(self._distances(targets[start:start+chunk]))
+                               for start in range(0, len(targets), chunk)])
+
+    def _per_palette_min(self, distances):
+        """Reduce colour distances (..., n_colours) to the closest colour of each palette"""
+        non_empty = self.offsets[:-1] < self.offsets[1:]
+        result = np.full(distances.shape[:-1] + (len(self.names),), np.inf, dtype=np.float32)
+        if non_empty.any():
+            result[..., non_empty] = np.minimum.reduceat(distances, self.offsets[:-1][non_empty], axis=-1)
+        return result
+
+    def find_near_colour(self, colour, max_distance=30):
+        """
+        Palettes that contain a colour within max_distance of colour.
+        colour can be "#rrggbb" or an (r, g, b) tuple.
+        Returns [(name, distance)] closest first.
+        """
+        if isinstance(colour, str):
+            colour = ColourSpace.hex_to_rgb([colour])[0]
+        if not len(self.names):
+            return []
+        closest = self._closest_per_palette([colour])[0]
+        matches = np.nonzero(closest <= max_distance)[0]
+        return [(self.names[i], float(closest[i])) for i in matches[np.argsort(closest[matches], kind="stable")]]
+
+    def closest_to_colours(self, colours, weights=None, count=5):
+        """
+        Palettes that best cover a set of colours: the weighted mean distance
+        from each colour to its nearest palette colour. Returns [(name, score)].
+        """
+        if not len(self.names) or not len(colours):
+            return []
+        weights = np.ones(len(colours)) if weights is None else np.asarray(weights, dtype=np.float64)
+        closest = self._closest_per_palette(colours)
+        scores = (closest * weights[:, np.newaxis]).sum(axis=0) / weights.sum()
+        best = np.argsort(scores, kind="stable")[:count]
+        return [(self.names[i], float(scores[i])) for i in best]
+
+    def closest_to_art(self, art, count=5):
+        """Palettes closest to the colours used in an Art object, weighted by pixel count"""
+        used = art.colour_index.used()
+        colours = art.palette_rgb()[used]
+        weights = [art.colour_index.count(index) for index in used]
+        return self.closest_to_colours(colours, weights, count)
@@ -1,18 +1,28 @@
-from Art import Art, Pencil, Bucket, PartialBucket, MirroredPencil
+from Art import Art, Pencil, Bucket, PartialBucket, MirroredPencil, SymmetryTool, ShapeTool, Line, Rectangle, Ellipse
+from Symmetry import Symmetry
+from Journal import Journal
+from PaletteLibrary import PaletteLibrary
+from Instrumentation import Instrumentation, timed
+from Session import SessionRecorder, symmetry_args
 #from Animation import Animation
+from Animation import ArtAnimation, OnionSkin
 from tkinter import *
 from tkinter.colorchooser import *
 from easygui import filesavebox, fileopenbox, ccbox, enterbox
 from PIL import Image, ImageDraw
+import base64
+import io
 import math
-import random
 import sys
+import time
 import os
-import colour
+import numpy as np
+import ColourSpace
+from collections import deque
 
 class PixelArtApp(Frame):
     """Window"""
-    def __init__(self, master=None, art=None, canvas_size=(16,16)):
+    def __init__(self, master=None, art=None, canvas_size=(16,16), filename=None):
         super().__init__()
         self.master = master
         if art:
@@ -28,6 +38,10 @@ class PixelArtApp(Frame):
         self.preview_image_scalar = (3,3) #The multiplier scale that the art preview image should display as
         self.zoom_change_amount = 1.25 #The amount of pixels to increase/decrease pixel size by
         self.tools_selection_per_row = 3
+        self.max_palette_buttons = 16 #Larger palettes are shown as a scrollable swatch image
+        self.palette_swatch_columns = 8
+        self.palette_swatch_size = 18 #Size of each colour in the swatch image, in pixels
+        self.palette_swatch_rows = 16 #Rows of the swatch visible without scrolling
         self.art_history_length = 5
         self.show_debug_console = False
         self.max_log_length = 10
@@ -76,10 +90,26 @@ class PixelArtApp(Frame):
         self.last_export_filename = None
         self.preview_image = PhotoImage(file="resources/default.png").zoom(*self.preview_image_scalar)
         self.art_history = []
-        self.previous_file_save = False
+        self.previous_file_save = filename or False
+        self.untitled_filename = "./savedArt/untitled.pxlart" #Where unsaved work is journalled
+        self.palette_library = None #PaletteLibrary of ./palettes, loaded on first use
+        self.autosave_every = 200 #Journal records between full autosave snapshots
+        self._open_journal(self.previous_file_save or self.untitled_filename, ask_recover=True)
         self.show_gridlines = False
         self.enable_drag = False
-        self.pixel_size = self.default_canvas_size/len(self.art.pixels[0])
+        self.previous_drag_location = None
+        self.shape_start = None #Where the current shape tool drag started
+        self.instrumentation = Instrumentation(enabled=False)
+        self.session_recorder = None #SessionRecorder while a session is being recorded
+        self.log_lines = deque(maxlen=self.max_log_length)
+        self.symmetry = None #Symmetry applied to every tool, if any
+        self.selection = None #Selected rectangle as (x, y, width, height)
+        self.selection_start = None
+        self.clipboard = None
+        self.pixel_size = self.default_canvas_size/max(len(self.art.pixels[0]), len(self.art.pixels))
+        self.art_animation = ArtAnimation()
+        self.animation_index = None #Frame of art_animation being edited
+        self.onion_skin = None #OnionSkin when onion skinning is on
         """
         #Animation vars
         self.animation = Animation([])
@@ -91,10 +121,14 @@ class PixelArtApp(Frame):
 
         #Init tools
         self.tools = [Pencil(), Bucket(), PartialBucket(),
-                      MirroredPencil("x"), MirroredPencil("y"), MirroredPencil("xy")]
+                      MirroredPencil("x"), MirroredPencil("y"), MirroredPencil("xy"),
+                      Bucket(contiguous=False), Line(), Rectangle(),
+                      Rectangle(filled=True), Ellipse(), Ellipse(filled=True)]
         self.tool_icons = ["resources/pen.png", "resources/bucket.png",
                            "resources/partialbucket.png", "resources/penX.png",
-                           "resources/penY.png", "resources/penXY.png"]
+                           "resources/penY.png", "resources/penXY.png",
+                           "resources/globalbucket.png", "resources/line.png", "resources/rectangle.png",
+                           "resources/filledrectangle.png", "resources/ellipse.png", "resources/filledellipse.png"]
 
         self.init_window()
 
@@ -125,15 +159,49 @@ class PixelArtApp(Frame):
         #Add Edit section to menu bar
         self.edit_menu = Menu(self.menu_bar)
         self.edit_menu.add_command(label='Undo', command=lambda:self.undo(), accelerator="Ctrl+Z")
+        self.edit_menu.add_separator()
+        self.edit_menu.add_command(label='Copy Selection', command=lambda: self.copy_selection(), accelerator="Ctrl+C")
+        self.edit_menu.add_command(label='Cut Selection', command=lambda: self.copy_selection(cut=True), accelerator="Ctrl+X")
+        self.edit_menu.add_command(label='Paste', command=lambda: self.paste_clipboard(), accelerator="Ctrl+V")
+        self.edit_menu.add_command(label='Fill Selection', command=lambda: self.run_region_operation(self.art.fill_rect, self.pen_colour), accelerator="")
+        self.edit_menu.add_command(label='Replace Colour in Selection', command=lambda: self.replace_colour_in_selection(), accelerator="")
+        self.edit_menu.add_command(label='Flip Horizontal', command=lambda: self.run_region_operation(self.art.flip_region, True), accelerator="")
+        self.edit_menu.add_command(label='Flip Vertical', command=lambda: self.run_region_operation(self.art.flip_region, False), accelerator="")
+        self.edit_menu.add_command(label='Rotate 90°', command=lambda: self.run_region_operation(self.art.rotate_region, True), accelerator="")
+        self.edit_menu.add_command(label='Select None', command=lambda: self.set_selection(None), accelerator="Esc")
         self.menu_bar.add_cascade(label='Edit', menu=self.edit_menu)
         #Add Palette section to menu bar
         self.palette_menu = Menu(self.menu_bar)
         self.palette_menu.add_command(label='Load from file', command=lambda: self.load_palette_from_file(), accelerator='')
         self.palette_menu.add_command(label='Load from URL', command=lambda: self.load_palette_from_url(), accelerator="")
         self.palette_menu.add_command(label='Random Palette', command=lambda: self.randomise_palette(), accelerator='Ctrl+Shift+R')
+        self.palette_menu.add_command(label='Closest Library Palette', command=lambda: self.load_closest_library_palette(), accelerator='')
+        self.palette_menu.add_command(label='Library Palettes With Pen Colour', command=lambda: self.find_library_palettes_with_colour(), accelerator='')
         self.palette_menu.add_separator()
+        self.palette_menu.add_command(label='Palette Size...', command=lambda:self.set_palette_size(), accelerator="")
         self.palette_menu.add_command(label='Sort Palette', command=lambda:self.sort_palette(), accelerator="")
+        self.palette_menu.add_command(label='Replace Colour Everywhere', command=lambda:self.replace_colour(), accelerator="")
+        self.palette_menu.add_command(label='Show Unused Colours', command=lambda:self.log("Unused colours: {}".format(self.art.unused_colours())), accelerator="")
         self.menu_bar.add_cascade(label='Palette', menu=self.palette_menu)
+        #Add Image section to menu bar
+        self.image_menu = Menu(self.menu_bar)
+        self.image_menu.add_command(label='Resize Canvas...', command=lambda: self.resize_canvas(), accelerator='')
+        self.image_menu.add_command(label='Crop to Selection', command=lambda: self.crop_to_selection(), accelerator='')
+        self.image_menu.add_separator()
+        self.image_menu.add_command(label='Scale 2x (Nearest)', command=lambda: self.replace_art(self.art.scale(2)), accelerator='')
+        self.image_menu.add_command(label='Scale 2x (Smooth Edges)', command=lambda: self.replace_art(self.art.scale2x()), accelerator='')
+        self.menu_bar.add_cascade(label='Image', menu=self.image_menu)
+        #Add Animation section to menu bar
+        self.animation_menu = Menu(self.menu_bar)
+        self.animation_menu.add_command(label='Add Frame', command=lambda: self.add_animation_frame(), accelerator='')
+        self.animation_menu.add_command(label='Previous Frame', command=lambda: self.step_animation_frame(-1), accelerator='Ctrl+,')
+        self.animation_menu.add_command(label='Next Frame', command=lambda: self.step_animation_frame(1), accelerator='Ctrl+.')
+        self.animation_menu.add_separator()
+        self.animation_menu.add_checkbutton(label='Onion Skin', command=lambda: self.toggle_onion_skin(), accelerator='')
+        self.animation_menu.add_command(label='Onion Skin Frames...', command=lambda: self.set_onion_skin_frames(), accelerator='')
+        self.animation_menu.add_separator()
+        self.animation_menu.add_command(label='Export Animation as GIF', command=lambda: self.export_animation(), accelerator='')
+        self.menu_bar.add_cascade(label='Animation', menu=self.animation_menu)
         #Add Options section to menu bar
         self.options_menu = Menu(self.menu_bar)
         self.options_menu.add_checkbutton(label='Gridlines', command=self._toggle_canvas_grid, accelerator='')
@@ -141,9 +209,18 @@ class PixelArtApp(Frame):
         self.options_menu.add_command(label='Zoom in', command=lambda: self._set_pixel_size(self.zoom_change_amount), accelerator='Ctrl+')
         self.options_menu.add_command(label='Zoom out', command=lambda: self._set_pixel_size(-self.zoom_change_amount), accelerator='Ctrl-')
         self.options_menu.add_checkbutton(label='Show/Hide Debug Console', command=lambda: self.toggle_show_console(), accelerator='F12')
+        self.options_menu.add_checkbutton(label='Performance Timers', command=lambda: self.toggle_instrumentation(), accelerator='')
+        self.options_menu.add_checkbutton(label='Capture cProfile', command=lambda: self.toggle_profiling(), accelerator='')
+        self.options_menu.add_checkbutton(label='Record Session', command=lambda: self.toggle_session_recording(), accelerator='')
         self.menu_bar.add_cascade(label='Options', menu=self.options_menu)
-
-        for menu in [self.menu_bar, self.file_menu, self.edit_menu, self.palette_menu, self.options_menu]:
+        #Add Symmetry section to menu bar
+        self.symmetry_menu = Menu(self.menu_bar)
+        self.symmetry_mode = StringVar(self.master, value="None")
+        for label in ["None", "Mirror X", "Mirror Y", "Mirror XY", "Diagonal", "Radial 4", "Radial 8", "Tiled 2x2"]:
+            self.symmetry_menu.add_radiobutton(label=label, value=label, variable=self.symmetry_mode, command=lambda: self.set_symmetry(self.symmetry_mode.get()))
+        self.menu_bar.add_cascade(label='Symmetry', menu=self.symmetry_menu)
+
+        for menu in [self.menu_bar, self.file_menu, self.edit_menu, self.palette_menu, self.image_menu, self.animation_menu, self.options_menu, self.symmetry_menu]:
             menu.config(self.menu_styling)
 
         #Split window into two frames
@@ -162,21 +239,8 @@ class PixelArtApp(Frame):
         self.preview_label.grid(column=10, row=0, padx=6, pady=6)
 
         #Create palette buttons
-        self.colour_buttons = []
-        colour_buttons_container = Frame(self.left_frame)
-        colour_buttons_container.grid(row=0, column=0, padx=6, pady=6)
-        for colour_index, pc in enumerate([(c, self.art.palette[c]) for c in sorted(self.art.palette)]): #enumerate through the current palette
-            #Create button object
-            colour_button = Button(colour_buttons_container)
-            colour_button.grid(column=0, row=colour_index)
-            colour_button.config(self.palette_button_styling)
-            #Bind events to colour button
-            colour_button.bind("<Button-1>", lambda event, index=colour_index: self.change_pen_colour(index)) #Left-click = select as pen
-            colour_button.bind("<Button-3>", lambda event, index=colour_index: self.change_palette_colour(index)) #Right-click=change palette colour
-            self.master.bind("{}".format(colour_index+1), lambda event, index=colour_index: self.change_pen_colour(index)) #Number key press = select that colour as pen
-            #Save the button in a list
-            self.colour_buttons.append(colour_button)
-        self.colour_buttons[self.pen_colour].config(text=self.colour_select_icon)
+        self.palette_container = None
+        self._generate_palette_widget()
 
         #Create tool selection buttons
         self.selected_tool_id = IntVar(self.master)
@@ -190,7 +254,7 @@ class PixelArtApp(Frame):
                 img = PhotoImage(file=self.tool_icons[i])
             except TclError:
                 img=None
-            b = Radiobutton(tool_buttons_container, value=i, background=self.art.palette[colour_index],
+            b = Radiobutton(tool_buttons_container, value=i, background=self.left_bg_colour,
                 image=img, text="{}".format(self.tool_icons[i]) , variable=self.selected_tool_id)
             b.img = img
             b.config(self.tool_button_styling)
@@ -202,9 +266,12 @@ class PixelArtApp(Frame):
         self.bottom_frame.grid(row=50, column=0, columnspan=100, sticky="nsew")
         self.output_console = Listbox(self.bottom_frame, height=4, width=30, borderwidth=0, highlightcolor="#000000",
                                         relief=FLAT, bg="#000000", fg="#FFFFFF")
+        self.stats_overlay = Label(self.bottom_frame, justify=LEFT, anchor="w", bg="#000000", fg="#00FF00", font=("Courier", 8))
+        self._stats_overlay_job = None
 
         if self.show_debug_console:
             self.output_console.pack(expand=True, fill=BOTH)
+            self.stats_overlay.pack(expand=True, fill=BOTH)
 
         """
         #Animation Frame
@@ -278,6 +345,18 @@ class PixelArtApp(Frame):
         self.master.bind_all("<Control-R>", lambda event: self.randomise_palette(ask_confirm=False))
         #Undo (ctrl z)
         self.master.bind_all("<Control-z>", lambda event: self.undo())
+        #Selection clipboard (ctrl c, ctrl x, ctrl v)
+        self.master.bind_all("<Control-c>", lambda event: self.copy_selection())
+        self.master.bind_all("<Control-x>", lambda event: self.copy_selection(cut=True))
+        self.master.bind_all("<Control-v>", lambda event: self.paste_clipboard())
+        #Clear selection (escape)
+        self.master.bind_all("<Escape>", lambda event: self.set_selection(None))
+        #Previous/next animation frame (ctrl , and ctrl .)
+        self.master.bind_all("<Control-comma>", lambda event: self.step_animation_frame(-1))
+        self.master.bind_all("<Control-period>", lambda event: self.step_animation_frame(1))
+        #Move selection (ctrl arrow keys)
+        for key, direction in [("Left", (-1, 0)), ("Right", (1, 0)), ("Up", (0, -1)), ("Down", (0, 1))]:
+            self.master.bind_all("<Control-{}>".format(key), lambda event, d=direction: self.move_selection(*d))
         #Enable/Disable mousedrag (Ctrl M)
         self.master.bind_all("<Control-m>", lambda event: self.toggle_allow_drag() )
         #Show/hide debug console (F12)
@@ -303,26 +382,263 @@ class PixelArtApp(Frame):
             self.animation_preview.after(100, lambda c=counter: self.play_animation_preview(c))
     """
 
+    def _open_journal(self, document_filename, ask_recover=False):
+        """Start journalling edits for a document, offering to recover a previous crash"""
+        recovered = False
+        if ask_recover and Journal.exists(document_filename):
+            if ccbox("Unsaved changes to {} were found.\nRecover them?".format(document_filename), "Recover unsaved changes?"):
+                self.art = Journal.recover(document_filename)
+                recovered = True
+        if getattr(self, "journal", None):
+            self.journal.discard()
+        self.journal = Journal(document_filename, self.art, compact_every=self.autosave_every)
+        if recovered:
+            #Keep the recovered changes safe until the next save
+            self.journal.compact()
+
+    def _get_palette_library(self):
+        """The palette library, scanned once and refreshed on each use"""
+        if self.palette_library is None:
+            self.palette_library = PaletteLibrary("./palettes")
+        else:
+            self.palette_library.refresh()
+        return self.palette_library
+
+    def load_closest_library_palette(self):
+        """Load the library palette closest to the colours used in the art"""
+        matches = self._get_palette_library().closest_to_art(self.art)
+        for name, score in matches:
+            self.log("{}: {:.1f}".format(name, score))
+        if matches:
+            self.load_palette_from_file(self.palette_library.path(matches[0][0]))
+
+    def find_library_palettes_with_colour(self, max_distance=30):
+        """List library palettes that contain a colour close to the pen colour"""
+        matches = self._get_palette_library().find_near_colour(self.art.palette[self.pen_colour], max_distance)
+        self.log("{} palettes contain {}".format(len(matches), self.art.palette[self.pen_colour]))
+        for name, distance in matches[:self.max_log_length-1]:
+            self.log("{}: {:.1f}".format(name, distance))
+
     def load_palette_from_url(self, url=None):
         if not url:
             url = enterbox("Enter a URL", "Load from URL", strip=True)
         if url:
             if self.art.load_palette_from_url(url):
                 self.log("Loading from URL: {}".format(url))
+                self.art_history = []
+                self.journal.compact()
                 self.update_palette_buttons()
                 self.update_canvas()
+                if self.session_recorder:
+                    self.session_recorder.record_art(self.art)
             else:
                 self.log("Unsupported URL: {}".format(url))
 
+    def _generate_palette_widget(self):
+        """
+        Create a button for each palette colour, or for palettes of more than
+        max_palette_buttons colours, a single scrollable swatch image.
+        """
+        if self.palette_container:
+            self.palette_container.destroy()
+        self.palette_container = Frame(self.left_frame)
+        self.palette_container.grid(row=0, column=0, padx=6, pady=6)
+        self.colour_buttons = []
+        self.palette_swatch = None
+        self.palette_size = len(self.art.palette)
+        if self.palette_size > self.max_palette_buttons:
+            self._generate_palette_swatch(self.palette_container)
+        else:
+            for colour_index in range(self.palette_size):
+                #Create button object
+                colour_button = Button(self.palette_container)
+                colour_button.grid(column=0, row=colour_index)
+                colour_button.config(self.palette_button_styling)
+                #Bind events to colour button
+                colour_button.bind("<Button-1>", lambda event, index=colour_index: self.change_pen_colour(index)) #Left-click = select as pen
+                colour_button.bind("<Button-3>", lambda event, index=colour_index: self.change_palette_colour(index)) #Right-click=change palette colour
+                #Save the button in a list
+                self.colour_buttons.append(colour_button)
+            self.update_palette_buttons()
+        for colour_index in range(min(9, self.palette_size)):
+            self.master.bind("{}".format(colour_index+1), lambda event, index=colour_index: self.change_pen_colour(index)) #Number key press = select that colour as pen
+        self.change_pen_colour(min(self.pen_colour, self.palette_size-1))
+
+    def _generate_palette_swatch(self, parent):
+        """Canvas showing the whole palette as one image, with a scrollbar"""
+        columns, size = self.palette_swatch_columns, self.palette_swatch_size
+        rows = -(-self.palette_size // columns)
+        swatch = Canvas(parent, width=columns*size, height=min(rows, self.palette_swatch_rows)*size,
+                        scrollregion=(0, 0, columns*size, rows*size), bg=self.left_bg_colour, highlightthickness=0)
+        scrollbar = Scrollbar(parent, orient=VERTICAL, command=swatch.yview)
+        swatch.config(yscrollcommand=scrollbar.set)
+        swatch.grid(row=0, column=0)
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        swatch.bind("<Button-1>", lambda e: self._on_swatch_click(e, self.change_pen_colour)) #Left-click = select as pen
+        swatch.bind("<Button-3>", lambda e: self._on_swatch_click(e, self.change_palette_colour)) #Right-click=change palette colour
+        swatch.bind("<MouseWheel>", lambda e: swatch.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        swatch.bind("<Button-4>", lambda e: swatch.yview_scroll(-1, "units"))
+        swatch.bind("<Button-5>", lambda e: swatch.yview_scroll(1, "units"))
+        self.palette_swatch = swatch
+        self._draw_palette_swatch()
+
+    def _draw_palette_swatch(self):
+        """Render every palette colour into the swatch image"""
+        columns, size = self.palette_swatch_columns, self.palette_swatch_size
+        rows = -(-self.palette_size // columns)
+        background = ColourSpace.hex_to_rgb([self.left_bg_colour])[0]
+        cells = np.tile(background, (rows*columns, 1))
+        cells[:self.palette_size] = self.art.palette_rgb()[:self.palette_size]
+        image = cells.reshape(rows, columns, 3).repeat(size, axis=0).repeat(size, axis=1)
+        #Leave a gap between the colours
+        image[size-1::size] = background
+        image[:, size-1::size] = background
+        png = io.BytesIO()
+        Image.fromarray(image).save(png, "png")
+        self.palette_swatch_image = PhotoImage(data=base64.b64encode(png.getvalue()))
+        self.palette_swatch.delete("swatch")
+        self.palette_swatch.create_image(0, 0, anchor=NW, image=self.palette_swatch_image, tags="swatch")
+        self.palette_swatch.tag_raise("selected")
+
+    def _on_swatch_click(self, event, action):
+        """Call action with the palette index under the mouse on the swatch"""
+        size = self.palette_swatch_size
+        column = int(self.palette_swatch.canvasx(event.x) // size)
+        index = int(self.palette_swatch.canvasy(event.y) // size) * self.palette_swatch_columns + column
+        if 0 <= column < self.palette_swatch_columns and 0 <= index < self.palette_size:
+            action(index)
+
     def _generate_drawing_canvas(self, parent):
         """Generate a drawing canvas object"""
-        self.canvas_pixels = [[0 for x in range(len(self.art.pixels[0]))] for y in range(len(self.art.pixels[1]))]
-        drawing_canvas = Canvas(parent, width=len(self.art.pixels[0])*self.pixel_size, height=len(self.art.pixels[1])*self.pixel_size)
+        self.canvas_pixels = [[0 for x in range(len(self.art.pixels[0]))] for y in range(len(self.art.pixels))]
+        drawing_canvas = Canvas(parent, width=len(self.art.pixels[0])*self.pixel_size, height=len(self.art.pixels)*self.pixel_size)
         drawing_canvas.grid(row=0, column=0)
-        drawing_canvas.bind('<Button-1>', lambda e: self.activate_tool((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size))))
+        drawing_canvas.bind('<Button-1>', lambda e: self._on_canvas_press((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size))))
+        drawing_canvas.bind('<B1-Motion>', lambda e: self._on_canvas_drag((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size))))
+        drawing_canvas.bind('<ButtonRelease-1>', lambda e: self._on_canvas_release((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size))))
         drawing_canvas.bind('<Button-3>', lambda e: self.change_pen_colour(self.art.pixels[math.floor(e.y/self.pixel_size)][math.floor(e.x/self.pixel_size)]))
+        #Shift + drag selects a rectangle
+        drawing_canvas.bind('<Shift-Button-1>', lambda e: self._drag_selection((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size)), start=True))
+        drawing_canvas.bind('<Shift-B1-Motion>', lambda e: self._drag_selection((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size))))
         return drawing_canvas
 
+    def _on_canvas_press(self, location):
+        """Start a shape, or activate any other tool straight away"""
+        tool = self.tools[self.selected_tool_id.get()]
+        if isinstance(tool, ShapeTool):
+            tool.begin(location)
+            self.shape_start = location
+            self._draw_shape_preview(tool, location)
+        else:
+            self.previous_drag_location = location
+            self.activate_tool(location)
+
+    def _on_canvas_drag(self, location):
+        """Update the shape preview, or keep drawing if mouse drag is enabled"""
+        if self.shape_start is not None:
+            self._draw_shape_preview(self.tools[self.selected_tool_id.get()], location)
+        elif self.enable_drag and location != self.previous_drag_location:
+            self.previous_drag_location = location
+            self.activate_tool(location, draw_all=False)
+
+    def _on_canvas_release(self, location):
+        """Draw the shape being dragged as a single change"""
+        if self.shape_start is None:
+            return
+        self.shape_start = None
+        self.drawing_canvas.delete("preview")
+        self.activate_tool(location)
+
+    def _draw_shape_preview(self, tool, location):
+        """Outline the shape being dragged with a single canvas item"""
+        self.drawing_canvas.delete("preview")
+        (x0, y0), (x1, y1) = self.shape_start, location
+        colour = self.art.palette[self.pen_colour]
+        size = self.pixel_size
+        if tool.preview_shape == "line":
+            #Line between the centres of the end pixels
+            self.drawing_canvas.create_line((x0+0.5)*size, (y0+0.5)*size, (x1+0.5)*size, (y1+0.5)*size,
+                                            fill=colour, width=max(1, size//2), capstyle=ROUND, tags="preview")
+        else:
+            create = self.drawing_canvas.create_rectangle if tool.preview_shape == "rectangle" else self.drawing_canvas.create_oval
+            create(min(x0, x1)*size, min(y0, y1)*size, (max(x0, x1)+1)*size, (max(y0, y1)+1)*size,
+                   outline=colour, fill=colour if tool.filled else "", width=max(1, size//4), tags="preview")
+
+    def _drag_selection(self, location, start=False):
+        """Update the selection rectangle while shift-dragging"""
+        if start or not self.selection_start:
+            self.selection_start = location
+        (x0, y0), (x1, y1) = self.selection_start, location
+        self.set_selection((min(x0, x1), min(y0, y1), abs(x1-x0)+1, abs(y1-y0)+1))
+
+    def set_selection(self, rect):
+        """Set the selected rectangle (x, y, width, height) and outline it on the canvas"""
+        self.selection = rect
+        self.drawing_canvas.delete("selection")
+        if rect:
+            x, y, w, h = rect
+            self.drawing_canvas.create_rectangle(x*self.pixel_size, y*self.pixel_size, (x+w)*self.pixel_size, (y+h)*self.pixel_size,
+                                                 outline="#000000", dash=(3, 3), width=1, tags="selection")
+
+    def _get_selection(self):
+        """The selected rectangle, or the whole canvas if nothing is selected"""
+        if self.selection:
+            return self.selection
+        return (0, 0, len(self.art.pixels[0]), len(self.art.pixels))
+
+    def run_region_operation(self, operation, *args):
+        """
+        Run a bulk region operation from Art (e.g. Art.flip_region) on the selection.
+        The operation is recorded as a single undo step and redrawn in one go.
+        """
+        start = time.perf_counter()
+        selection = self._get_selection()
+        delta = operation(*selection, *args)
+        self._add_to_history(delta)
+        self.redraw_delta(delta)
+        self._record_session("g", start, operation.__name__, *selection, *args)
+        return delta
+
+    def copy_selection(self, cut=False):
+        """Copy the selected pixels into the clipboard"""
+        start = time.perf_counter()
+        selection = self._get_selection()
+        self.clipboard = self.art.copy_region(*selection)
+        self._record_session("c", start, *selection)
+        self.log("Copied {}x{} pixels".format(len(self.clipboard[0]) if self.clipboard else 0, len(self.clipboard)))
+        if cut:
+            self.run_region_operation(self.art.fill_rect, 0)
+
+    def paste_clipboard(self):
+        """Paste the clipboard at the top-left of the selection"""
+        if not self.clipboard:
+            return
+        start = time.perf_counter()
+        x, y = self._get_selection()[:2]
+        delta = self.art.paste(self.clipboard, x, y)
+        self._add_to_history(delta)
+        self.redraw_delta(delta)
+        self._record_session("v", start, x, y)
+        self.set_selection((x, y, len(self.clipboard[0]), len(self.clipboard)))
+
+    def move_selection(self, dx, dy):
+        """Move the selected pixels by (dx, dy)"""
+        if not self.selection:
+            return
+        self.run_region_operation(self.art.move_region, dx, dy)
+        x, y, w, h = self.selection
+        self.set_selection((x+dx, y+dy, w, h))
+
+    def replace_colour_in_selection(self):
+        """Replace a palette index within the selection with the pen colour"""
+        old_index = enterbox("Palette index to replace with the pen colour", "Replace Colour", strip=True)
+        try:
+            old_index = int(old_index)
+        except (TypeError, ValueError):
+            return
+        self.run_region_operation(self.art.replace_colour_in_region, old_index, self.pen_colour)
+
+    @timed("preview_export")
     def update_preview_image(self, size=(100,100)):
         """Draw the art preview image to the preview label."""
         self.art.export_to_image_file("resources/temp.png", scalar=1)
@@ -340,41 +656,147 @@ class PixelArtApp(Frame):
         else:
             user_confirmed = True
         if user_confirmed:
-            self.art = Art(self.art.palette, self.art.image_size, pixels=None)
+            self.art = Art(self.art.palette, self.art.image_size, pixels=None, sparse=self.art.sparse, packed=self.art.packed)
+            self.art_history = []
+            self.journal.compact(self.art)
             self.update_canvas()
+            if self.session_recorder:
+                self.session_recorder.record_art(self.art)
+
+    def _is_animation_frame_size(self):
+        """Whether the art being edited is the same size as the animation frames"""
+        return (len(self.art.pixels[0]), len(self.art.pixels)) == self.art_animation.image_size
+
+    def _store_animation_frame(self):
+        """Save the art being edited into its animation frame"""
+        if self.animation_index is None:
+            return
+        if not self._is_animation_frame_size():
+            self.log("Not storing frame {}: frames must all be {}x{}".format(self.animation_index, *self.art_animation.image_size))
+            return
+        self.art_animation.set_frame(self.animation_index, self.art)
+        if self.onion_skin:
+            self.onion_skin.invalidate(self.animation_index)
+
+    def add_animation_frame(self):
+        """Add a copy of the current art as a new frame after the last one, and edit it"""
+        if len(self.art_animation) and not self._is_animation_frame_size():
+            self.log("Frames must all be {}x{}".format(*self.art_animation.image_size))
+            return
+        self._store_animation_frame()
+        if not len(self.art_animation):
+            #The art being edited becomes the first frame
+            self.art_animation.append(self.art)
+        self.art_animation.append(self.art)
+        self.log("Added frame {}".format(len(self.art_animation)-1))
+        self.show_animation_frame(len(self.art_animation)-1, store=False)
+
+    def step_animation_frame(self, step):
+        """Move forwards or backwards through the animation frames"""
+        if self.animation_index is not None:
+            self.show_animation_frame(self.animation_index+step)
+
+    def show_animation_frame(self, index, store=True):
+        """Switch to editing another animation frame"""
+        if not 0 <= index < len(self.art_animation):
+            return
+        if store:
+            self._store_animation_frame()
+        self.animation_index = index
+        self.log("Editing frame {}".format(index))
+        self.replace_art(self.art_animation.get_frame(index))
+
+    def toggle_onion_skin(self):
+        """Show the neighbouring animation frames faintly behind the current one"""
+        if self.onion_skin:
+            self.onion_skin = None
+        else:
+            self.onion_skin = OnionSkin(self.art_animation)
+        self.update_canvas()
 
-    def toggle_allow_drag(self):
-        """Toggle the ability to draw while dragging the mouse"""
-        def button1_move(e):
+    def set_onion_skin_frames(self, frames=None):
+        """Set how many previous and following frames the onion skin shows, e.g. "2 1" """
+        if not frames:
+            frames = enterbox("Number of previous and next frames to show (e.g. 2 1)", "Onion Skin", strip=True)
+        try:
+            previous, following = [int(n) for n in frames.split()]
+        except (AttributeError, ValueError):
+            return
+        if not self.onion_skin:
+            self.onion_skin = OnionSkin(self.art_animation)
+        self.onion_skin.previous, self.onion_skin.following = previous, following
+        self.onion_skin.invalidate()
+        self.update_canvas()
+
+    def export_animation(self, filename=None):
+        """Export the animation frames as a GIF"""
+        self._store_animation_frame()
+        if not len(self.art_animation):
+            self.log("No animation frames to export")
+            return
+        if not filename:
+            filename = filesavebox(title="Export animation", default="./*.gif")
+        if filename:
             try:
-                print(self.prev)
-            except:
-                self.prev = None
-            cur = (math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size))
-            if cur != self.prev:
-                self.prev = cur
-                self.activate_tool((math.floor(e.x/self.pixel_size), math.floor(e.y/self.pixel_size)),draw_all=False)
+                self.art_animation.export_as_gif(filename, scalar=10)
+            except ValueError as e:
+                self.log("Can't export animation: {}".format(e))
+                return
+            self.log("Exported {} frames to {}".format(len(self.art_animation), filename))
+
+    def _canvas_colours(self, cells=None):
+        """
+        Colour to show for each cell, or for every cell in row-major order.
+        With onion skinning on, the cached blend of the other frames is mixed in.
+        """
+        if self.onion_skin and self.animation_index is not None and self._is_animation_frame_size():
+            if cells is None:
+                return ColourSpace.rgb_to_hex(self.onion_skin.composite(self.animation_index, self.art).reshape(-1, 3))
+            return self.onion_skin.composite_cells(self.animation_index, self.art, cells)
+        if cells is None:
+            return [self.art.palette[index] for row in self.art.pixels for index in row]
+        return [self.art.palette[self.art.pixels[y][x]] for x, y in cells]
 
+    def toggle_allow_drag(self):
+        """Toggle the ability to draw while dragging the mouse"""
+        #Dragging is handled by _on_canvas_drag
         self.enable_drag = not self.enable_drag
 
         if self.enable_drag:
             self.log("Enabling mouse drag")
-            self.drawing_canvas.bind('<B1-Motion>', lambda e: button1_move(e))
         else:
             self.log("Disabling mouse drag")
-            self.drawing_canvas.unbind("<B1-Motion>")
+
+    def set_symmetry(self, mode_label):
+        """Set the symmetry that every tool is run through"""
+        width, height = len(self.art.pixels[0]), len(self.art.pixels)
+        symmetries = {
+            "Mirror X": lambda: Symmetry("x"),
+            "Mirror Y": lambda: Symmetry("y"),
+            "Mirror XY": lambda: Symmetry("xy"),
+            "Diagonal": lambda: Symmetry("diagonal"),
+            "Radial 4": lambda: Symmetry("radial", ways=4),
+            "Radial 8": lambda: Symmetry("radial", ways=8),
+            "Tiled 2x2": lambda: Symmetry("tiled", tile_size=(max(1, width//2), max(1, height//2))),
+        }
+        self.symmetry = symmetries[mode_label]() if mode_label in symmetries else None
+        if self.session_recorder:
+            self.session_recorder.record("y", 0, *symmetry_args(self.symmetry))
+        self.log("Symmetry: {}".format(mode_label))
 
     def _toggle_canvas_grid(self):
         """Toggle the canvas gridlines"""
         self.show_gridlines = not self.show_gridlines
         if self.show_gridlines:
             self.log("Show Gridlines")
-            for grid_index in range(0, len(self.art.pixels[0])):
+            width, height = len(self.art.pixels[0]), len(self.art.pixels)
+            for grid_index in range(0, width):
                 self.drawing_canvas.create_line(grid_index*self.pixel_size, 0,
-                                                grid_index*self.pixel_size, self.pixel_size*len(self.art.pixels[0]),
+                                                grid_index*self.pixel_size, self.pixel_size*height,
                                                 tags="gridline")
+            for grid_index in range(0, height):
                 self.drawing_canvas.create_line(0, grid_index*self.pixel_size,
-                                                self.pixel_size*len(self.art.pixels[0]), grid_index*self.pixel_size,
+                                                self.pixel_size*width, grid_index*self.pixel_size,
                                             tags="gridline")
         else:
             self.log("Hide Gridlines")
@@ -382,27 +804,68 @@ class PixelArtApp(Frame):
 
     def _set_pixel_size(self, scale):
         """Update size of pixels to be a new value."""
+        start = time.perf_counter()
         if scale < 0:
             #Zooming out
             scale = abs(scale)
             self.pixel_size = max(1, self.pixel_size / scale)
-            self.drawing_canvas.config(height=self.pixel_size*len(self.art.pixels[0]),
-                                    width=self.pixel_size*len(self.art.pixels[1]))
+            self.drawing_canvas.config(height=self.pixel_size*len(self.art.pixels),
+                                    width=self.pixel_size*len(self.art.pixels[0]))
             self.drawing_canvas.scale(ALL, 0, 0, 1/scale, 1/scale)
         else:
             #Zooming in
             self.pixel_size = self.pixel_size * scale
-            self.drawing_canvas.config(height=self.pixel_size*len(self.art.pixels[0]),
-                                    width=self.pixel_size*len(self.art.pixels[1]))
+            self.drawing_canvas.config(height=self.pixel_size*len(self.art.pixels),
+                                    width=self.pixel_size*len(self.art.pixels[0]))
             self.drawing_canvas.scale(ALL, 0, 0, scale, scale)
 
         self.update_window_size()
+        self._record_session("z", start, scale)
         self.log("Changing pixel size: {}".format(self.pixel_size))
 
     def sort_palette(self):
+        start = time.perf_counter()
         self.art.sort_palette()
+        #Sorting renumbers the pixels, so older deltas no longer apply
+        self.art_history = []
+        self.journal.compact()
+        self.update_palette_buttons()
+        self.update_canvas()
+        self._record_session("s", start)
+
+    def set_palette_size(self, size=None):
+        """Add or remove palette colours; pixels of removed colours become colour 0"""
+        if not size:
+            size = enterbox("Number of palette colours (1-65536)", "Palette Size", strip=True)
+        start = time.perf_counter()
+        try:
+            self.art.resize_palette(int(size))
+        except (TypeError, ValueError):
+            return
+        #Undoing could bring back removed colours
+        self.art_history = []
+        if self.clipboard:
+            #Like the pixels, clipboard pixels of removed colours become colour 0
+            self.clipboard = [[symbol if symbol < len(self.art.palette) else 0 for symbol in row] for row in self.clipboard]
+        self.journal.compact()
         self.update_palette_buttons()
         self.update_canvas()
+        self._record_session("R", start, len(self.art.palette))
+        self.log("Palette has {} colours".format(len(self.art.palette)))
+
+    def replace_colour(self, old_index=None):
+        """Replace every pixel of a palette index with the pen colour"""
+        if old_index is None:
+            old_index = enterbox("Palette index to replace with the pen colour", "Replace Colour", strip=True)
+        try:
+            old_index = int(old_index)
+        except (TypeError, ValueError):
+            return
+        start = time.perf_counter()
+        delta = self.art.replace_colour(old_index, self.pen_colour)
+        self._add_to_history(delta)
+        self.redraw_delta(delta)
+        self._record_session("r", start, old_index, self.pen_colour)
 
     def randomise_palette(self, ask_confirm=True):
         """Randomise the current palette"""
@@ -411,14 +874,19 @@ class PixelArtApp(Frame):
         else:
             confirmed = True
         if confirmed:
-            for index in self.art.palette.keys():
-                random_colour = self.art.rgb_colour_to_html(random.choice(range(0, 255)), random.choice(range(0, 255)), random.choice(range(0, 255)))
+            start = time.perf_counter()
+            random_colours = ColourSpace.rgb_to_hex(np.random.randint(0, 256, (len(self.art.palette), 3)))
+            for index, random_colour in zip(list(self.art.palette), random_colours):
                 self.art.palette[index] = random_colour
             self.art.sort_palette()
+            self.art_history = []
+            self.journal.compact()
             self.update_canvas()
             self.update_palette_buttons()
             self.update_preview_image()
+            self._record_session("P", start, *random_colours)
 
+    @timed("file_save")
     def _save_to_file(self, filename=None):
         """Save current artwork/palette to a file"""
         if not filename:
@@ -427,7 +895,10 @@ class PixelArtApp(Frame):
             self.log("Saving to: {}".format(filename))
             self.art.save_to_file(filename)
             self.previous_file_save = filename
+            #Everything is saved, so there is nothing to recover
+            self._open_journal(filename)
 
+    @timed("file_load")
     def load_palette_from_file(self, filename=None):
         """Load a palette from a given file"""
         if not filename:
@@ -435,9 +906,15 @@ class PixelArtApp(Frame):
         if filename:
             self.log("Loading from: {}".format(filename))
             self.art.load_palette_from_file(filename)
+            #Older deltas could hold colours the new palette doesn't have
+            self.art_history = []
+            self.journal.compact()
             self.update_canvas()
             self.update_palette_buttons()
+            if self.session_recorder:
+                self.session_recorder.record_art(self.art)
 
+    @timed("file_load")
     def load_art_from_file(self, filename=None, ignore_warning=False):
         """
         Load artwork from a given file.
@@ -449,13 +926,45 @@ class PixelArtApp(Frame):
 
             self.log("Loading from: {}".format(filename))
             self.art = Art.load_from_file(filename)
+            self.previous_file_save = filename
+            self._open_journal(filename, ask_recover=True)
+            self.replace_art(self.art)
+
+    def replace_art(self, art):
+        """Switch to a different Art object, e.g. after loading or resizing"""
+        self.art = art
+        self.art_history = []
+        self.selection = None
+        if self.journal.art is not art:
+            self.journal.compact(art)
 
-            self.drawing_canvas.destroy()
-            self.drawing_canvas = self._generate_drawing_canvas(self.drawing_canvas_frame)
+        self.drawing_canvas.destroy()
+        self.drawing_canvas = self._generate_drawing_canvas(self.drawing_canvas_frame)
 
-            self.update_canvas()
-            self.update_palette_buttons()
-            self.update_window_size()
+        self.update_canvas()
+        self.update_palette_buttons()
+        self.update_window_size()
+        if self.session_recorder:
+            self.session_recorder.record_art(art)
+
+    def resize_canvas(self, size=None, anchor="centre"):
+        """Change the canvas size, keeping the current art at the anchor"""
+        if not size:
+            size = enterbox("New canvas size (e.g. 32x16)", "Resize Canvas", strip=True)
+        try:
+            width, height = parse_canvas_size(size)
+        except (AttributeError, ValueError):
+            return
+        self.log("Resizing canvas to {}x{}".format(width, height))
+        self.replace_art(self.art.resize_canvas(width, height, anchor))
+
+    def crop_to_selection(self):
+        """Crop the canvas to the selected rectangle"""
+        if self.selection:
+            try:
+                self.replace_art(self.art.crop(*self.selection))
+            except ValueError as e:
+                self.log(str(e))
 
     def export_as_image_file(self, filename=False):
         """Export the current canvas to an image file"""
@@ -481,7 +990,15 @@ class PixelArtApp(Frame):
         self.pen_colour = colour_index
         for button in self.colour_buttons:
             button.config(text="")
-        self.colour_buttons[colour_index].config(text=self.colour_select_icon)
+        if self.colour_buttons:
+            self.colour_buttons[colour_index].config(text=self.colour_select_icon)
+        if self.palette_swatch:
+            #Outline the selected colour on the swatch
+            size, columns = self.palette_swatch_size, self.palette_swatch_columns
+            x, y = colour_index % columns * size, colour_index // columns * size
+            self.palette_swatch.delete("selected")
+            self.palette_swatch.create_rectangle(x, y, x+size-2, y+size-2, width=2, tags="selected",
+                                                 outline=ColourSpace.text_colour(self.art.palette[colour_index]))
         self.log("Set pen colour to: {}".format(colour_index))
 
     def change_palette_colour(self, colour_index):
@@ -491,14 +1008,17 @@ class PixelArtApp(Frame):
         default_colour = self.art.palette[colour_index]
         new_colour = askcolor(default_colour)[1]
         if new_colour:
+            start = time.perf_counter()
             self.art.palette[colour_index] = new_colour.strip()
-            self.colour_buttons[colour_index].config(background=new_colour)
+            self.journal.record_palette_colour(colour_index, new_colour.strip())
             self.change_pen_colour(colour_index)
             self.update_canvas()
             self.update_palette_buttons()
+            self._record_session("p", start, colour_index, new_colour.strip())
         else:
             pass
 
+    @timed("canvas_redraw")
     def update_canvas(self, clear_canvas=True, selected_pixels=False):
         """
         Update the drawing canvas so the correct colours are showing.
@@ -509,83 +1029,160 @@ class PixelArtApp(Frame):
         if clear_canvas:
             self.drawing_canvas.delete("rect")
         if not selected_pixels:
+            colours = iter(self._canvas_colours())
             for y, pixel_row in enumerate(self.canvas_pixels):
                 for x, pixel_button in enumerate(pixel_row):
-                    colour_index = self.art.pixels[y][x]
-                    colour = self.art.palette[colour_index]
+                    colour = next(colours)
 
-                    self.drawing_canvas.create_rectangle(x*self.pixel_size, y*self.pixel_size, x*self.pixel_size+self.pixel_size, y*self.pixel_size+self.pixel_size,
+                    #Keep the canvas item id so single pixels can be recoloured later
+                    self.canvas_pixels[y][x] = self.drawing_canvas.create_rectangle(x*self.pixel_size, y*self.pixel_size, x*self.pixel_size+self.pixel_size, y*self.pixel_size+self.pixel_size,
                                                         fill=colour, width=0, tags="rect")
         else:
-            for pixel in selected_pixels:
-                x = pixel[0]
-                y = pixel[1]
-                colour_index = self.art.pixels[y][x]
-                colour = self.art.palette[colour_index]
-                self.drawing_canvas.create_rectangle(x*self.pixel_size, y*self.pixel_size, x*self.pixel_size+self.pixel_size, y*self.pixel_size+self.pixel_size,
-                                                        fill=colour, width=0, tags="rect")
+            for (x, y), colour in zip(selected_pixels, self._canvas_colours(selected_pixels)):
+                self.drawing_canvas.itemconfig(self.canvas_pixels[y][x], fill=colour)
 
         self.drawing_canvas.tag_raise("gridline")
+        self.drawing_canvas.tag_raise("selection")
         self.update_preview_image()
-        self.log("Updating canvas...")
 
     def update_palette_buttons(self):
         """Update colour of palette buttons to be consistant with the art palette"""
+        if len(self.art.palette) != self.palette_size:
+            #Palette has grown or shrunk, so the buttons are rebuilt
+            self._generate_palette_widget()
+            return
+        if self.palette_swatch:
+            self._draw_palette_swatch()
+            self.change_pen_colour(self.pen_colour)
+            return
         for colour_index, button in zip(self.art.palette, self.colour_buttons):
             this_colour = self.art.palette[colour_index]
-            colour_obj = colour.Color(this_colour)
-            colour_obj.green = 1-colour_obj.green
-            colour_obj.red = 1-colour_obj.red
-            colour_obj.blue = 1-colour_obj.blue
-            colour_obj.set_saturation(0.99)
-            text_colour = colour_obj.hex
-            button.config(fg=text_colour)
+            button.config(fg=ColourSpace.text_colour(this_colour))
             button.config(background=this_colour)
 
+    def redraw_delta(self, delta):
+        """Redraw only the dirty rectangle of a Delta"""
+        bounds = delta.bounds() if delta else None
+        if not bounds:
+            return
+        x, y, w, h = bounds
+        self.update_canvas(clear_canvas=False, selected_pixels=[(xn, yn) for yn in range(y, y+h) for xn in range(x, x+w)])
+
+    def _add_to_history(self, delta):
+        """Add a Delta to the undo history"""
+        if not delta:
+            return
+        self.art_history.append(delta)
+        self.journal.record_delta(delta)
+        while len(self.art_history) >= self.art_history_length:
+            self.art_history.remove(self.art_history[0])
+
     def set_pixel_colour(self, x, y, colour_index):
         """Set the colour of an individual pixel on the drawing canvas"""
         self.art.set_pixel(x, y, colour_index)
         colour_value = self.art.palette[colour_index]
         self.canvas_pixels[x][y].config(background=colour_value)
 
+    @timed("tool_activation")
     def activate_tool(self, location, draw_all=True):
         """
         Activate a the currently selected drawing tool at a given location.
-        disabling draw_all means that only new pixels will be updated on the canvas"""
-        #Add change to history
-        self.art_history.append(self.art.copy())
-        while len(self.art_history) >= self.art_history_length:
-            self.art_history.remove(self.art_history[0])
-
-        t = self.tools[self.selected_tool_id.get()]
+        disabling draw_all means that only the changed pixels will be updated on the canvas"""
+        start = time.perf_counter()
+        tool = t = self.tools[self.selected_tool_id.get()]
+        if self.symmetry:
+            t = SymmetryTool(t, self.symmetry)
         self.log("{} @ {}".format(type(t).__name__, location))
         try:
-            t.activate(location, self.art.pixels, self.pen_colour)
+            delta = self.art.apply_tool(t, location, self.pen_colour)
         except IndexError:
-            pass
+            return
+
+        #Add change to history
+        self._add_to_history(delta)
 
         if draw_all:
-            self.update_canvas()
-        else:
-            self.update_canvas(clear_canvas=False, selected_pixels=[(location)])
+            self.redraw_delta(delta)
+        elif delta:
+            self.update_canvas(clear_canvas=False, selected_pixels=delta.cells())
+        if self.session_recorder:
+            self.session_recorder.record_tool(tool, location, self.pen_colour, time.perf_counter() - start, drag=not draw_all)
 
+    @timed("undo")
     def undo(self):
         """Return to the previous art state"""
+        start = time.perf_counter()
         try:
-            previous_state = self.art_history.pop()
-            self.art = previous_state
-            self.update_canvas()
+            delta = self.art_history.pop()
+            self.art.apply_delta(delta, undo=True)
+            self.journal.record_delta(delta, undo=True)
+            self.redraw_delta(delta)
+            self._record_session("u", start)
             self.log("Undoing")
         except IndexError:
             self.log("Reached undo limit: {}".format(self.art_history_length))
 
     def log(self, output):
-        """Output a string to the debug console"""
-        print(output)
-        self.output_console.insert(END, output)
-        while self.output_console.size() > self.max_log_length:
-            self.output_console.delete(0)
-        self.output_console.see(END)
+        """
+        Output a string to the debug console.
+        The console widget is only touched while it is visible;
+        redraws are counted by the canvas_redraw timer rather than logged.
+        """
+        self.log_lines.append(output)
+        if self.show_debug_console:
+            self.output_console.insert(END, output)
+            while self.output_console.size() > self.max_log_length:
+                self.output_console.delete(0)
+            self.output_console.see(END)
+
+    def toggle_instrumentation(self):
+        """Enable/disable the per-operation performance timers"""
+        self.instrumentation.enabled = not self.instrumentation.enabled
+        if self.instrumentation.enabled:
+            self.instrumentation.reset()
+        self.log("Performance timers {}".format("enabled" if self.instrumentation.enabled else "disabled"))
+
+    def toggle_profiling(self, filename=None):
+        """Start or stop capturing a cProfile to a file"""
+        if self.instrumentation.profiler:
+            filename = self.instrumentation.stop_profile()
+            self.log("Saved profile: {}".format(filename))
+            return
+        if not filename:
+            filename = filesavebox(title="Save profile to", default="./*.prof")
+        if filename:
+            self.instrumentation.start_profile(filename)
+            self.log("Profiling to: {}".format(filename))
+
+    def toggle_session_recording(self, filename=None):
+        """Start or stop recording a session log that Session.py can replay"""
+        if self.session_recorder:
+            self.session_recorder.close()
+            self.log("Saved session: {} ({} events)".format(self.session_recorder.filename, self.session_recorder.events))
+            self.session_recorder = None
+            return
+        if not filename:
+            filename = filesavebox(title="Record session to", default="./*.pxlsession")
+        if filename:
+            self.session_recorder = SessionRecorder(filename, self.art, self.symmetry, self.art_history_length, self.clipboard)
+            self.log("Recording session to: {}".format(filename))
+
+    def _record_session(self, kind, start, *args):
+        """Add an event that started at start (time.perf_counter) to the session being recorded"""
+        if self.session_recorder:
+            self.session_recorder.record(kind, time.perf_counter() - start, *args)
+
+    def _update_stats_overlay(self):
+        """Refresh the timer summary under the debug console while it is shown"""
+        self._stats_overlay_job = None
+        if not self.show_debug_console:
+            return
+        if self.instrumentation.enabled:
+            text = "\n".join(self.instrumentation.summary_lines()) or "No timings yet"
+        else:
+            text = "Timers off (Options > Performance Timers)"
+        self.stats_overlay.config(text=text)
+        self._stats_overlay_job = self.master.after(1000, self._update_stats_overlay)
 
     def _on_window_resize(self, event):
         """Window was resized"""
@@ -604,11 +1201,18 @@ class PixelArtApp(Frame):
         """Toggle the display of the debug console"""
         self.show_debug_console = not self.show_debug_console
         if self.show_debug_console:
+            self.output_console.delete(0, END)
+            for line in self.log_lines:
+                self.output_console.insert(END, line)
             self.log("Show console")
             self.output_console.pack(expand=True, fill=BOTH)
+            self.stats_overlay.pack(expand=True, fill=BOTH)
+            if not self._stats_overlay_job:
+                self._update_stats_overlay()
         else:
             self.log("Hide console")
             self.output_console.pack_forget()
+            self.stats_overlay.pack_forget()
         self.update_window_size()
 
 class SaveArtWindow(Toplevel):
@@ -673,8 +1277,16 @@ class SaveArtWindow(Toplevel):
         self.preview_label.config(image=self.preview_image)
 
 
+def parse_canvas_size(text):
+    """Parse a canvas size like "16" or "32x16" into (width, height)"""
+    size = [int(n) for n in text.lower().split("x")]
+    if len(size) not in (1, 2) or min(size) < 1:
+        raise ValueError("Invalid canvas size: {}".format(text))
+    return (size[0], size[-1])
+
 def main():
     art_to_load = None
+    filename = None
     canvas_size = (8, 8)
     #Create required folders if they don't exist:
     for directory in ["./savedArt", "./exportedArt", "./palettes", "./resources/temp"]:
@@ -685,11 +1297,12 @@ def main():
         if os.path.splitext(sys.argv[1])[1] == ".pxlart":
             try:
                 art_to_load = Art.load_from_file(sys.argv[1])
+                filename = sys.argv[1]
             except FileNotFoundError:
                 print("Could not find file: {}".format(sys.argv[1]))
         else:
             try:
-                canvas_size = (int(sys.argv[1]), int(sys.argv[1]))
+                canvas_size = parse_canvas_size(sys.argv[1])
             except ValueError:
                 print("Using default canvas size")
 
@@ -700,7 +1313,7 @@ def main():
         print("No args provided. Using default canvas size.")
 
     root = Tk()
-    w = PixelArtApp(root, art_to_load, canvas_size)
+    w = PixelArtApp(root, art_to_load, canvas_size, filename)
 
     root.mainloop()
 
@@ -0,0 +1,522 @@
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+import numpy as np
+
+#Bits per pixel that PackedPixels can use, smallest first
+BIT_DEPTHS = (1, 2, 4, 8, 16)
+
+def iter_row_runs(row):
+    """
+    Yield (value, length) runs for a row of pixels.
+    Works for both plain lists and SparseRow objects.
+    """
+    if hasattr(row, "runs"):
+        yield from row.runs()
+    else:
+        for value, group in groupby(row):
+            yield value, sum(1 for _ in group)
+
+def write_cells(pixelgrid, xs, ys, values):
+    """
+    Set the pixels at (xs[i], ys[i]) to values[i], touching each row once,
+    and return their previous values. Works for every pixel store: packed
+    stores write all the rows in one go, others one row slice at a time.
+    """
+    xs, ys, values = np.asarray(xs), np.asarray(ys), np.asarray(values)
+    if hasattr(pixelgrid, "set_cells"):
+        return pixelgrid.set_cells(xs, ys, values)
+    previous = np.empty(len(xs), dtype=np.int64)
+    if not len(xs):
+        return previous
+    order = np.lexsort((xs, ys))
+    sorted_ys = ys[order]
+    row_starts = np.flatnonzero(np.diff(sorted_ys)) + 1
+    for cells in np.split(order, row_starts):
+        y = int(ys[cells[0]])
+        row_xs = xs[cells]
+        x0, x1 = int(row_xs.min()), int(row_xs.max()) + 1
+        segment = np.array(pixelgrid[y][x0:x1])
+        previous[cells] = segment[row_xs - x0]
+        segment[row_xs - x0] = values[cells]
+        pixelgrid[y][x0:x1] = segment.tolist()
+    return previous
+
+class SparseRow():
+    """
+    A single row of pixels stored as runs of the same palette index.
+    starts[i] is the first x coordinate of run i, which has the value values[i].
+    """
+    def __init__(self, width, fill_value=0):
+        self.width = width
+        self.starts = [0]
+        self.values = [fill_value]
+
+    @classmethod
+    def from_values(cls, values):
+        """Create a row from a list of palette indexes"""
+        values = list(values)
+        row = cls(len(values))
+        row.starts, row.values = [], []
+        x = 0
+        for value, length in iter_row_runs(values):
+            row.starts.append(x)
+            row.values.append(value)
+            x += length
+        if not row.starts:
+            row.starts, row.values = [0], [0]
+        return row
+
+    @classmethod
+    def from_runs(cls, width, runs):
+        """Create a row from (value, length) pairs that add up to the width"""
+        row = cls(width)
+        row.starts, row.values = [], []
+        x = 0
+        for value, length in runs:
+            if length <= 0:
+                continue
+            if row.values and row.values[-1] == value:
+                x += length
+                continue
+            row.starts.append(x)
+            row.values.append(value)
+            x += length
+        if x != width:
+            raise ValueError("Runs cover {} pixels, expected {}".format(x, width))
+        if not row.starts:
+            row.starts, row.values = [0], [0]
+        return row
+
+    def _index(self, x):
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError("pixel index out of range")
+        return x
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            start, stop, step = x.indices(self.width)
+            if step != 1:
+                return list(self)[x]
+            values = []
+            for value, length in self.runs(start, stop):
+                values.extend([value]*length)
+            return values
+        x = self._index(x)
+        return self.values[bisect_right(self.starts, x)-1]
+
+    def __setitem__(self, x, value):
+        if isinstance(x, slice):
+            start, stop, step = x.indices(self.width)
+            value = list(value)
+            if step != 1 or len(value) != max(0, stop-start):
+                raise ValueError("SparseRow only supports same-length contiguous slice assignment")
+            for run_value, length in iter_row_runs(value):
+                self.fill(start, start+length, run_value)
+                start += length
+            return
+        x = self._index(x)
+        self.fill(x, x+1, value)
+
+    def __iter__(self):
+        for value, length in self.runs():
+            for _ in range(length):
+                yield value
+
+    def __eq__(self, other):
+        if isinstance(other, SparseRow):
+            return self.width == other.width and self.starts == other.starts and self.values == other.values
+        try:
+            return len(other) == self.width and list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return "SparseRow({})".format(list(self.runs()))
+
+    def fill(self, start, stop, value):
+        """Set every pixel in the range [start, stop) to value"""
+        start, stop = max(0, start), min(self.width, stop)
+        if start >= stop:
+            return
+        starts, values = self.starts, self.values
+        if stop < self.width:
+            tail = values[bisect_right(starts, stop)-1]
+        else:
+            tail = None
+        lo = bisect_left(starts, start)
+        hi = bisect_right(starts, stop)
+        if tail is None:
+            starts[lo:hi] = [start]
+            values[lo:hi] = [value]
+        else:
+            starts[lo:hi] = [start, stop]
+            values[lo:hi] = [value, tail]
+        #Merge any runs that now have the same value as their neighbour
+        for i in range(min(lo+1, len(starts)-1), max(lo, 1)-1, -1):
+            if values[i] == values[i-1]:
+                del starts[i]
+                del values[i]
+
+    def runs(self, start=0, stop=None):
+        """Yield (value, length) runs, optionally clipped to [start, stop)"""
+        if stop is None:
+            stop = self.width
+        if start >= stop:
+            return
+        i = bisect_right(self.starts, start)-1
+        while i < len(self.starts) and self.starts[i] < stop:
+            run_start = max(self.starts[i], start)
+            run_stop = self.starts[i+1] if i+1 < len(self.starts) else self.width
+            yield self.values[i], min(run_stop, stop) - run_start
+            i += 1
+
+    def copy(self):
+        row = SparseRow(self.width)
+        row.starts = list(self.starts)
+        row.values = list(self.values)
+        return row
+
+class SparsePixels():
+    """
+    Pixel store for mostly-empty canvases.
+    Behaves like a list of rows (pixels[y][x]) but each row is a SparseRow,
+    so memory is proportional to the number of runs rather than the canvas area.
+    """
+    def __init__(self, width, height, fill_value=0):
+        self.width = width
+        self.height = height
+        self.rows = [SparseRow(width, fill_value) for y in range(height)]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a sparse store from a list of rows of palette indexes"""
+        rows = list(rows)
+        pixels = cls(len(rows[0]) if rows else 0, 0)
+        pixels.rows = [row.copy() if isinstance(row, SparseRow) else SparseRow.from_values(row) for row in rows]
+        pixels.height = len(pixels.rows)
+        return pixels
+
+    @classmethod
+    def from_runs(cls, width, height, runs):
+        """
+        Create a sparse store from (value, length) runs in row-major order.
+        Runs may span across the end of a row.
+        """
+        pixels = cls(width, 0)
+        row_runs, row_length = [], 0
+        for value, length in runs:
+            while length > 0:
+                taken = min(length, width-row_length)
+                row_runs.append((value, taken))
+                row_length += taken
+                length -= taken
+                if row_length == width:
+                    pixels.rows.append(SparseRow.from_runs(width, row_runs))
+                    row_runs, row_length = [], 0
+        if row_runs or len(pixels.rows) != height:
+            raise ValueError("Runs do not fill a {}x{} canvas".format(width, height))
+        pixels.height = height
+        return pixels
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, y):
+        return self.rows[y]
+
+    def __setitem__(self, y, row):
+        if isinstance(y, slice):
+            self.rows[y] = [r.copy() if isinstance(r, SparseRow) else SparseRow.from_values(r) for r in row]
+        else:
+            self.rows[y] = row.copy() if isinstance(row, SparseRow) else SparseRow.from_values(row)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return "SparsePixels({}x{}, {} runs)".format(self.width, self.height, self.run_count())
+
+    def copy(self):
+        pixels = SparsePixels(self.width, 0)
+        pixels.rows = [row.copy() for row in self.rows]
+        pixels.height = self.height
+        return pixels
+
+    def runs(self):
+        """Yield (value, length) runs in row-major order, merging runs across rows"""
+        current, count = None, 0
+        for row in self.rows:
+            for value, length in row.runs():
+                if value == current:
+                    count += length
+                else:
+                    if count:
+                        yield current, count
+                    current, count = value, length
+        if count:
+            yield current, count
+
+    def run_count(self):
+        """Number of runs stored, a measure of memory use"""
+        return sum(len(row.starts) for row in self.rows)
+
+def bit_depth_for(palette_size):
+    """Smallest bit depth in BIT_DEPTHS that can hold palette_size indexes"""
+    for bit_depth in BIT_DEPTHS:
+        if palette_size <= 1 << bit_depth:
+            return bit_depth
+    raise ValueError("Palettes can have at most {} colours".format(1 << BIT_DEPTHS[-1]))
+
+def _shifts(bit_depth):
+    #Shift of each pixel within a byte; the leftmost pixel is in the high bits, as in PNG
+    return np.arange(8-bit_depth, -1, -bit_depth, dtype=np.uint8)
+
+def pack_rows(array, bit_depth):
+    """
+    Pack a 2d array of palette indexes. Each row becomes a row of bytes
+    holding 8/bit_depth pixels each, or of uint16s for 16 bit.
+    """
+    if bit_depth == 16:
+        return np.asarray(array).astype(np.uint16)
+    if bit_depth == 8:
+        return np.asarray(array).astype(np.uint8)
+    per_byte = 8 // bit_depth
+    height, width = np.shape(array)
+    row_bytes = -(-width // per_byte)
+    padded = np.zeros((height, row_bytes * per_byte), dtype=np.uint8)
+    padded[:, :width] = array
+    return np.bitwise_or.reduce(padded.reshape(height, row_bytes, per_byte) << _shifts(bit_depth), axis=2).astype(np.uint8)
+
+def unpack_rows(data, width, bit_depth):
+    """Inverse of pack_rows: a 2d int32 array of palette indexes"""
+    if bit_depth >= 8:
+        return data.astype(np.int32)
+    values = (data[:, :, np.newaxis] >> _shifts(bit_depth)) & ((1 << bit_depth) - 1)
+    return values.reshape(data.shape[0], -1)[:, :width].astype(np.int32)
+
+class PackedRow():
+    """A view of one row of a PackedPixels store, indexed like a list"""
+    __slots__ = ("store", "y")
+
+    def __init__(self, store, y):
+        self.store = store
+        self.y = y
+
+    def _index(self, x):
+        if x < 0:
+            x += self.store.width
+        if not 0 <= x < self.store.width:
+            raise IndexError("pixel index out of range")
+        return x
+
+    def to_array(self):
+        return unpack_rows(self.store.data[self.y:self.y+1], self.store.width, self.store.bit_depth)[0]
+
+    def __len__(self):
+        return self.store.width
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return self.to_array()[x].tolist()
+        return self.store.get(self._index(x), self.y)
+
+    def __setitem__(self, x, value):
+        if isinstance(x, slice):
+            row = self.to_array()
+            row[x] = value
+            self.store.set_row(self.y, row)
+            return
+        self.store.set(self._index(x), self.y, value)
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def __eq__(self, other):
+        try:
+            return len(other) == len(self) and list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return "PackedRow({})".format(list(self))
+
+    def runs(self, start=0, stop=None):
+        """Yield (value, length) runs, optionally clipped to [start, stop)"""
+        row = self.to_array()[start:stop]
+        if not len(row):
+            return
+        edges = np.flatnonzero(row[1:] != row[:-1]) + 1
+        starts = np.concatenate(([0], edges))
+        lengths = np.diff(np.append(starts, len(row)))
+        yield from zip(row[starts].tolist(), lengths.tolist())
+
+class PackedPixels():
+    """
+    Pixel store that packs each palette index into bit_depth bits (1, 2, 4,
+    8 or 16), so a 4 colour canvas takes a quarter of a byte per pixel.
+    Behaves like a list of rows (pixels[y][x]); rows are views that unpack
+    on access. Use bit_depth_for(len(palette)) to choose the bit depth.
+    """
+    def __init__(self, width, height, bit_depth=8, fill_value=0):
+        if bit_depth not in BIT_DEPTHS:
+            raise ValueError("Unsupported bit depth: {}".format(bit_depth))
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.data = pack_rows(np.full((height, width), fill_value), bit_depth)
+
+    @classmethod
+    def from_array(cls, array, bit_depth):
+        """Create a packed store from a 2d array of palette indexes"""
+        array = np.asarray(array)
+        height, width = array.shape
+        pixels = cls(width, 0, bit_depth)
+        pixels._check_range(array)
+        pixels.data = pack_rows(array, bit_depth)
+        pixels.height = height
+        return pixels
+
+    @classmethod
+    def from_rows(cls, rows, bit_depth):
+        """Create a packed store from a list of rows of palette indexes"""
+        return cls.from_array(np.array([list(row) for row in rows], dtype=np.int32).reshape(len(rows), -1), bit_depth)
+
+    @classmethod
+    def from_bytes(cls, width, height, bit_depth, data):
+        """Create a packed store from the bytes of another store's data"""
+        pixels = cls(width, 0, bit_depth)
+        dtype = np.uint16 if bit_depth == 16 else np.uint8
+        row_length = width if bit_depth >= 8 else -(-width * bit_depth // 8)
+        pixels.data = np.frombuffer(data, dtype=dtype).reshape(height, row_length).copy()
+        pixels.height = height
+        return pixels
+
+    @property
+    def max_value(self):
+        """Largest palette index that fits in bit_depth bits"""
+        return (1 << self.bit_depth) - 1
+
+    def _check_range(self, values):
+        if np.size(values) and (np.min(values) < 0 or np.max(values) > self.max_value):
+            raise ValueError("Palette indexes must be between 0 and {} at {} bit".format(self.max_value, self.bit_depth))
+
+    def get(self, x, y):
+        bit_depth = self.bit_depth
+        if bit_depth >= 8:
+            return int(self.data[y, x])
+        bit = x * bit_depth
+        return (int(self.data[y, bit >> 3]) >> (8 - bit_depth - (bit & 7))) & self.max_value
+
+    def set(self, x, y, value):
+        if not 0 <= value <= self.max_value:
+            self._check_range(value)
+        bit_depth = self.bit_depth
+        if bit_depth >= 8:
+            self.data[y, x] = value
+            return
+        bit = x * bit_depth
+        shift = 8 - bit_depth - (bit & 7)
+        byte = int(self.data[y, bit >> 3])
+        self.data[y, bit >> 3] = (byte & ~(self.max_value << shift) & 0xFF) | (value << shift)
+
+    def set_row(self, y, values):
+        """Replace a whole row with a sequence of palette indexes"""
+        values = np.asarray(values)
+        self._check_range(values)
+        self.data[y] = pack_rows(values[np.newaxis], self.bit_depth)[0]
+
+    def get_block(self, x, y, width, height):
+        """A rectangle of pixels as a 2d int32 array, unpacking only its rows"""
+        return unpack_rows(self.data[y:y+height], self.width, self.bit_depth)[:, x:x+width]
+
+    def set_block(self, x, y, array):
+        """Write a 2d array of palette indexes with its top left corner at (x, y)"""
+        array = np.asarray(array)
+        self._check_range(array)
+        height, width = array.shape
+        rows = unpack_rows(self.data[y:y+height], self.width, self.bit_depth)
+        rows[:, x:x+width] = array
+        self.data[y:y+height] = pack_rows(rows, self.bit_depth)
+
+    def set_cells(self, xs, ys, values):
+        """
+        Write values at (xs[i], ys[i]), unpacking and repacking only the rows
+        they are on. Returns the previous values.
+        """
+        if not len(xs):
+            return np.empty(0, dtype=np.int32)
+        self._check_range(values)
+        rows, row_of = np.unique(ys, return_inverse=True)
+        unpacked = unpack_rows(self.data[rows], self.width, self.bit_depth)
+        previous = unpacked[row_of, xs]
+        unpacked[row_of, xs] = values
+        self.data[rows] = pack_rows(unpacked, self.bit_depth)
+        return previous
+
+    def set_bit_depth(self, bit_depth):
+        """Repack every pixel at a different bit depth"""
+        if bit_depth == self.bit_depth:
+            return
+        array = self.to_array()
+        if bit_depth not in BIT_DEPTHS:
+            raise ValueError("Unsupported bit depth: {}".format(bit_depth))
+        if array.size and array.max() >= 1 << bit_depth:
+            raise ValueError("Pixels use palette indexes that don't fit in {} bits".format(bit_depth))
+        self.data = pack_rows(array, bit_depth)
+        self.bit_depth = bit_depth
+
+    def to_array(self):
+        """Every pixel as a 2d int32 numpy array"""
+        return unpack_rows(self.data, self.width, self.bit_depth)
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, y):
+        if isinstance(y, slice):
+            return [PackedRow(self, yn) for yn in range(*y.indices(self.height))]
+        if y < 0:
+            y += self.height
+        if not 0 <= y < self.height:
+            raise IndexError("row index out of range")
+        return PackedRow(self, y)
+
+    def __setitem__(self, y, row):
+        self.set_row(y, list(row))
+
+    def __iter__(self):
+        return (PackedRow(self, y) for y in range(self.height))
+
+    def __eq__(self, other):
+        if isinstance(other, PackedPixels):
+            return np.array_equal(self.to_array(), other.to_array())
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return "PackedPixels({}x{}, {} bit)".format(self.width, self.height, self.bit_depth)
+
+    def copy(self):
+        pixels = PackedPixels(self.width, 0, self.bit_depth)
+        pixels.data = self.data.copy()
+        pixels.height = self.height
+        return pixels
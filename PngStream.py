@@ -0,0 +1,91 @@
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+ADLER_BASE = 65521
+
+def adler32_combine(adler1, adler2, length2):
+    """
+    Checksum of two pieces of data joined together, from their separate
+    adler32 checksums. Port of adler32_combine from zlib.
+    """
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + ADLER_BASE - remainder
+    sum1 %= ADLER_BASE
+    sum2 %= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+def _render_and_compress(render, level, last):
+    """Render a band of rows and compress it as raw deflate blocks"""
+    raw = b"".join(b"\x00" + row for row in render())
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(raw)
+    #A sync flush ends on a byte boundary so bands can be concatenated
+    data += compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(raw), len(raw)
+
+class PngStreamWriter():
+    """
+    Writes a PNG one band of rows at a time, so the whole image never has
+    to be in memory. Bands are rendered and deflated on a thread pool and
+    joined into one zlib stream, in the same way as pigz.
+    """
+    def __init__(self, filename, width, height, alpha=True, level=6, workers=None):
+        self.width = width
+        self.height = height
+        self.level = level
+        workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = workers * 2
+        self.pending = deque()
+        self.adler = 1
+        self.rows_queued = 0
+        self.file = open(filename, "wb")
+        self.file.write(PNG_SIGNATURE)
+        colour_type = 6 if alpha else 2
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0))
+        #zlib header for the deflate stream split across the IDAT chunks
+        self._write_chunk(b"IDAT", b"\x78\x9c")
+
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF))
+
+    def _write_next_band(self):
+        data, adler, length = self.pending.popleft().result()
+        self.adler = adler32_combine(self.adler, adler, length)
+        self._write_chunk(b"IDAT", data)
+
+    def add_band(self, row_count, render):
+        """
+        Queue a band of row_count rows. render is called on a worker thread and
+        returns a list of rows, each the pixel bytes for one output row.
+        Bands are written in the order they are added.
+        """
+        self.rows_queued += row_count
+        last = self.rows_queued >= self.height
+        self.pending.append(self.pool.submit(_render_and_compress, render, self.level, last))
+        #Limit the bands held in memory
+        while len(self.pending) >= self.max_pending:
+            self._write_next_band()
+
+    def close(self):
+        """Write the remaining bands and finish the file"""
+        try:
+            while self.pending:
+                self._write_next_band()
+            if self.rows_queued != self.height:
+                raise ValueError("Wrote {} rows, expected {}".format(self.rows_queued, self.height))
+            self._write_chunk(b"IDAT", struct.pack(">I", self.adler & 0xFFFFFFFF))
+            self._write_chunk(b"IEND", b"")
+        finally:
+            self.pool.shutdown()
+            self.file.close()
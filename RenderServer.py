@@ -0,0 +1,226 @@
+"""
+Local HTTP server that renders .pxlart files to PNG on demand.
+
+Usage:
+    python RenderServer.py --root ./savedArt --port 8765 --workers 8
+
+    GET /render?path=sprite.pxlart&scale=4[&transparent=0]   -> image/png
+    GET /stats                                               -> JSON cache and timing stats
+
+Parsed Art objects are kept in an LRU cache keyed by path, modification
+time and size, so an edited file is reloaded on its next request. Rendered
+PNGs are cached the same way per scale. Requests are handled by a fixed
+pool of worker threads.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from Art import Art
+from Instrumentation import Instrumentation
+
+MAX_SCALE = 64
+MAX_OUTPUT_PIXELS = 4096*4096
+
+#Raised by a file that can't be parsed or rendered, e.g. a corrupt packed line or a "#fff" palette colour
+DECODE_ERRORS = (OSError, ValueError, KeyError, IndexError, UnicodeDecodeError, zlib.error)
+
+class LRUCache():
+    """Thread-safe least recently used cache with a maximum number of entries"""
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class RenderError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Renderer():
+    """
+    Loads and renders .pxlart files under root, with caching.
+    Paths outside root are refused.
+    """
+    def __init__(self, root=".", art_cache_size=64, render_cache_size=256):
+        self.root = os.path.realpath(root)
+        self.art_cache = LRUCache(art_cache_size)
+        self.render_cache = LRUCache(render_cache_size)
+        self.instrumentation = Instrumentation(enabled=True)
+        self.stats_lock = threading.Lock()
+
+    def _record(self, name, seconds):
+        with self.stats_lock:
+            self.instrumentation.record(name, seconds)
+
+    def _resolve(self, path):
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, full_path]) != self.root or not full_path.endswith(".pxlart"):
+            raise RenderError(403, "Not a .pxlart file under the render root: {}".format(path))
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            raise RenderError(404, "No such file: {}".format(path))
+        return full_path, (full_path, stat.st_mtime_ns, stat.st_size)
+
+    def get_art(self, path):
+        """The Art object for a path, loaded from disk only if it has changed"""
+        full_path, key = self._resolve(path)
+        art = self.art_cache.get(key)
+        if art is None:
+            start = time.perf_counter()
+            try:
+                art = Art.load_from_file(full_path)
+            except DECODE_ERRORS as e:
+                raise RenderError(422, "Could not load {}: {}".format(path, e))
+            self._record("load", time.perf_counter() - start)
+            self.art_cache.put(key, art)
+        return key, art
+
+    def render(self, path, scale=1, transparent_palette_index=None):
+        """PNG bytes of a file at a scale"""
+        if not 1 <= scale <= MAX_SCALE:
+            raise RenderError(400, "scale must be between 1 and {}".format(MAX_SCALE))
+        key, art = self.get_art(path)
+        render_key = key + (scale, transparent_palette_index)
+        png = self.render_cache.get(render_key)
+        if png is None:
+            width, height = len(art.pixels[0]), len(art.pixels)
+            if width*height*scale*scale > MAX_OUTPUT_PIXELS:
+                raise RenderError(400, "Rendered image would be too large")
+            start = time.perf_counter()
+            try:
+                png = art.export_to_bytes("png", scale, transparent_palette_index)
+            except DECODE_ERRORS as e:
+                raise RenderError(422, "Could not render {}: {}".format(path, e))
+            self._record("render", time.perf_counter() - start)
+            self.render_cache.put(render_key, png)
+        return png
+
+    def stats(self):
+        with self.stats_lock:
+            timings = {name: self.instrumentation.stats(name) for name in self.instrumentation.counters}
+        return {
+            "art_cache": self.art_cache.stats(),
+            "render_cache": self.render_cache.stats(),
+            "timings": timings,
+        }
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        renderer = self.server.renderer
+        try:
+            if url.path == "/render":
+                if "path" not in query:
+                    raise RenderError(400, "Missing path")
+                try:
+                    scale = int(query.get("scale", ["1"])[0])
+                    transparent = query.get("transparent", [None])[0]
+                    transparent = None if transparent is None else int(transparent)
+                except ValueError:
+                    raise RenderError(400, "scale and transparent must be integers")
+                self._send(200, "image/png", renderer.render(query["path"][0], scale, transparent))
+            elif url.path == "/stats":
+                self._send(200, "application/json", json.dumps(renderer.stats(), indent=2).encode())
+            else:
+                raise RenderError(404, "Unknown endpoint: {}".format(url.path))
+        except RenderError as e:
+            self._send(e.status, "text/plain", str(e).encode())
+        except Exception:
+            #Always answer, so the client doesn't just see the connection close
+            print("Error handling {}:".format(self.path), file=sys.stderr)
+            traceback.print_exc()
+            self._send(500, "text/plain", b"Internal server error")
+
+class RenderServer(HTTPServer):
+    """HTTP server that hands each connection to a fixed-size thread pool"""
+    request_queue_size = 128
+
+    def __init__(self, address, renderer, workers=8, verbose=False):
+        super().__init__(address, RenderRequestHandler)
+        self.renderer = renderer
+        self.verbose = verbose
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Render .pxlart files to PNG over HTTP.")
+    parser.add_argument("--root", default=".", help="Directory that files are served from")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--art-cache", type=int, default=64, help="Number of parsed files to keep")
+    parser.add_argument("--render-cache", type=int, default=256, help="Number of rendered PNGs to keep")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    renderer = Renderer(args.root, args.art_cache, args.render_cache)
+    server = RenderServer((args.host, args.port), renderer, args.workers, args.verbose)
+    print("Serving {} on http://{}:{}/".format(renderer.root, args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Record editing sessions and replay them headlessly as benchmarks.
+
+Usage:
+    python Session.py session.pxlsession                     # replay 3 times and print per-event latency
+    python Session.py session.pxlsession --repeat 5 --output results.json
+    python Session.py session.pxlsession --compare old.json  # flag regressions against a previous replay
+
+A session log is a text file with one event per line:
+
+    kind ms_since_previous_event duration_us args...
+
+    o                          switch to new art, given by the "a" lines that follow
+    a <.pxlart line>           a line of that art
+    h length                   undo history length (PixelArtApp.art_history_length)
+    b width symbol ...         clipboard contents when recording started, row by row
+    t tool x y symbol [sx sy]  tool activation (sx sy: start of a shape)
+    d tool x y symbol          tool activation while dragging
+    y mode [ways tw th]        symmetry changed ("-" for none)
+    p index #rrggbb            palette colour changed
+    P #rrggbb ...              palette randomised, then sorted
+    s                          palette sorted
+    r index symbol             colour replaced
+    R size                     palette resized (PixelArtApp.set_palette_size)
+    g operation x y w h args   region operation, an Art method run on the selection
+    c x y w h                  selection copied to the clipboard (a cut is then a fill_rect)
+    v x y                      clipboard pasted
+    u                          undo
+    z scale                    zoom (see PixelArtApp._set_pixel_size)
+
+duration_us is how long the editor took to handle the event, including
+redrawing the canvas, so it can be compared with the headless replay time.
+The replay runs the same Art and tool calls as the editor without a canvas;
+zoom only affects the canvas, so it is counted but not replayed.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+from Art import Art, Pencil, Bucket, PartialBucket, MirroredPencil, SymmetryTool, ShapeTool, Line, Rectangle, Ellipse
+from Symmetry import Symmetry
+from Instrumentation import Instrumentation
+from benchmark import get_metadata, compare_results
+
+SESSION_HEADER = "pxlsession 1"
+
+TOOL_TYPES = {tool_type.__name__: tool_type for tool_type in
+              (Pencil, Bucket, PartialBucket, MirroredPencil, Line, Rectangle, Ellipse)}
+
+def tool_name(tool):
+    """A name for a tool that make_tool can rebuild it from, e.g. "Bucket:global" """
+    name = type(tool).__name__
+    if isinstance(tool, Bucket) and not tool.contiguous:
+        name += ":global"
+    elif isinstance(tool, MirroredPencil):
+        name += ":" + tool.axis
+    elif isinstance(tool, ShapeTool) and tool.filled:
+        name += ":filled"
+    return name
+
+def make_tool(name):
+    """Build a tool from its tool_name"""
+    type_name, _, option = name.partition(":")
+    tool_type = TOOL_TYPES[type_name]
+    if issubclass(tool_type, Bucket):
+        return tool_type(contiguous=option != "global")
+    if tool_type is MirroredPencil:
+        return tool_type(option or "x")
+    if issubclass(tool_type, ShapeTool):
+        return tool_type(filled=option == "filled")
+    return tool_type()
+
+def symmetry_args(symmetry):
+    if symmetry is None:
+        return ["-"]
+    return [symmetry.mode, symmetry.ways, symmetry.tile_size[0], symmetry.tile_size[1]]
+
+def make_symmetry(args):
+    if args[0] == "-":
+        return None
+    mode, ways, tile_w, tile_h = args
+    return Symmetry(mode, int(ways), (int(tile_w), int(tile_h)))
+
+class SessionRecorder():
+    """
+    Writes editor events to a session log as they happen.
+    The art being edited when recording starts is written first.
+    """
+    def __init__(self, filename, art, symmetry=None, history_length=None, clipboard=None):
+        self.filename = filename
+        #Line buffered, so the log survives the editor being closed mid-session
+        self.file = open(filename, "w", buffering=1)
+        self.file.write(SESSION_HEADER + "\n")
+        self.last_time = time.perf_counter()
+        self.events = 0
+        if history_length is not None:
+            self.record("h", 0, history_length)
+        self.record_art(art)
+        if symmetry is not None:
+            self.record("y", 0, *symmetry_args(symmetry))
+        if clipboard:
+            self.record("b", 0, len(clipboard[0]), *[symbol for row in clipboard for symbol in row])
+
+    def record(self, kind, duration, *args):
+        """Write one event that took duration seconds"""
+        now = time.perf_counter()
+        since = max(0, round((now - duration - self.last_time) * 1000))
+        self.last_time = now
+        self.file.write(" ".join([kind, str(since), str(round(duration * 1e6))] + [str(arg) for arg in args]) + "\n")
+        self.events += 1
+
+    def record_art(self, art, duration=0):
+        """Switch to new art (loaded, resized, cleared...)"""
+        self.record("o", duration)
+        lines = io.StringIO()
+        art.write_to(lines)
+        for line in lines.getvalue().splitlines():
+            self.file.write("a " + line + "\n")
+
+    def record_tool(self, tool, location, symbol, duration, drag=False):
+        args = [tool_name(tool), location[0], location[1], symbol]
+        if isinstance(tool, ShapeTool) and tool.start is not None:
+            args += list(tool.start)
+        self.record("d" if drag else "t", duration, *args)
+
+    def close(self):
+        self.file.close()
+
+def load_session(filename):
+    """
+    Read a session log. Returns a list of events as
+    (kind, ms_since_previous, duration_seconds, args); the args of an "o"
+    event are the Art to switch to.
+    """
+    events = []
+    with open(filename) as f:
+        if f.readline().strip() != SESSION_HEADER:
+            raise ValueError("Not a session log: {}".format(filename))
+        art_lines = None
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("a "):
+                art_lines.append(line[2:])
+                continue
+            if art_lines is not None:
+                events[-1] = events[-1][:3] + (Art.read_from(art_lines),)
+                art_lines = None
+            if not line:
+                continue
+            kind, since, duration, *args = line.split(" ")
+            events.append((kind, int(since), int(duration) / 1e6, args))
+            if kind == "o":
+                art_lines = []
+        if art_lines is not None:
+            events[-1] = events[-1][:3] + (Art.read_from(art_lines),)
+    return events
+
+def event_name(kind, args):
+    """Name that an event's timings are grouped under"""
+    names = {"o": "open", "h": "history_length", "b": "clipboard", "y": "symmetry", "p": "palette_colour",
+             "P": "randomise_palette", "s": "sort_palette", "r": "replace_colour", "R": "palette_size",
+             "c": "copy", "v": "paste", "u": "undo", "z": "zoom"}
+    if kind == "t":
+        return "tool:" + args[0]
+    if kind == "d":
+        return "drag:" + args[0]
+    if kind == "g":
+        return "region:" + args[0]
+    return names.get(kind, kind)
+
+def region_args(args):
+    """Arguments of a region operation event: ints, or True/False for flags"""
+    return [arg == "True" if arg in ("True", "False") else int(arg) for arg in args]
+
+#Art methods that a "g" event may run
+REGION_OPERATIONS = {"fill_rect", "move_region", "flip_region", "rotate_region", "replace_colour_in_region"}
+
+class SessionReplayer():
+    """
+    Replays session events against an Art object, the way PixelArtApp would
+    without its canvas, timing each event.
+    """
+    def __init__(self, history_length=5):
+        self.art = None
+        self.history = []
+        #Overridden by the session's "h" event; the default is PixelArtApp's
+        self.history_length = history_length
+        self.symmetry = None
+        self.tools = {}
+        self.clipboard = None
+
+    def _get_tool(self, name):
+        if name not in self.tools:
+            self.tools[name] = make_tool(name)
+        return self.tools[name]
+
+    def apply(self, kind, args):
+        """Apply one event"""
+        if kind == "o":
+            self.art = args.copy()
+            self.history = []
+        elif kind == "h":
+            self.history_length = int(args[0])
+        elif kind == "b":
+            width, symbols = int(args[0]), [int(symbol) for symbol in args[1:]]
+            self.clipboard = [symbols[i:i+width] for i in range(0, len(symbols), width)]
+        elif kind in ("t", "d"):
+            tool = self._get_tool(args[0])
+            if isinstance(tool, ShapeTool):
+                tool.begin((int(args[4]), int(args[5])) if len(args) > 4 else None)
+            if self.symmetry:
+                tool = SymmetryTool(tool, self.symmetry)
+            try:
+                delta = self.art.apply_tool(tool, (int(args[1]), int(args[2])), int(args[3]))
+            except IndexError:
+                return
+            self._add_to_history(delta)
+        elif kind == "u":
+            if self.history:
+                self.art.apply_delta(self.history.pop(), undo=True)
+        elif kind == "y":
+            self.symmetry = make_symmetry(args)
+        elif kind == "p":
+            self.art.palette[int(args[0])] = args[1]
+        elif kind == "P":
+            for index, colour in zip(list(self.art.palette), args):
+                self.art.palette[index] = colour
+            self.art.sort_palette()
+            self.history = []
+        elif kind == "s":
+            self.art.sort_palette()
+            self.history = []
+        elif kind == "r":
+            self._add_to_history(self.art.replace_colour(int(args[0]), int(args[1])))
+        elif kind == "R":
+            self.art.resize_palette(int(args[0]))
+            self.history = []
+            if self.clipboard:
+                self.clipboard = [[symbol if symbol < len(self.art.palette) else 0 for symbol in row] for row in self.clipboard]
+        elif kind == "g":
+            if args[0] not in REGION_OPERATIONS:
+                raise ValueError("Unknown region operation: {}".format(args[0]))
+            self._add_to_history(getattr(self.art, args[0])(*region_args(args[1:])))
+        elif kind == "c":
+            self.clipboard = self.art.copy_region(*region_args(args))
+        elif kind == "v":
+            if self.clipboard:
+                self._add_to_history(self.art.paste(self.clipboard, int(args[0]), int(args[1])))
+
+    def _add_to_history(self, delta):
+        if not delta:
+            return
+        self.history.append(delta)
+        if len(self.history) >= self.history_length:
+            self.history.pop(0)
+
+def replay(events, repeat=1):
+    """
+    Replay a loaded session repeat times.
+    Returns (replayed, recorded, passes): Instrumentation of the replay
+    timings and of the timings recorded by the editor, both grouped by
+    event_name, and the total seconds per event_name for each replay.
+    """
+    replayed = Instrumentation(enabled=True, window=len(events)*repeat)
+    recorded = Instrumentation(enabled=True, window=len(events))
+    for kind, _, duration, args in events:
+        if kind != "z":
+            recorded.record(event_name(kind, args), duration)
+    passes = []
+    for _ in range(repeat):
+        replayer = SessionReplayer()
+        totals = {}
+        for kind, _, _, args in events:
+            name = event_name(kind, args)
+            if kind == "z":
+                replayed.count(name)
+                continue
+            start = time.perf_counter()
+            replayer.apply(kind, args)
+            seconds = time.perf_counter() - start
+            replayed.record(name, seconds)
+            totals[name] = totals.get(name, 0) + seconds
+        passes.append(totals)
+    return replayed, recorded, passes
+
+def replay_results(filename, events, passes):
+    """
+    Replay timings in the same result format as benchmark.py: one result per
+    event type, timing the total spent on that type in each replay.
+    """
+    sizes = [list(args.image_size) for kind, _, _, args in events if kind == "o"]
+    results = []
+    for name in sorted(passes[0]):
+        timings = [totals[name] for totals in passes]
+        results.append({
+            "benchmark": "replay:{}:{}".format(os.path.basename(filename), name),
+            "size": sizes[0] if sizes else [0, 0],
+            "backend": "session",
+            "repeat": len(passes),
+            "events": sum(1 for kind, _, _, args in events if event_name(kind, args) == name),
+            "min": min(timings),
+            "mean": sum(timings)/len(timings),
+            "max": max(timings),
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded editing session and report per-event latency.")
+    parser.add_argument("session", help="Session log recorded with Options > Record Session")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to replay the session")
+    parser.add_argument("--output", help="File to write JSON results to")
+    parser.add_argument("--compare", help="Previous JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    events = load_session(args.session)
+    replayed, recorded, passes = replay(events, args.repeat)
+    print("Replayed {} events x{}".format(len(events), args.repeat))
+    for line in replayed.summary_lines():
+        print("  replay  " + line)
+    for line in recorded.summary_lines():
+        print("  editor  " + line)
+
+    results = replay_results(args.session, events, passes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": get_metadata(), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        regressions = compare_results(old_report["results"], results, args.threshold)
+        for (name, _, _), old, new, ratio in regressions:
+            print("REGRESSION {}: {:.6f}s -> {:.6f}s ({:.2f}x)".format(name, old, new, ratio), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
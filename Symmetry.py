@@ -0,0 +1,99 @@
+import math
+
+class Symmetry():
+    """
+    Maps a pixel to all of its symmetric counterparts on a canvas.
+
+    modes:
+        "x"        mirror top to bottom
+        "y"        mirror left to right
+        "xy"       mirror both ways (4 copies)
+        "diagonal" mirror across both diagonals (4 copies)
+        "radial"   rotate around the centre, `ways` copies
+        "tiled"    repeat every `tile_size` pixels, wrapping around the edges
+
+    Index maps are built once per canvas size and reused for every stroke.
+    """
+    modes = ("x", "y", "xy", "diagonal", "radial", "tiled")
+
+    def __init__(self, mode="x", ways=4, tile_size=(8, 8)):
+        if mode not in self.modes:
+            raise ValueError("Unknown symmetry mode: {}".format(mode))
+        self.mode = mode
+        self.ways = max(1, ways)
+        self.tile_size = tile_size
+        self._maps = {}
+
+    def __repr__(self):
+        return "Symmetry({!r}, ways={}, tile_size={})".format(self.mode, self.ways, self.tile_size)
+
+    def _get_maps(self, width, height):
+        """Get (or build) the index maps for a canvas size"""
+        maps = self._maps.get((width, height))
+        if maps is None:
+            maps = self._build_maps(width, height)
+            self._maps[(width, height)] = maps
+        return maps
+
+    def _build_maps(self, width, height):
+        if self.mode in ("x", "y", "xy"):
+            #Mirrored coordinate for every column and row
+            return {
+                "x": [width-1-x for x in range(width)],
+                "y": [height-1-y for y in range(height)],
+            }
+        if self.mode == "tiled":
+            tile_w, tile_h = self.tile_size
+            return {
+                "dx": list(range(0, width, max(1, tile_w))),
+                "dy": list(range(0, height, max(1, tile_h))),
+            }
+        if self.mode == "diagonal":
+            #Scale factors so non-square canvases map corner to corner
+            return {
+                "x_from_y": [round(y*(width-1)/max(1, height-1)) for y in range(height)],
+                "y_from_x": [round(x*(height-1)/max(1, width-1)) for x in range(width)],
+            }
+        #Radial: rotation matrix for each copy, and a per-pixel cache
+        angles = [2*math.pi*k/self.ways for k in range(self.ways)]
+        return {
+            "rotations": [(math.cos(a), math.sin(a)) for a in angles],
+            "centre": ((width-1)/2, (height-1)/2),
+            "cache": {},
+        }
+
+    def targets(self, x, y, width, height):
+        """List of (x, y) locations that mirror (x, y), including itself"""
+        maps = self._get_maps(width, height)
+        if self.mode == "y":
+            return [(x, y), (maps["x"][x], y)]
+        if self.mode == "x":
+            return [(x, y), (x, maps["y"][y])]
+        if self.mode == "xy":
+            mx, my = maps["x"][x], maps["y"][y]
+            return [(x, y), (mx, y), (x, my), (mx, my)]
+        if self.mode == "tiled":
+            return [((x+dx) % width, (y+dy) % height) for dy in maps["dy"] for dx in maps["dx"]]
+        if self.mode == "diagonal":
+            #Reflect across the main diagonal and the anti-diagonal
+            dx, dy = maps["x_from_y"][y], maps["y_from_x"][x]
+            return [(x, y), (dx, dy), (width-1-dx, height-1-dy), (width-1-x, height-1-y)]
+        cache = maps["cache"]
+        if (x, y) not in cache:
+            cx, cy = maps["centre"]
+            locations = []
+            for cos, sin in maps["rotations"]:
+                rx = round(cx + (x-cx)*cos - (y-cy)*sin)
+                ry = round(cy + (x-cx)*sin + (y-cy)*cos)
+                if 0 <= rx < width and 0 <= ry < height:
+                    locations.append((rx, ry))
+            cache[(x, y)] = locations
+        return cache[(x, y)]
+
+    def expand(self, locations, width, height):
+        """All symmetric locations for a list of locations, without duplicates"""
+        expanded = {}
+        for x, y in locations:
+            for target in self.targets(x, y, width, height):
+                expanded[target] = True
+        return list(expanded)
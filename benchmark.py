@@ -0,0 +1,243 @@
+"""
+Headless benchmarks for the Art model, tools and export paths.
+
+Usage:
+    python benchmark.py                          # all benchmarks, all sizes
+    python benchmark.py --sizes 16 256 --repeat 5 --output results.json
+    python benchmark.py --compare old.json       # flag regressions against a previous run
+    python benchmark.py --backend packed         # use the bit-packed pixel store
+
+Results are written as JSON so they can be kept and compared between releases.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from Art import Art, Bucket, PartialBucket, Line, Ellipse
+from Animation import Animation, ArtAnimation
+
+DEFAULT_SIZES = [16, 64, 256, 1024, 2048]
+
+def new_art(size, backend="dense"):
+    """Blank art using a pixel store: "dense", "sparse" or "packed" """
+    return Art(image_size=(size, size), sparse=backend == "sparse", packed=backend == "packed")
+
+def make_art(size, backend="dense", seed=0):
+    """Create a reproducible test image with a few filled rectangles"""
+    rng = random.Random(seed)
+    art = new_art(size, backend)
+    for _ in range(8):
+        w, h = rng.randint(1, max(1, size//4)), rng.randint(1, max(1, size//4))
+        art.fill_rect(rng.randrange(size), rng.randrange(size), w, h, rng.randrange(1, len(art.palette)))
+    return art
+
+def bench_copy(size, backend, workdir):
+    art = make_art(size, backend)
+    return lambda: art.copy()
+
+def bench_save(size, backend, workdir):
+    art = make_art(size, backend)
+    filename = os.path.join(workdir, "save.pxlart")
+    return lambda: art.save_to_file(filename)
+
+def bench_load(size, backend, workdir):
+    filename = os.path.join(workdir, "load.pxlart")
+    make_art(size, backend).save_to_file(filename)
+    return lambda: Art.load_from_file(filename)
+
+def bench_export_png(size, backend, workdir):
+    art = make_art(size, backend)
+    filename = os.path.join(workdir, "export.png")
+    return lambda: art.export_to_image_file(filename, scalar=1)
+
+def bench_export_png_banded(size, backend, workdir):
+    art = make_art(size, backend)
+    filename = os.path.join(workdir, "export_banded.png")
+    return lambda: art.export_to_png_banded(filename, scalar=10)
+
+def bench_sort_palette(size, backend, workdir):
+    art = make_art(size, backend)
+    return lambda: art.sort_palette()
+
+def bench_bucket(size, backend, workdir):
+    art = make_art(size, backend)
+    tool = Bucket()
+    #Alternate colours so every run fills the same region
+    symbols = iter(range(1, 10**9))
+    return lambda: art.apply_tool(tool, (0, 0), 1 + next(symbols)%2)
+
+def bench_partial_bucket(size, backend, workdir):
+    def run():
+        art = new_art(size, backend)
+        art.apply_tool(PartialBucket(), (0, 0), 1)
+    return run
+
+def bench_global_bucket(size, backend, workdir):
+    art = make_art(size, backend)
+    tool = Bucket(contiguous=False)
+    symbols = iter(range(1, 10**9))
+    return lambda: art.apply_tool(tool, (0, 0), 1 + next(symbols)%2)
+
+def bench_undo(size, backend, workdir):
+    art = make_art(size, backend)
+    delta = art.apply_tool(Bucket(contiguous=False), (0, 0), 3)
+    #Undo and redo a change to most of the canvas
+    def run():
+        art.apply_delta(delta, undo=True)
+        art.apply_delta(delta)
+    return run
+
+def bench_shapes(size, backend, workdir):
+    art = make_art(size, backend)
+    line, ellipse = Line(), Ellipse(filled=True)
+    def run():
+        line.begin((0, 0))
+        art.apply_tool(line, (size-1, size//2), 1)
+        ellipse.begin((size//4, size//4))
+        art.apply_tool(ellipse, (size*3//4, size*3//4), 2)
+    return run
+
+def bench_export_gif(size, backend, workdir, frame_count=4):
+    frames = []
+    for frame_no in range(frame_count):
+        filename = os.path.join(workdir, "frame{}.png".format(frame_no))
+        make_art(size, backend, seed=frame_no).export_to_image_file(filename, scalar=1)
+        frames.append(filename)
+    animation = Animation(frames)
+    filename = os.path.join(workdir, "animation.gif")
+    return lambda: animation.export_as_gif(filename)
+
+def bench_art_animation_export_gif(size, backend, workdir, frame_count=16):
+    rng = random.Random(0)
+    art = make_art(size, backend)
+    animation = ArtAnimation()
+    for frame_no in range(frame_count):
+        #Sprite-like animation: a small block moves each frame
+        art = art.copy()
+        art.fill_rect(rng.randrange(size), rng.randrange(size), 2, 2, rng.randrange(1, len(art.palette)))
+        animation.append(art)
+    filename = os.path.join(workdir, "art_animation.gif")
+    return lambda: animation.export_as_gif(filename)
+
+BENCHMARKS = {
+    "art_copy": bench_copy,
+    "save_to_file": bench_save,
+    "load_from_file": bench_load,
+    "export_to_image_file": bench_export_png,
+    "export_to_png_banded": bench_export_png_banded,
+    "sort_palette": bench_sort_palette,
+    "bucket_fill": bench_bucket,
+    "partial_bucket_fill": bench_partial_bucket,
+    "global_bucket_fill": bench_global_bucket,
+    "undo_redo": bench_undo,
+    "shape_tools": bench_shapes,
+    "animation_export_gif": bench_export_gif,
+    "art_animation_export_gif": bench_art_animation_export_gif,
+}
+
+def time_function(function, repeat):
+    """Run a function repeat times and return the timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def get_metadata():
+    """Information about the machine and code version the results came from"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commit": commit,
+    }
+
+def run_benchmarks(names, sizes, repeat, backend="dense", log=print):
+    """Run the named benchmarks at each size and return a list of result dicts"""
+    results = []
+    workdir = tempfile.mkdtemp(prefix="pxlart_bench_")
+    try:
+        for name in names:
+            for size in sizes:
+                function = BENCHMARKS[name](size, backend, workdir)
+                timings = time_function(function, repeat)
+                result = {
+                    "benchmark": name,
+                    "size": [size, size],
+                    "backend": backend,
+                    "repeat": repeat,
+                    "min": min(timings),
+                    "mean": sum(timings)/len(timings),
+                    "max": max(timings),
+                }
+                results.append(result)
+                log("{benchmark:>22} {size[0]:>5}x{size[1]:<5} {backend:>6}  min {min:.6f}s  mean {mean:.6f}s".format(**result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def compare_results(old_results, new_results, threshold=1.25):
+    """
+    Compare two lists of results by their min timings.
+    Returns a list of (key, old, new, ratio) where new is slower than old*threshold.
+    """
+    def key(result):
+        return (result["benchmark"], tuple(result["size"]), result["backend"])
+    old_by_key = {key(r): r for r in old_results}
+    regressions = []
+    for result in new_results:
+        old = old_by_key.get(key(result))
+        if old and old["min"] > 0:
+            ratio = result["min"] / old["min"]
+            if ratio > threshold:
+                regressions.append((key(result), old["min"], result["min"], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Art model, tools and export paths.")
+    parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backend", choices=["dense", "sparse", "packed"], default="dense", help="Pixel store to use")
+    parser.add_argument("--sparse", action="store_const", const="sparse", dest="backend", help="Same as --backend sparse")
+    parser.add_argument("--output", help="File to write JSON results to (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    #Progress goes to stderr so stdout can be piped as JSON
+    results = run_benchmarks(args.benchmarks, args.sizes, args.repeat, args.backend,
+                             log=lambda line: print(line, file=sys.stderr))
+    report = {"meta": get_metadata(), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        regressions = compare_results(old_report["results"], results, args.threshold)
+        for (name, size, backend), old, new, ratio in regressions:
+            print("REGRESSION {} {}x{} {}: {:.6f}s -> {:.6f}s ({:.2f}x)".format(name, size[0], size[1], backend, old, new, ratio), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Load test for RenderServer.
+
+Usage:
+    python RenderServer.py --root ./palettes &
+    python loadtest.py --paths envy_grows.pxlart --scales 1 4 16 --clients 16 --requests 2000
+
+Each client thread sends requests one after another, cycling through every
+path and scale. Prints throughput and latency percentiles, and the server's
+own cache and timing stats.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+def percentile(timings, percent):
+    return timings[min(len(timings)-1, int(len(timings) * percent / 100))]
+
+def run_load_test(base_url, paths, scales, clients, requests, timeout=30):
+    """
+    Send requests from clients threads. Returns a dict of throughput,
+    latency percentiles (seconds) and error counts.
+    """
+    urls = ["{}/render?{}".format(base_url, urlencode({"path": path, "scale": scale}))
+            for path, scale in itertools.product(paths, scales)]
+    next_request = itertools.count()
+    lock = threading.Lock()
+    timings, errors = [], {}
+
+    def client():
+        while True:
+            with lock:
+                n = next(next_request)
+            if n >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urls[n % len(urls)], timeout=timeout) as response:
+                    response.read()
+                error = None
+            except urllib.error.HTTPError as e:
+                error = "HTTP {}".format(e.code)
+            except (urllib.error.URLError, OSError) as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if error is None:
+                    timings.append(elapsed)
+                else:
+                    errors[error] = errors.get(error, 0) + 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    timings.sort()
+    result = {"requests": requests, "ok": len(timings), "errors": errors,
+              "duration": duration, "requests_per_second": requests / duration}
+    if timings:
+        result.update({"p50": percentile(timings, 50), "p90": percentile(timings, 90),
+                       "p99": percentile(timings, 99), "max": timings[-1]})
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running RenderServer.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--paths", nargs="+", required=True, help="Files to request, relative to the server root")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    result = run_load_test(args.url, args.paths, args.scales, args.clients, args.requests)
+    print("{requests} requests ({ok} ok) in {duration:.2f}s: {requests_per_second:.1f} req/s".format(**result))
+    if "p50" in result:
+        print("latency p50={:.1f}ms p90={:.1f}ms p99={:.1f}ms max={:.1f}ms".format(
+            result["p50"]*1000, result["p90"]*1000, result["p99"]*1000, result["max"]*1000))
+    if result["errors"]:
+        print("errors: {}".format(result["errors"]))
+    with urllib.request.urlopen("{}/stats".format(args.url)) as response:
+        print(json.dumps(json.loads(response.read()), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Tests for Art canvas operations on every pixel store.
+
+Usage:
+    python -m pytest test_Art.py
+"""
+import unittest
+
+from Art import Art, Bucket
+
+STORES = {
+    "list": {"packed": False},
+    "sparse": {"sparse": True},
+    "packed": {"packed": True},
+}
+
+def make_art(store, size=(8, 6)):
+    art = Art(image_size=size, **STORES[store])
+    for x in range(size[0]):
+        art.set_pixel(x, x % size[1], x % 8)
+    return art
+
+class CropTest(unittest.TestCase):
+    def test_crop_is_clipped_to_the_canvas(self):
+        for store in STORES:
+            with self.subTest(store=store):
+                art = make_art(store)
+                cropped = art.crop(-2, 3, 5, 10)
+                self.assertEqual(cropped.image_size, (3, 3))
+                self.assertEqual([list(row) for row in cropped.pixels],
+                                 [list(row[0:3]) for row in art.pixels[3:6]])
+                self.assertEqual(cropped.packed, art.packed)
+                self.assertEqual(cropped.sparse, art.sparse)
+
+    def test_empty_crop_raises(self):
+        for store in STORES:
+            for rect in [(0, 0, 0, 4), (2, 2, 4, 0), (8, 0, 2, 2), (0, 6, 2, 2), (-5, -5, 3, 3), (20, 20, 4, 4)]:
+                with self.subTest(store=store, rect=rect):
+                    with self.assertRaisesRegex(ValueError, "no pixels on the 8x6 canvas"):
+                        make_art(store).crop(*rect)
+
+    def test_zero_size_canvas_raises(self):
+        for store in STORES:
+            with self.subTest(store=store):
+                with self.assertRaises(ValueError):
+                    make_art(store).resize_canvas(0, 4)
+
+class DeltaTest(unittest.TestCase):
+    def test_undo_and_redo_restore_every_store(self):
+        for store in STORES:
+            with self.subTest(store=store):
+                art = make_art(store)
+                before = [list(row) for row in art.pixels]
+                delta = art.apply_tool(Bucket(contiguous=False), (1, 0), 5)
+                after = [list(row) for row in art.pixels]
+                art.apply_delta(delta, undo=True)
+                self.assertEqual([list(row) for row in art.pixels], before)
+                art.apply_delta(delta)
+                self.assertEqual([list(row) for row in art.pixels], after)
+                delta.undo(art.pixels)
+                self.assertEqual([list(row) for row in art.pixels], before)
+
+    def test_fill_delta_matches_its_changes(self):
+        art = Art(image_size=(8, 6))
+        art.fill_rect(2, 1, 3, 2, 4)
+        delta = art.apply_tool(Bucket(), (0, 0), 2)
+        cells = [(x, y) for y in range(6) for x in range(8) if not (2 <= x < 5 and 1 <= y < 3)]
+        self.assertEqual(len(delta), len(cells))
+        self.assertEqual(delta.bounds(), (0, 0, 8, 6))
+        self.assertEqual(sorted(delta.cells()), sorted(cells))
+        delta.record(0, 0, 2, 0)
+        self.assertEqual(len(delta), len(cells) - 1)
+        self.assertEqual(delta.changes[(1, 0)], (0, 2))
+        art.apply_delta(delta, undo=True)
+        self.assertEqual(art.pixels[0][0], 2)
+        self.assertEqual(art.pixels[0][1], 0)
+
+if __name__ == "__main__":
+    unittest.main()
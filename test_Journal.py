@@ -0,0 +1,96 @@
+"""
+Tests for Journal crash recovery.
+
+Usage:
+    python -m pytest test_Journal.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from Art import Art, Pencil, Rectangle
+from Journal import Journal
+
+def pixel_rows(art):
+    return [list(row) for row in art.pixels]
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.document = os.path.join(self.directory, "art.pxlart")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def draw(self, art, journal, location, symbol, tool=None):
+        delta = art.apply_tool(tool or Pencil(), location, symbol)
+        journal.record_delta(delta)
+        return delta
+
+    def read_journal(self):
+        with open(self.document + ".journal") as f:
+            return f.read()
+
+    def write_journal(self, text):
+        with open(self.document + ".journal", "w") as f:
+            f.write(text)
+
+    def test_recover_replays_edits(self):
+        art = Art(image_size=(8, 8))
+        journal = Journal(self.document, art)
+        self.draw(art, journal, (1, 1), 3)
+        rectangle = Rectangle(filled=True)
+        rectangle.begin((2, 2))
+        self.draw(art, journal, (6, 5), 5, rectangle)
+        undo = self.draw(art, journal, (7, 7), 2)
+        art.apply_delta(undo, undo=True)
+        journal.record_delta(undo, undo=True)
+        art.palette[4] = "#123456"
+        journal.record_palette_colour(4, "#123456")
+        journal.close()
+        recovered = Journal.recover(self.document)
+        self.assertEqual(pixel_rows(recovered), pixel_rows(art))
+        self.assertEqual(recovered.palette, art.palette)
+
+    def test_crash_after_resize_snapshot(self):
+        art = Art(image_size=(16, 16))
+        journal = Journal(self.document, art)
+        self.draw(art, journal, (12, 14), 3)
+        stale_journal = self.read_journal()
+        smaller = art.crop(0, 0, 8, 8)
+        journal.compact(smaller)
+        journal.close()
+        #Crash after the new snapshot was written, before its journal replaced the old one
+        self.write_journal(stale_journal)
+        recovered = Journal.recover(self.document)
+        self.assertEqual(pixel_rows(recovered), pixel_rows(smaller))
+
+    def test_crash_after_palette_sort_snapshot(self):
+        art = Art(palette={0: "#00ff00", 1: "#ff0000", 2: "#000000"}, image_size=(4, 4))
+        journal = Journal(self.document, art)
+        self.draw(art, journal, (0, 0), 1)
+        self.draw(art, journal, (1, 0), 2)
+        stale_journal = self.read_journal()
+        art.sort_palette()
+        self.assertEqual(art.palette[0], "#000000")
+        journal.compact()
+        journal.close()
+        self.write_journal(stale_journal)
+        recovered = Journal.recover(self.document)
+        self.assertEqual(pixel_rows(recovered), pixel_rows(art))
+        self.assertEqual(recovered.palette, art.palette)
+
+    def test_out_of_range_changes_are_skipped(self):
+        #A snapshot from before markers were written, with a journal that doesn't fit it
+        Art(image_size=(4, 4)).save_to_file(self.document + ".autosave")
+        self.write_journal("d 1 1 2 9 9 3 2 2 99\np 200 #ffffff\nd 3 3 1\n")
+        recovered = Journal.recover(self.document)
+        expected = Art(image_size=(4, 4))
+        expected.set_pixel(1, 1, 2)
+        expected.set_pixel(3, 3, 1)
+        self.assertEqual(pixel_rows(recovered), pixel_rows(expected))
+        self.assertEqual(recovered.palette, expected.palette)
+
+if __name__ == "__main__":
+    unittest.main()
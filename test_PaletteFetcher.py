@@ -0,0 +1,120 @@
+"""
+Tests for PaletteFetcher against a stub HTTP server on 127.0.0.1.
+
+Usage:
+    python -m pytest test_PaletteFetcher.py
+"""
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Art import PaletteLoader
+from PaletteFetcher import PaletteFetcher, PaletteFetchError, palette_filename
+
+COLOURLOVERS_JSON = json.dumps([{"colors": ["FF0000", "00FF00", "0000FF"]}])
+COLORMIND_JSON = json.dumps({"result": [[0, 0, 0], [255, 255, 255]]})
+COLOR_HEX_HTML = """<html><body>
+<div class="palettecolordivc" title="#112233"></div>
+<div class="palettecolordivc" title="#445566"></div>
+</body></html>"""
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, content_type, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_GET(self):
+        self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if self.path.startswith("/colourlovers.com/api/palette/1/"):
+            self._send(200, "application/json", COLOURLOVERS_JSON)
+        elif self.path == "/colormind.io/api/":
+            self._send(200, "application/json", COLORMIND_JSON)
+        elif self.path == "/color-hex.com/color-palette/1":
+            self._send(200, "text/html", COLOR_HEX_HTML)
+        elif self.path == "/color-hex.com/color-palette/503":
+            self._send(503, "text/plain", "busy", [("Retry-After", "0")])
+        else:
+            self._send(404, "text/plain", "not found")
+
+class BrokenParserLoader(PaletteLoader):
+    """Loader whose colourlovers parser fails with an unexpected exception"""
+    def parse_colourlovers(self, response):
+        raise AttributeError("unexpected body")
+
+class PaletteFetcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.hits = {}
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = "http://127.0.0.1:{}".format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def make_fetcher(self, loader=None):
+        loader = loader or PaletteLoader()
+        loader.colormind_url = self.base + "/colormind.io/api/"
+        return PaletteFetcher(max_concurrency=4, host_rate=0, retries=2, backoff=0, timeout=5, loader=loader)
+
+    def test_fetch_all(self):
+        urls = {
+            "colourlovers": self.base + "/colourlovers.com/palette/1/three",
+            "colormind": self.base + "/colormind.io/",
+            "color_hex": self.base + "/color-hex.com/color-palette/1",
+            "unavailable": self.base + "/color-hex.com/color-palette/503",
+            "missing": self.base + "/color-hex.com/color-palette/404",
+        }
+        palettes, errors = self.make_fetcher().fetch_all(urls.values())
+        self.assertEqual(palettes[urls["colourlovers"]], {0: "#FF0000", 1: "#00FF00", 2: "#0000FF"})
+        self.assertEqual(palettes[urls["colormind"]], {0: "#000000", 1: "#ffffff"})
+        self.assertEqual(palettes[urls["color_hex"]], {0: "#112233", 1: "#445566"})
+        self.assertEqual(set(errors), {urls["unavailable"], urls["missing"]})
+        self.assertIn("HTTP 503", str(errors[urls["unavailable"]]))
+        self.assertIn("HTTP 404", str(errors[urls["missing"]]))
+        #503 is retried, 404 is not
+        self.assertEqual(self.server.hits["/color-hex.com/color-palette/503"], 3)
+        self.assertEqual(self.server.hits["/color-hex.com/color-palette/404"], 1)
+
+    def test_fetch_iter_yields_every_url(self):
+        urls = [self.base + "/color-hex.com/color-palette/1", self.base + "/color-hex.com/color-palette/404"]
+        async def collect():
+            return [result async for result in self.make_fetcher().fetch_iter(urls)]
+        results = asyncio.run(collect())
+        self.assertEqual(sorted(url for url, _, _ in results), sorted(urls))
+        errors = {url: error for url, _, error in results}
+        self.assertIsNone(errors[urls[0]])
+        self.assertIsInstance(errors[urls[1]], PaletteFetchError)
+
+    def test_unexpected_parser_error_is_reported(self):
+        url = self.base + "/colourlovers.com/palette/1/broken"
+        async def collect():
+            fetcher = self.make_fetcher(BrokenParserLoader())
+            return [result async for result in fetcher.fetch_iter([url])]
+        #Before errors other than PaletteFetchError were reported, this never finished
+        results = asyncio.run(asyncio.wait_for(collect(), timeout=10))
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0][2], AttributeError)
+
+    def test_palette_filename(self):
+        self.assertEqual(palette_filename("http://www.colourlovers.com/palette/49963/let_them_eat_cake"),
+                         "palette_49963_let_them_eat_cake.pxlart")
+        first = palette_filename("http://colormind.io/", {0: "#000000", 1: "#ffffff"})
+        second = palette_filename("http://colormind.io/", {0: "#111111", 1: "#ffffff"})
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.startswith("colormind.io_"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Tests for RenderServer error responses.
+
+Usage:
+    python -m pytest test_RenderServer.py
+"""
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from Art import Art
+from RenderServer import Renderer, RenderServer
+
+class RenderServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        Art(image_size=(4, 3)).save_to_file(os.path.join(cls.root, "good.pxlart"))
+        with open(os.path.join(cls.root, "corrupt.pxlart"), "w") as f:
+            f.write("size, 4 3\npalette, #FFFFFF #000000\npacked, 1 bm90IHpsaWI=\n")
+        with open(os.path.join(cls.root, "short_colour.pxlart"), "w") as f:
+            f.write("size, 2 1\npalette, #fff #000000\npixels, 0 1\n")
+        cls.renderer = Renderer(cls.root)
+        cls.server = RenderServer(("127.0.0.1", 0), cls.renderer, workers=2)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = "http://127.0.0.1:{}".format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root)
+
+    def status(self, path):
+        try:
+            with urlopen(self.base + path, timeout=10) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+    def test_render(self):
+        status, body = self.status("/render?path=good.pxlart&scale=2")
+        self.assertEqual(status, 200)
+        self.assertTrue(body.startswith(b"\x89PNG"))
+
+    def test_corrupt_packed_pixels(self):
+        status, body = self.status("/render?path=corrupt.pxlart")
+        self.assertEqual(status, 422)
+        self.assertIn(b"corrupt.pxlart", body)
+
+    def test_malformed_palette_colour(self):
+        status, body = self.status("/render?path=short_colour.pxlart")
+        self.assertEqual(status, 422)
+        self.assertIn(b"short_colour.pxlart", body)
+
+    def test_unexpected_error(self):
+        def fail(*args):
+            raise RuntimeError("renderer bug")
+        original = self.renderer.render
+        self.renderer.render = fail
+        try:
+            with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                status, _ = self.status("/render?path=good.pxlart")
+        finally:
+            self.renderer.render = original
+        self.assertEqual(status, 500)
+        self.assertIn("RuntimeError: renderer bug", stderr.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()